@@ -0,0 +1,302 @@
+"""Benchmarks for the line breaking algorithms.
+
+Runs the algorithms in line_break_from_paper (LINE_BY_LINE,
+LINE_BREAKER, DYNAMIC) and in textflow over a grid of paragraph sizes,
+line widths and word-length distributions, reporting words/sec, peak
+memory and the scaling exponent (the slope of log(time) against
+log(words)) as JSON.
+
+The paragraphs are generated with a fixed random seed, or taken from
+the paper's text (line-breaking-text-formatting.md), so the results
+are reproducible without a network connection.
+
+Usage:
+    python benchmark.py [--quick] [--output FILE] [--compare BASELINE]
+
+With --compare, the results are compared with a previous output of
+this program, and the exit code is 1 if any benchmark is slower by
+more than --threshold.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import line_adjust
+import line_break_from_paper
+import textflow
+
+try:
+    import numpy  # pylint: disable=unused-import
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+PAPER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'line-breaking-text-formatting.md')
+
+SEED = 1981
+
+SIZES = [10, 100, 1_000, 10_000, 100_000, 1_000_000]
+QUICK_SIZES = [10, 100, 1_000, 10_000]
+MAX_WIDTHS = [20, 47, 72, 120]
+QUICK_MAX_WIDTHS = [47]
+
+
+def run_paper_line_by_line(text_words: List[str], max_width: int) -> None:
+    line_break = line_break_from_paper.LineBreak(text_words, max_width)
+    line_break.LINE_BY_LINE()
+
+
+def run_paper_line_breaker(text_words: List[str], max_width: int) -> None:
+    line_break = line_break_from_paper.LineBreak(text_words, max_width)
+    line_break.LINE_BY_LINE()
+    line_break.LINE_BY_LINE_reversed()
+    line_break.LINE_BREAKER()
+
+
+def run_paper_dynamic(text_words: List[str], max_width: int) -> None:
+    line_break = line_break_from_paper.LineBreak(text_words, max_width)
+    line_break.LINE_BY_LINE()
+    line_break.DYNAMIC()
+
+
+def run_paper_dynamic_numpy(text_words: List[str], max_width: int) -> None:
+    line_break = line_break_from_paper.LineBreak(text_words, max_width)
+    line_break.LINE_BY_LINE()
+    line_break.DYNAMIC_numpy()
+
+
+def textflow_runner(line_indexes: textflow.LineIndexesFn) -> Callable[[List[str], int], None]:
+    """Benchmark runner for a textflow algorithm (including creating the Word's)."""
+
+    def run(text_words: List[str], max_width: int) -> None:
+        line_indexes(textflow.split_text_to_words(text_words), max_width, 1)
+
+    return run
+
+
+# name: (runner, maximum number of words it's run with)
+ENGINES: Dict[str, Tuple[Callable[[List[str], int], None], int]] = {
+    'paper.LINE_BY_LINE': (run_paper_line_by_line, 1_000_000),
+    'paper.LINE_BREAKER': (run_paper_line_breaker, 1_000_000),
+    'paper.DYNAMIC': (run_paper_dynamic, 300),  # O(N^3) time, O(N^2) space
+    'paper.DYNAMIC_numpy': (run_paper_dynamic_numpy, 1_000),  # needs NumPy
+    'textflow.line_by_line_indexes': (textflow_runner(textflow.line_by_line_indexes), 1_000_000),
+    'textflow.optimal_line_indexes': (textflow_runner(textflow.optimal_line_indexes), 1_000_000),
+    'textflow.optimal_line_indexes_linear': (
+        textflow_runner(textflow.optimal_line_indexes_linear), 1_000_000),
+}
+
+
+def uniform_words(rand: random.Random, num_words: int) -> List[str]:
+    """Words with lengths uniformly distributed in 1..12."""
+    return ['x' * rand.randint(1, 12) for _ in range(num_words)]
+
+
+def english_words(rand: random.Random, num_words: int) -> List[str]:
+    """Words with lengths approximately distributed as in English text."""
+    lengths = list(range(1, 16))
+    weights = [3, 17, 20, 15, 11, 9, 8, 6, 4, 3, 2, 1, 0.5, 0.3, 0.2]
+    return ['x' * length for length in rand.choices(lengths, weights, k=num_words)]
+
+
+def short_words(rand: random.Random, num_words: int) -> List[str]:
+    """Words of 1 to 3 letters (large slack windows for LINE_BREAKER)."""
+    return ['x' * rand.randint(1, 3) for _ in range(num_words)]
+
+
+def paper_words(rand: random.Random, num_words: int) -> List[str]:
+    """The words of the paper, repeated as needed."""
+    # pylint: disable=unused-argument
+    with open(PAPER_PATH) as paper_file:
+        words = [word for para in line_adjust.split_paragraphs(paper_file.read()) for word in para.split()]
+    return [words[i % len(words)] for i in range(num_words)]
+
+
+DISTRIBUTIONS: Dict[str, Callable[[random.Random, int], List[str]]] = {
+    'uniform': uniform_words,
+    'english': english_words,
+    'short': short_words,
+    'paper': paper_words,
+}
+
+
+def corpus(distribution: str, num_words: int) -> List[str]:
+    """The (deterministic) words for a benchmark."""
+    return DISTRIBUTIONS[distribution](random.Random(f'{SEED}-{distribution}-{num_words}'), num_words)
+
+
+def time_run(run: Callable[[List[str], int], None], text_words: List[str], max_width: int,
+             min_time: float) -> float:
+    """Best time (seconds) for run, repeated until min_time has elapsed (at least 3 times)."""
+    best = math.inf
+    total = 0.0
+    repeats = 0
+    while repeats < 3 or total < min_time:
+        start = time.perf_counter()
+        run(text_words, max_width)
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        repeats += 1
+        if elapsed > min_time:
+            break
+    return best
+
+
+def peak_memory(run: Callable[[List[str], int], None], text_words: List[str], max_width: int) -> int:
+    """Peak memory (bytes) allocated by run."""
+    tracemalloc.start()
+    try:
+        run(text_words, max_width)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run_benchmarks(engines: Iterable[str], distributions: Iterable[str], sizes: Iterable[int],
+                   max_widths: Iterable[int], min_time=0.2, verbose=False) -> Dict[str, Any]:
+    """Run the benchmarks, returning the results (see main)."""
+    results = []
+    for distribution in distributions:
+        for num_words in sizes:
+            text_words = corpus(distribution, num_words)
+            for max_width in max_widths:
+                for engine in engines:
+                    run, engine_max_words = ENGINES[engine]
+                    if num_words > engine_max_words:
+                        continue
+                    if engine == 'paper.DYNAMIC_numpy' and not HAVE_NUMPY:
+                        continue
+                    if verbose:
+                        print(f'{engine} {distribution} words={num_words} width={max_width}',
+                              file=sys.stderr, flush=True)
+                    seconds = time_run(run, text_words, max_width, min_time)
+                    results.append(dict(
+                        engine=engine,
+                        distribution=distribution,
+                        max_width=max_width,
+                        words=num_words,
+                        seconds=seconds,
+                        words_per_sec=num_words / seconds if seconds > 0 else math.inf,
+                        peak_bytes=peak_memory(run, text_words, max_width),
+                    ))
+    return dict(
+        meta=dict(
+            python=platform.python_version(),
+            implementation=platform.python_implementation(),
+            machine=platform.machine(),
+            seed=SEED,
+        ),
+        results=results,
+        scaling=scaling_exponents(results),
+    )
+
+
+def scaling_exponents(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Least-squares slope of log(seconds) against log(words), for each
+    engine, distribution and max_width (1.0 is linear, 3.0 is cubic).
+
+    Sizes under 1000 words are left out if there are enough larger
+    ones, because fixed overheads dominate them.
+    """
+    groups: Dict[Tuple[str, str, int], List[Tuple[int, float]]] = {}
+    for result in results:
+        key = (result['engine'], result['distribution'], result['max_width'])
+        groups.setdefault(key, []).append((result['words'], result['seconds']))
+    scaling = []
+    for (engine, distribution, max_width), points in groups.items():
+        large_points = [(words, seconds) for words, seconds in points if words >= 1000]
+        if len(large_points) >= 2:
+            points = large_points
+        points = [(words, seconds) for words, seconds in points if seconds > 0]
+        if len(points) < 2:
+            continue
+        xs = [math.log(words) for words, _ in points]
+        ys = [math.log(seconds) for _, seconds in points]
+        x_mean = sum(xs) / len(xs)
+        y_mean = sum(ys) / len(ys)
+        slope = (sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) /
+                 sum((x - x_mean) ** 2 for x in xs))
+        scaling.append(dict(engine=engine, distribution=distribution, max_width=max_width,
+                            exponent=slope))
+    return scaling
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Compare results with baseline: returns the regressions, where
+    the time is more than (1 + threshold) times the baseline's."""
+    def key(result):
+        return (result['engine'], result['distribution'], result['max_width'], result['words'])
+
+    baseline_seconds = {key(result): result['seconds'] for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        if key(result) in baseline_seconds and baseline_seconds[key(result)] > 0:
+            ratio = result['seconds'] / baseline_seconds[key(result)]
+            if ratio > 1.0 + threshold:
+                regressions.append(dict(
+                    engine=result['engine'],
+                    distribution=result['distribution'],
+                    max_width=result['max_width'],
+                    words=result['words'],
+                    seconds=result['seconds'],
+                    baseline_seconds=baseline_seconds[key(result)],
+                    ratio=ratio,
+                ))
+    return regressions
+
+
+def main(argv=None) -> int:
+    """Main (uses sys.argv if argv is None)."""
+    parser = argparse.ArgumentParser(description='Benchmark the line breaking algorithms.')
+    parser.add_argument('--quick', action='store_true', help='small grid (up to 10^4 words, width 47)')
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINES),
+                        help='engine to run (can be repeated; default: all)')
+    parser.add_argument('--distribution', action='append', choices=sorted(DISTRIBUTIONS),
+                        help='word length distribution (can be repeated; default: all)')
+    parser.add_argument('--size', action='append', type=int, help='number of words (can be repeated)')
+    parser.add_argument('--width', action='append', type=textflow.line_width, help='line width (can be repeated)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum total seconds for repeating each benchmark')
+    parser.add_argument('--output', '-o', help='file for the JSON results (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown relative to BASELINE (0.2 = 20%%)')
+    parser.add_argument('--verbose', '-v', action='store_true', help='show progress on stderr')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        args.engine or list(ENGINES),
+        args.distribution or list(DISTRIBUTIONS),
+        args.size or (QUICK_SIZES if args.quick else SIZES),
+        args.width or (QUICK_MAX_WIDTHS if args.quick else MAX_WIDTHS),
+        min_time=args.min_time,
+        verbose=args.verbose,
+    )
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            results['regressions'] = compare(results, json.load(baseline_file), args.threshold)
+        if results['regressions']:
+            exit_code = 1
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+            output_file.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""Display widths of text in a fixed-width font (terminal), for textflow.
+
+Most characters take one column, but East Asian wide and fullwidth
+characters (CJK ideographs, kana, hangul, most emoji) take two, and
+combining marks, format characters (such as zero width space) and
+control characters take none. text_width is the number of columns of a
+word; it's what textflow uses as the width of a Word (see
+textflow.text_to_words and textflow.Vocabulary).
+
+The widths of the characters are in a table of ranges (WIDTH_TABLE: the
+first code point of each range, and the width of the code points up to
+the next range), which is searched with bisect; the characters' widths
+are memoized (CHAR_WIDTHS), so each different character is searched
+for once. An ASCII word's width is its length, with no lookups. The
+widths of non-ASCII words are also memoized (MEMO), so that a repeated
+word is measured once.
+
+Some sequences of characters are one glyph, so text_width also handles:
+
+- emoji ZWJ sequences: a character after a zero width joiner (U+200D)
+  is joined to the previous one, so it has no width;
+- emoji presentation: a variation selector-16 (U+FE0F) after a narrow
+  character makes it wide (e.g., U+2764 U+FE0F);
+- emoji modifiers (skin tones, U+1F3FB..U+1F3FF) after a character
+  have no width.
+
+The table is for UNICODE_VERSION, and was generated by build_table
+(run this module to print it). Unassigned code points are given the
+width of the range before them (except in planes 2 and 3, which are
+reserved for CJK ideographs, so they're wide).
+"""
+
+import bisect
+import re
+import sys
+import unicodedata
+from typing import Dict, List, Tuple
+
+# The version of unicodedata that WIDTH_TABLE was generated with
+UNICODE_VERSION = '14.0.0'
+
+# Code points at which the width changes, and the width from there
+# (see build_table)
+WIDTH_TABLE: Tuple[Tuple[int, int], ...] = (
+    (0x00000, 0), (0x00020, 1), (0x0007F, 0), (0x000A0, 1), (0x00300, 0), (0x00370, 1),
+    (0x00483, 0), (0x0048A, 1), (0x00591, 0), (0x005BE, 1), (0x005BF, 0), (0x005C0, 1),
+    (0x005C1, 0), (0x005C3, 1), (0x005C4, 0), (0x005C6, 1), (0x005C7, 0), (0x005D0, 1),
+    (0x00600, 0), (0x00606, 1), (0x00610, 0), (0x0061B, 1), (0x0061C, 0), (0x0061D, 1),
+    (0x0064B, 0), (0x00660, 1), (0x00670, 0), (0x00671, 1), (0x006D6, 0), (0x006DE, 1),
+    (0x006DF, 0), (0x006E5, 1), (0x006E7, 0), (0x006E9, 1), (0x006EA, 0), (0x006EE, 1),
+    (0x0070F, 0), (0x00710, 1), (0x00711, 0), (0x00712, 1), (0x00730, 0), (0x0074D, 1),
+    (0x007A6, 0), (0x007B1, 1), (0x007EB, 0), (0x007F4, 1), (0x007FD, 0), (0x007FE, 1),
+    (0x00816, 0), (0x0081A, 1), (0x0081B, 0), (0x00824, 1), (0x00825, 0), (0x00828, 1),
+    (0x00829, 0), (0x00830, 1), (0x00859, 0), (0x0085E, 1), (0x00890, 0), (0x008A0, 1),
+    (0x008CA, 0), (0x00903, 1), (0x0093A, 0), (0x0093B, 1), (0x0093C, 0), (0x0093D, 1),
+    (0x00941, 0), (0x00949, 1), (0x0094D, 0), (0x0094E, 1), (0x00951, 0), (0x00958, 1),
+    (0x00962, 0), (0x00964, 1), (0x00981, 0), (0x00982, 1), (0x009BC, 0), (0x009BD, 1),
+    (0x009C1, 0), (0x009C7, 1), (0x009CD, 0), (0x009CE, 1), (0x009E2, 0), (0x009E6, 1),
+    (0x009FE, 0), (0x00A03, 1), (0x00A3C, 0), (0x00A3E, 1), (0x00A41, 0), (0x00A59, 1),
+    (0x00A70, 0), (0x00A72, 1), (0x00A75, 0), (0x00A76, 1), (0x00A81, 0), (0x00A83, 1),
+    (0x00ABC, 0), (0x00ABD, 1), (0x00AC1, 0), (0x00AC9, 1), (0x00ACD, 0), (0x00AD0, 1),
+    (0x00AE2, 0), (0x00AE6, 1), (0x00AFA, 0), (0x00B02, 1), (0x00B3C, 0), (0x00B3D, 1),
+    (0x00B3F, 0), (0x00B40, 1), (0x00B41, 0), (0x00B47, 1), (0x00B4D, 0), (0x00B57, 1),
+    (0x00B62, 0), (0x00B66, 1), (0x00B82, 0), (0x00B83, 1), (0x00BC0, 0), (0x00BC1, 1),
+    (0x00BCD, 0), (0x00BD0, 1), (0x00C00, 0), (0x00C01, 1), (0x00C04, 0), (0x00C05, 1),
+    (0x00C3C, 0), (0x00C3D, 1), (0x00C3E, 0), (0x00C41, 1), (0x00C46, 0), (0x00C58, 1),
+    (0x00C62, 0), (0x00C66, 1), (0x00C81, 0), (0x00C82, 1), (0x00CBC, 0), (0x00CBD, 1),
+    (0x00CBF, 0), (0x00CC0, 1), (0x00CC6, 0), (0x00CC7, 1), (0x00CCC, 0), (0x00CD5, 1),
+    (0x00CE2, 0), (0x00CE6, 1), (0x00D00, 0), (0x00D02, 1), (0x00D3B, 0), (0x00D3D, 1),
+    (0x00D41, 0), (0x00D46, 1), (0x00D4D, 0), (0x00D4E, 1), (0x00D62, 0), (0x00D66, 1),
+    (0x00D81, 0), (0x00D82, 1), (0x00DCA, 0), (0x00DCF, 1), (0x00DD2, 0), (0x00DD8, 1),
+    (0x00E31, 0), (0x00E32, 1), (0x00E34, 0), (0x00E3F, 1), (0x00E47, 0), (0x00E4F, 1),
+    (0x00EB1, 0), (0x00EB2, 1), (0x00EB4, 0), (0x00EBD, 1), (0x00EC8, 0), (0x00ED0, 1),
+    (0x00F18, 0), (0x00F1A, 1), (0x00F35, 0), (0x00F36, 1), (0x00F37, 0), (0x00F38, 1),
+    (0x00F39, 0), (0x00F3A, 1), (0x00F71, 0), (0x00F7F, 1), (0x00F80, 0), (0x00F85, 1),
+    (0x00F86, 0), (0x00F88, 1), (0x00F8D, 0), (0x00FBE, 1), (0x00FC6, 0), (0x00FC7, 1),
+    (0x0102D, 0), (0x01031, 1), (0x01032, 0), (0x01038, 1), (0x01039, 0), (0x0103B, 1),
+    (0x0103D, 0), (0x0103F, 1), (0x01058, 0), (0x0105A, 1), (0x0105E, 0), (0x01061, 1),
+    (0x01071, 0), (0x01075, 1), (0x01082, 0), (0x01083, 1), (0x01085, 0), (0x01087, 1),
+    (0x0108D, 0), (0x0108E, 1), (0x0109D, 0), (0x0109E, 1), (0x01100, 2), (0x01160, 0),
+    (0x01200, 1), (0x0135D, 0), (0x01360, 1), (0x01712, 0), (0x01715, 1), (0x01732, 0),
+    (0x01734, 1), (0x01752, 0), (0x01760, 1), (0x01772, 0), (0x01780, 1), (0x017B4, 0),
+    (0x017B6, 1), (0x017B7, 0), (0x017BE, 1), (0x017C6, 0), (0x017C7, 1), (0x017C9, 0),
+    (0x017D4, 1), (0x017DD, 0), (0x017E0, 1), (0x0180B, 0), (0x01810, 1), (0x01885, 0),
+    (0x01887, 1), (0x018A9, 0), (0x018AA, 1), (0x01920, 0), (0x01923, 1), (0x01927, 0),
+    (0x01929, 1), (0x01932, 0), (0x01933, 1), (0x01939, 0), (0x01940, 1), (0x01A17, 0),
+    (0x01A19, 1), (0x01A1B, 0), (0x01A1E, 1), (0x01A56, 0), (0x01A57, 1), (0x01A58, 0),
+    (0x01A61, 1), (0x01A62, 0), (0x01A63, 1), (0x01A65, 0), (0x01A6D, 1), (0x01A73, 0),
+    (0x01A80, 1), (0x01AB0, 0), (0x01B04, 1), (0x01B34, 0), (0x01B35, 1), (0x01B36, 0),
+    (0x01B3B, 1), (0x01B3C, 0), (0x01B3D, 1), (0x01B42, 0), (0x01B43, 1), (0x01B6B, 0),
+    (0x01B74, 1), (0x01B80, 0), (0x01B82, 1), (0x01BA2, 0), (0x01BA6, 1), (0x01BA8, 0),
+    (0x01BAA, 1), (0x01BAB, 0), (0x01BAE, 1), (0x01BE6, 0), (0x01BE7, 1), (0x01BE8, 0),
+    (0x01BEA, 1), (0x01BED, 0), (0x01BEE, 1), (0x01BEF, 0), (0x01BF2, 1), (0x01C2C, 0),
+    (0x01C34, 1), (0x01C36, 0), (0x01C3B, 1), (0x01CD0, 0), (0x01CD3, 1), (0x01CD4, 0),
+    (0x01CE1, 1), (0x01CE2, 0), (0x01CE9, 1), (0x01CED, 0), (0x01CEE, 1), (0x01CF4, 0),
+    (0x01CF5, 1), (0x01CF8, 0), (0x01CFA, 1), (0x01DC0, 0), (0x01E00, 1), (0x0200B, 0),
+    (0x02010, 1), (0x0202A, 0), (0x0202F, 1), (0x02060, 0), (0x02070, 1), (0x020D0, 0),
+    (0x02100, 1), (0x0231A, 2), (0x0231C, 1), (0x02329, 2), (0x0232B, 1), (0x023E9, 2),
+    (0x023ED, 1), (0x023F0, 2), (0x023F1, 1), (0x023F3, 2), (0x023F4, 1), (0x025FD, 2),
+    (0x025FF, 1), (0x02614, 2), (0x02616, 1), (0x02648, 2), (0x02654, 1), (0x0267F, 2),
+    (0x02680, 1), (0x02693, 2), (0x02694, 1), (0x026A1, 2), (0x026A2, 1), (0x026AA, 2),
+    (0x026AC, 1), (0x026BD, 2), (0x026BF, 1), (0x026C4, 2), (0x026C6, 1), (0x026CE, 2),
+    (0x026CF, 1), (0x026D4, 2), (0x026D5, 1), (0x026EA, 2), (0x026EB, 1), (0x026F2, 2),
+    (0x026F4, 1), (0x026F5, 2), (0x026F6, 1), (0x026FA, 2), (0x026FB, 1), (0x026FD, 2),
+    (0x026FE, 1), (0x02705, 2), (0x02706, 1), (0x0270A, 2), (0x0270C, 1), (0x02728, 2),
+    (0x02729, 1), (0x0274C, 2), (0x0274D, 1), (0x0274E, 2), (0x0274F, 1), (0x02753, 2),
+    (0x02756, 1), (0x02757, 2), (0x02758, 1), (0x02795, 2), (0x02798, 1), (0x027B0, 2),
+    (0x027B1, 1), (0x027BF, 2), (0x027C0, 1), (0x02B1B, 2), (0x02B1D, 1), (0x02B50, 2),
+    (0x02B51, 1), (0x02B55, 2), (0x02B56, 1), (0x02CEF, 0), (0x02CF2, 1), (0x02D7F, 0),
+    (0x02D80, 1), (0x02DE0, 0), (0x02E00, 1), (0x02E80, 2), (0x0302A, 0), (0x0302E, 2),
+    (0x0303F, 1), (0x03041, 2), (0x03099, 0), (0x0309B, 2), (0x03248, 1), (0x03250, 2),
+    (0x04DC0, 1), (0x04E00, 2), (0x0A4D0, 1), (0x0A66F, 0), (0x0A673, 1), (0x0A674, 0),
+    (0x0A67E, 1), (0x0A69E, 0), (0x0A6A0, 1), (0x0A6F0, 0), (0x0A6F2, 1), (0x0A802, 0),
+    (0x0A803, 1), (0x0A806, 0), (0x0A807, 1), (0x0A80B, 0), (0x0A80C, 1), (0x0A825, 0),
+    (0x0A827, 1), (0x0A82C, 0), (0x0A830, 1), (0x0A8C4, 0), (0x0A8CE, 1), (0x0A8E0, 0),
+    (0x0A8F2, 1), (0x0A8FF, 0), (0x0A900, 1), (0x0A926, 0), (0x0A92E, 1), (0x0A947, 0),
+    (0x0A952, 1), (0x0A960, 2), (0x0A980, 0), (0x0A983, 1), (0x0A9B3, 0), (0x0A9B4, 1),
+    (0x0A9B6, 0), (0x0A9BA, 1), (0x0A9BC, 0), (0x0A9BE, 1), (0x0A9E5, 0), (0x0A9E6, 1),
+    (0x0AA29, 0), (0x0AA2F, 1), (0x0AA31, 0), (0x0AA33, 1), (0x0AA35, 0), (0x0AA40, 1),
+    (0x0AA43, 0), (0x0AA44, 1), (0x0AA4C, 0), (0x0AA4D, 1), (0x0AA7C, 0), (0x0AA7D, 1),
+    (0x0AAB0, 0), (0x0AAB1, 1), (0x0AAB2, 0), (0x0AAB5, 1), (0x0AAB7, 0), (0x0AAB9, 1),
+    (0x0AABE, 0), (0x0AAC0, 1), (0x0AAC1, 0), (0x0AAC2, 1), (0x0AAEC, 0), (0x0AAEE, 1),
+    (0x0AAF6, 0), (0x0AB01, 1), (0x0ABE5, 0), (0x0ABE6, 1), (0x0ABE8, 0), (0x0ABE9, 1),
+    (0x0ABED, 0), (0x0ABF0, 1), (0x0AC00, 2), (0x0D7B0, 0), (0x0D800, 1), (0x0F900, 2),
+    (0x0FB00, 1), (0x0FB1E, 0), (0x0FB1F, 1), (0x0FE00, 0), (0x0FE10, 2), (0x0FE20, 0),
+    (0x0FE30, 2), (0x0FE70, 1), (0x0FEFF, 0), (0x0FF01, 2), (0x0FF61, 1), (0x0FFE0, 2),
+    (0x0FFE8, 1), (0x0FFF9, 0), (0x0FFFC, 1), (0x101FD, 0), (0x10280, 1), (0x102E0, 0),
+    (0x102E1, 1), (0x10376, 0), (0x10380, 1), (0x10A01, 0), (0x10A10, 1), (0x10A38, 0),
+    (0x10A40, 1), (0x10AE5, 0), (0x10AEB, 1), (0x10D24, 0), (0x10D30, 1), (0x10EAB, 0),
+    (0x10EAD, 1), (0x10F46, 0), (0x10F51, 1), (0x10F82, 0), (0x10F86, 1), (0x11001, 0),
+    (0x11002, 1), (0x11038, 0), (0x11047, 1), (0x11070, 0), (0x11071, 1), (0x11073, 0),
+    (0x11075, 1), (0x1107F, 0), (0x11082, 1), (0x110B3, 0), (0x110B7, 1), (0x110B9, 0),
+    (0x110BB, 1), (0x110BD, 0), (0x110BE, 1), (0x110C2, 0), (0x110D0, 1), (0x11100, 0),
+    (0x11103, 1), (0x11127, 0), (0x1112C, 1), (0x1112D, 0), (0x11136, 1), (0x11173, 0),
+    (0x11174, 1), (0x11180, 0), (0x11182, 1), (0x111B6, 0), (0x111BF, 1), (0x111C9, 0),
+    (0x111CD, 1), (0x111CF, 0), (0x111D0, 1), (0x1122F, 0), (0x11232, 1), (0x11234, 0),
+    (0x11235, 1), (0x11236, 0), (0x11238, 1), (0x1123E, 0), (0x11280, 1), (0x112DF, 0),
+    (0x112E0, 1), (0x112E3, 0), (0x112F0, 1), (0x11300, 0), (0x11302, 1), (0x1133B, 0),
+    (0x1133D, 1), (0x11340, 0), (0x11341, 1), (0x11366, 0), (0x11400, 1), (0x11438, 0),
+    (0x11440, 1), (0x11442, 0), (0x11445, 1), (0x11446, 0), (0x11447, 1), (0x1145E, 0),
+    (0x1145F, 1), (0x114B3, 0), (0x114B9, 1), (0x114BA, 0), (0x114BB, 1), (0x114BF, 0),
+    (0x114C1, 1), (0x114C2, 0), (0x114C4, 1), (0x115B2, 0), (0x115B8, 1), (0x115BC, 0),
+    (0x115BE, 1), (0x115BF, 0), (0x115C1, 1), (0x115DC, 0), (0x11600, 1), (0x11633, 0),
+    (0x1163B, 1), (0x1163D, 0), (0x1163E, 1), (0x1163F, 0), (0x11641, 1), (0x116AB, 0),
+    (0x116AC, 1), (0x116AD, 0), (0x116AE, 1), (0x116B0, 0), (0x116B6, 1), (0x116B7, 0),
+    (0x116B8, 1), (0x1171D, 0), (0x11720, 1), (0x11722, 0), (0x11726, 1), (0x11727, 0),
+    (0x11730, 1), (0x1182F, 0), (0x11838, 1), (0x11839, 0), (0x1183B, 1), (0x1193B, 0),
+    (0x1193D, 1), (0x1193E, 0), (0x1193F, 1), (0x11943, 0), (0x11944, 1), (0x119D4, 0),
+    (0x119DC, 1), (0x119E0, 0), (0x119E1, 1), (0x11A01, 0), (0x11A0B, 1), (0x11A33, 0),
+    (0x11A39, 1), (0x11A3B, 0), (0x11A3F, 1), (0x11A47, 0), (0x11A50, 1), (0x11A51, 0),
+    (0x11A57, 1), (0x11A59, 0), (0x11A5C, 1), (0x11A8A, 0), (0x11A97, 1), (0x11A98, 0),
+    (0x11A9A, 1), (0x11C30, 0), (0x11C3E, 1), (0x11C3F, 0), (0x11C40, 1), (0x11C92, 0),
+    (0x11CA9, 1), (0x11CAA, 0), (0x11CB1, 1), (0x11CB2, 0), (0x11CB4, 1), (0x11CB5, 0),
+    (0x11D00, 1), (0x11D31, 0), (0x11D46, 1), (0x11D47, 0), (0x11D50, 1), (0x11D90, 0),
+    (0x11D93, 1), (0x11D95, 0), (0x11D96, 1), (0x11D97, 0), (0x11D98, 1), (0x11EF3, 0),
+    (0x11EF5, 1), (0x13430, 0), (0x14400, 1), (0x16AF0, 0), (0x16AF5, 1), (0x16B30, 0),
+    (0x16B37, 1), (0x16F4F, 0), (0x16F50, 1), (0x16F8F, 0), (0x16F93, 1), (0x16FE0, 2),
+    (0x16FE4, 0), (0x16FF0, 2), (0x1BC00, 1), (0x1BC9D, 0), (0x1BC9F, 1), (0x1BCA0, 0),
+    (0x1CF50, 1), (0x1D167, 0), (0x1D16A, 1), (0x1D173, 0), (0x1D183, 1), (0x1D185, 0),
+    (0x1D18C, 1), (0x1D1AA, 0), (0x1D1AE, 1), (0x1D242, 0), (0x1D245, 1), (0x1DA00, 0),
+    (0x1DA37, 1), (0x1DA3B, 0), (0x1DA6D, 1), (0x1DA75, 0), (0x1DA76, 1), (0x1DA84, 0),
+    (0x1DA85, 1), (0x1DA9B, 0), (0x1DF00, 1), (0x1E000, 0), (0x1E100, 1), (0x1E130, 0),
+    (0x1E137, 1), (0x1E2AE, 0), (0x1E2C0, 1), (0x1E2EC, 0), (0x1E2F0, 1), (0x1E8D0, 0),
+    (0x1E900, 1), (0x1E944, 0), (0x1E94B, 1), (0x1F004, 2), (0x1F005, 1), (0x1F0CF, 2),
+    (0x1F0D1, 1), (0x1F18E, 2), (0x1F18F, 1), (0x1F191, 2), (0x1F19B, 1), (0x1F200, 2),
+    (0x1F321, 1), (0x1F32D, 2), (0x1F336, 1), (0x1F337, 2), (0x1F37D, 1), (0x1F37E, 2),
+    (0x1F394, 1), (0x1F3A0, 2), (0x1F3CB, 1), (0x1F3CF, 2), (0x1F3D4, 1), (0x1F3E0, 2),
+    (0x1F3F1, 1), (0x1F3F4, 2), (0x1F3F5, 1), (0x1F3F8, 2), (0x1F43F, 1), (0x1F440, 2),
+    (0x1F441, 1), (0x1F442, 2), (0x1F4FD, 1), (0x1F4FF, 2), (0x1F53E, 1), (0x1F54B, 2),
+    (0x1F54F, 1), (0x1F550, 2), (0x1F568, 1), (0x1F57A, 2), (0x1F57B, 1), (0x1F595, 2),
+    (0x1F597, 1), (0x1F5A4, 2), (0x1F5A5, 1), (0x1F5FB, 2), (0x1F650, 1), (0x1F680, 2),
+    (0x1F6C6, 1), (0x1F6CC, 2), (0x1F6CD, 1), (0x1F6D0, 2), (0x1F6D3, 1), (0x1F6D5, 2),
+    (0x1F6E0, 1), (0x1F6EB, 2), (0x1F6F0, 1), (0x1F6F4, 2), (0x1F700, 1), (0x1F7E0, 2),
+    (0x1F800, 1), (0x1F90C, 2), (0x1F93B, 1), (0x1F93C, 2), (0x1F946, 1), (0x1F947, 2),
+    (0x1FA00, 1), (0x1FA70, 2), (0x1FB00, 1), (0x20000, 2), (0xE0001, 0), (0xF0000, 1),
+)
+
+# For bisect: WIDTH_STARTS[i] is the first code point with width WIDTHS[i]
+WIDTH_STARTS: List[int] = [start for start, _ in WIDTH_TABLE]
+WIDTHS = bytes(width for _, width in WIDTH_TABLE)
+
+ZERO_WIDTH_JOINER = '\u200d'
+VARIATION_SELECTOR_16 = '\ufe0f'
+EMOJI_MODIFIERS = range(0x1F3FB, 0x1F400)
+# The characters that can make a sequence one glyph (see module docstring)
+SEQUENCE_RE = re.compile('[\u200d\ufe0f\U0001F3FB-\U0001F3FF]')
+
+# Widths of non-ASCII texts (text_width), emptied when it has
+# MEMO_MAX_ENTRIES entries (as textflow.Vocabulary)
+MEMO_MAX_ENTRIES = 1 << 14
+MEMO: Dict[str, int] = {}
+
+
+def char_width(char: str) -> int:
+    """Number of columns (0, 1 or 2) of a character, from WIDTH_TABLE."""
+    return WIDTHS[bisect.bisect_right(WIDTH_STARTS, ord(char)) - 1]
+
+
+# char_width of the characters seen so far (looking up a character in
+# a dict is several times faster than the binary search), emptied when
+# it has CHAR_WIDTHS_MAX_ENTRIES characters (see add_char_widths)
+CHAR_WIDTHS_MAX_ENTRIES = 1 << 16
+CHAR_WIDTHS: Dict[str, int] = {}
+
+
+def add_char_widths(text: str) -> None:
+    """Add the characters of text to CHAR_WIDTHS."""
+    if len(CHAR_WIDTHS) + len(text) > CHAR_WIDTHS_MAX_ENTRIES:
+        CHAR_WIDTHS.clear()
+    for char in text:
+        if char not in CHAR_WIDTHS:
+            CHAR_WIDTHS[char] = char_width(char)
+
+
+def text_width(text: str) -> int:
+    """Number of columns of text (see module docstring)."""
+    if text.isascii():
+        return len(text)
+    width = MEMO.get(text)
+    if width is None:
+        if len(MEMO) >= MEMO_MAX_ENTRIES:
+            MEMO.clear()
+        width = MEMO[text] = non_ascii_width(text)
+    return width
+
+
+def non_ascii_width(text: str) -> int:
+    """text_width, without the ASCII fast path and the memo."""
+    char_widths = CHAR_WIDTHS
+    try:
+        if SEQUENCE_RE.search(text) is None:
+            return sum(map(char_widths.__getitem__, text))
+    except KeyError:
+        add_char_widths(text)
+        return non_ascii_width(text)
+    add_char_widths(text)
+    width = 0
+    char_w = 0  # width of the previous character
+    prev = ''
+    for char in text:
+        if prev == ZERO_WIDTH_JOINER or (prev and ord(char) in EMOJI_MODIFIERS):
+            char_w = 0  # joined to the previous character
+        elif char == VARIATION_SELECTOR_16:
+            char_w = 1 if char_w == 1 else 0  # the previous character becomes wide
+        else:
+            char_w = char_widths[char]
+        width += char_w
+        prev = char
+    return width
+
+
+def build_table() -> List[Tuple[int, int]]:
+    """WIDTH_TABLE for the unicodedata of this Python (takes about a second).
+
+    A character's width is 0 if it's a nonspacing or enclosing mark,
+    a format or control character (except soft hyphen), or a hangul
+    medial vowel or final consonant; 2 if it's East Asian wide or
+    fullwidth; otherwise 1.
+    """
+    table: List[Tuple[int, int]] = []
+    for code in range(sys.maxunicode + 1):
+        char = chr(code)
+        category = unicodedata.category(char)
+        if category == 'Cn' and table and not 0x20000 <= code <= 0x3FFFD:
+            continue  # unassigned: as the range before it
+        if code == 0xAD:  # soft hyphen
+            width = 1
+        elif category in ('Mn', 'Me', 'Cf', 'Cc') or 0x1160 <= code <= 0x11FF or 0xD7B0 <= code <= 0xD7FF:
+            width = 0
+        elif unicodedata.east_asian_width(char) in ('W', 'F') or 0x20000 <= code <= 0x3FFFD:
+            width = 2
+        else:
+            width = 1
+        if not table or width != table[-1][1]:
+            table.append((code, width))
+    return table
+
+
+def main() -> None:
+    """Print WIDTH_TABLE (for this Python's unicodedata)."""
+    print(f"UNICODE_VERSION = '{unicodedata.unidata_version}'")
+    table = build_table()
+    for i in range(0, len(table), 6):
+        print('    ' + ' '.join(f'(0x{code:05X}, {width}),' for code, width in table[i : i + 6]))
+
+
+if __name__ == '__main__':
+    main()
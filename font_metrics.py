@@ -0,0 +1,398 @@
+"""Word widths for proportional fonts, for use with textflow.
+
+FontMetrics has the advance widths of the characters of a font (in
+font units) and its kerning pairs. It can be loaded (see load_metrics)
+from:
+
+- an AFM (Adobe Font Metrics) file;
+- a TrueType/OpenType font's hmtx table (with cmap for mapping
+  characters to glyphs, and the kern table if there is one - kerning
+  in the GPOS table isn't supported);
+- a JSON file: {"name": ..., "units_per_em": 1000, "default_width": 500,
+  "widths": {"a": 556, ...}, "kerning": {"AV": -70, ...}}
+
+WidthMeasurer measures words in a font at a given size, as a float
+(points, or whatever unit the size is in), or as an int in fixed-point
+units (e.g., fixed_point=64 for 1/64 point). The widths are memoized in
+a WidthCache (bounded, least recently used entries are removed), which
+can be shared by several WidthMeasurer's.
+
+For example:
+
+    measurer = WidthMeasurer(load_metrics('Times-Roman.afm'), 10.0, fixed_point=64)
+    words = measurer.text_to_words(text)
+    lines = textflow.optimal_line_indexes(
+        words, measurer.to_units(300.0), measurer.space_width)
+
+The cost function for optimal line breaks (textflow.line_cost) isn't
+independent of the unit, so the fixed-point and float layouts can
+differ slightly.
+"""
+
+import collections
+import json
+import os
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import textflow
+from textflow import Width, Word
+
+
+class FontMetrics:
+    """The character widths and kerning pairs of a font.
+
+    name: str, identifies the font (for WidthCache)
+    units_per_em: int, font units per em (size)
+    advances: Dict[str, int], advance width (font units) of each character
+    default_advance: int, advance width for characters not in advances
+    kerning: Dict[Tuple[str, str], int], adjustment (font units) between two characters
+    """
+
+    def __init__(
+        self,
+        name: str,
+        units_per_em: int,
+        advances: Dict[str, int],
+        default_advance: int,
+        kerning: Optional[Dict[Tuple[str, str], int]] = None,
+    ) -> None:
+        self.name = name
+        self.units_per_em = units_per_em
+        self.advances = advances
+        self.default_advance = default_advance
+        self.kerning = kerning or {}
+
+    def __repr__(self) -> str:
+        return f'FontMetrics({self.name!r}, {len(self.advances)} chars, {len(self.kerning)} kerning pairs)'
+
+    def text_units(self, text: str) -> int:
+        """Width of text, in font units (including kerning)."""
+        advances = self.advances
+        default_advance = self.default_advance
+        units = sum(advances.get(char, default_advance) for char in text)
+        if self.kerning and len(text) > 1:
+            kerning = self.kerning
+            units += sum(kerning.get(pair, 0) for pair in zip(text, text[1:]))
+        return units
+
+
+class WidthCache:
+    """A memo table of word widths, keyed by (font, size, word).
+
+    The font is the FontMetrics object itself (not its name, which
+    unnamed fonts share), so the cache keeps the fonts alive.
+
+    The least recently used entries are removed when there are more
+    than max_entries.
+
+    hits, misses, evictions: counts of lookups and removals
+    """
+
+    def __init__(self, max_entries: int = 65536) -> None:
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        self.entries: 'collections.OrderedDict[Tuple[Tuple[FontMetrics, float, Optional[int]], str], Width]' = (
+            collections.OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        """Number of entries."""
+        return len(self.entries)
+
+    def get(self, key: Tuple[Tuple[FontMetrics, float, Optional[int]], str]) -> Optional[Width]:
+        """The width for key, or None if it isn't cached (counted as a hit or a miss)."""
+        width = self.entries.get(key)
+        if width is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return width
+
+    def put(self, key: Tuple[Tuple[FontMetrics, float, Optional[int]], str], width: Width) -> None:
+        """Cache the width for key, removing the least recently used
+        entry if there are more than max_entries."""
+        self.entries[key] = width
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss statistics and size of the cache."""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self.entries))
+
+
+class WidthMeasurer:
+    """Measures text in a font at a size, using a WidthCache.
+
+    The widths are floats (size * font units / units_per_em), or, if
+    fixed_point is given, ints in units of 1/fixed_point (rounded).
+    """
+
+    def __init__(
+        self,
+        metrics: FontMetrics,
+        size: float,
+        fixed_point: Optional[int] = None,
+        cache: Optional[WidthCache] = None,
+    ) -> None:
+        self.metrics = metrics
+        self.size = size
+        self.fixed_point = fixed_point
+        self.cache = WidthCache() if cache is None else cache
+        self.font_key = (metrics, size, fixed_point)
+
+    def width(self, text: str) -> Width:
+        """Width of text."""
+        key = (self.font_key, text)
+        width = self.cache.get(key)
+        if width is None:
+            width = self.to_units(self.metrics.text_units(text) * self.size / self.metrics.units_per_em)
+            self.cache.put(key, width)
+        return width
+
+    def to_units(self, length: float) -> Width:
+        """Convert a length (in the unit of size, e.g., a line width in
+        points) to the unit of the widths."""
+        if self.fixed_point is None:
+            return float(length)
+        return round(length * self.fixed_point)
+
+    @property
+    def space_width(self) -> Width:
+        """Width of a space between words."""
+        return self.width(' ')
+
+    def words(self, texts: Iterable[str]) -> List[Word]:
+        """Transform split text into list of Word (as textflow.split_text_to_words)."""
+        width = self.width
+        return [Word(text, width(text)) for text in texts]
+
+    def text_to_words(self, text: str) -> List[Word]:
+        """Split arbitrary text into list of Word (as textflow.text_to_words)."""
+        return self.words(textflow.split_text(text))
+
+
+def load_metrics(path: str) -> FontMetrics:
+    """Load the metrics of a font from an AFM, TrueType/OpenType or JSON file
+    (according to its extension)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.afm':
+        with open(path, encoding='latin-1') as afm_file:
+            return parse_afm(afm_file.read())
+    if ext in ('.ttf', '.otf'):
+        with open(path, 'rb') as font_file:
+            return parse_truetype(font_file.read(), os.path.splitext(os.path.basename(path))[0])
+    if ext == '.json':
+        with open(path) as json_file:
+            return parse_json(json.load(json_file))
+    raise ValueError(f'Unknown font metrics file type: {path!r}')
+
+
+def parse_json(data: Dict) -> FontMetrics:
+    """FontMetrics from the contents of a JSON metrics file (see module docstring)."""
+    kerning = {}
+    for pair, units in data.get('kerning', {}).items():
+        if len(pair) != 2:
+            raise ValueError(f'Kerning pair must be 2 characters: {pair!r}')
+        kerning[(pair[0], pair[1])] = units
+    units_per_em = data.get('units_per_em', 1000)
+    return FontMetrics(
+        data.get('name', ''),
+        units_per_em,
+        dict(data['widths']),
+        data.get('default_width', units_per_em // 2),
+        kerning,
+    )
+
+
+# Characters for AFM glyph names that aren't a single character or uniXXXX.
+GLYPH_NAMES = {
+    'space': ' ', 'exclam': '!', 'quotedbl': '"', 'numbersign': '#', 'dollar': '$',
+    'percent': '%', 'ampersand': '&', 'quotesingle': "'", 'parenleft': '(', 'parenright': ')',
+    'asterisk': '*', 'plus': '+', 'comma': ',', 'hyphen': '-', 'period': '.', 'slash': '/',
+    'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4',
+    'five': '5', 'six': '6', 'seven': '7', 'eight': '8', 'nine': '9',
+    'colon': ':', 'semicolon': ';', 'less': '<', 'equal': '=', 'greater': '>', 'question': '?',
+    'at': '@', 'bracketleft': '[', 'backslash': '\\', 'bracketright': ']', 'asciicircum': '^',
+    'underscore': '_', 'grave': '`', 'braceleft': '{', 'bar': '|', 'braceright': '}',
+    'asciitilde': '~', 'quoteleft': '‘', 'quoteright': '’', 'quotedblleft': '“',
+    'quotedblright': '”', 'endash': '–', 'emdash': '—', 'bullet': '•',
+    'ellipsis': '…', 'dagger': '†', 'daggerdbl': '‡', 'fi': 'ﬁ', 'fl': 'ﬂ',
+}
+
+
+def glyph_char(name: str, code: int) -> Optional[str]:
+    """The character for an AFM glyph name (or code, if the name isn't known)."""
+    if name in GLYPH_NAMES:
+        return GLYPH_NAMES[name]
+    if len(name) == 1:
+        return name
+    if name.startswith('uni') and len(name) == 7:
+        try:
+            return chr(int(name[3:], 16))
+        except ValueError:
+            pass
+    if 32 < code < 127 and code not in (39, 96):  # StandardEncoding is ASCII, except quoteright/quoteleft
+        return chr(code)
+    return None
+
+
+def parse_afm(text: str) -> FontMetrics:
+    """FontMetrics from the contents of an AFM file (C, WX, N in
+    CharMetrics; KPX and KP in KernPairs)."""
+    name = ''
+    advances: Dict[str, int] = {}
+    name_chars: Dict[str, str] = {}
+    default_advance = None
+    kerning: Dict[Tuple[str, str], int] = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'FontName' and len(fields) > 1:
+            name = fields[1]
+        elif fields[0] == 'C':
+            code, advance, glyph_name = -1, None, ''
+            for item in line.split(';'):
+                item_fields = item.split()
+                if len(item_fields) >= 2:
+                    if item_fields[0] == 'C':
+                        code = int(item_fields[1])
+                    elif item_fields[0] in ('WX', 'W0X'):
+                        advance = round(float(item_fields[1]))
+                    elif item_fields[0] == 'N':
+                        glyph_name = item_fields[1]
+            if advance is None:
+                continue
+            if glyph_name == '.notdef':
+                default_advance = advance
+            char = glyph_char(glyph_name, code)
+            if char is not None and char not in advances:
+                advances[char] = advance
+                name_chars[glyph_name] = char
+        elif fields[0] in ('KPX', 'KP') and len(fields) >= 4:
+            left = name_chars.get(fields[1])
+            right = name_chars.get(fields[2])
+            if left is not None and right is not None:
+                kerning[(left, right)] = round(float(fields[3]))
+    if default_advance is None:
+        default_advance = 500  # AFM widths are in 1/1000 em
+    return FontMetrics(name, 1000, advances, default_advance, kerning)
+
+
+def parse_truetype(data: bytes, name: str) -> FontMetrics:
+    """FontMetrics from the contents of a TrueType/OpenType font file
+    (head, hhea, hmtx, cmap and kern tables)."""
+    num_tables, = struct.unpack_from('>H', data, 4)
+    tables = {}
+    for i in range(num_tables):
+        tag, _, offset, length = struct.unpack_from('>4sIII', data, 12 + 16 * i)
+        tables[tag.decode('latin-1')] = (offset, length)
+    for tag in ('head', 'hhea', 'hmtx', 'cmap'):
+        if tag not in tables:
+            raise ValueError(f'Font {name!r} has no {tag} table')
+
+    units_per_em, = struct.unpack_from('>H', data, tables['head'][0] + 18)
+    num_h_metrics, = struct.unpack_from('>H', data, tables['hhea'][0] + 34)
+    glyph_advances = [
+        advance for advance, _ in struct.iter_unpack('>Hh', data[tables['hmtx'][0] : tables['hmtx'][0] + 4 * num_h_metrics])
+    ]
+    char_glyphs = truetype_cmap(data, tables['cmap'][0])
+
+    def glyph_advance(glyph: int) -> int:
+        # glyphs after the last hmetric have its advance
+        return glyph_advances[min(glyph, len(glyph_advances) - 1)]
+
+    advances = {char: glyph_advance(glyph) for char, glyph in char_glyphs.items()}
+    kerning = {}
+    if 'kern' in tables:
+        glyph_kerning = truetype_kern(data, tables['kern'][0])
+        if glyph_kerning:
+            glyph_chars: Dict[int, List[str]] = collections.defaultdict(list)
+            for char, glyph in char_glyphs.items():
+                glyph_chars[glyph].append(char)
+            for (left, right), units in glyph_kerning.items():
+                for left_char in glyph_chars.get(left, ()):
+                    for right_char in glyph_chars.get(right, ()):
+                        kerning[(left_char, right_char)] = units
+    return FontMetrics(name, units_per_em, advances, glyph_advance(0), kerning)
+
+
+def truetype_cmap(data: bytes, cmap_offset: int) -> Dict[str, int]:
+    """The character to glyph mapping in a cmap table (a Unicode subtable
+    of format 12 or 4)."""
+    num_subtables, = struct.unpack_from('>H', data, cmap_offset + 2)
+    subtables = {}
+    for i in range(num_subtables):
+        platform_id, encoding_id, offset = struct.unpack_from('>HHI', data, cmap_offset + 4 + 8 * i)
+        subtable_format, = struct.unpack_from('>H', data, cmap_offset + offset)
+        subtables[(platform_id, encoding_id, subtable_format)] = cmap_offset + offset
+    for key in ((3, 10, 12), (0, 4, 12), (0, 6, 12)):
+        if key in subtables:
+            return cmap_format_12(data, subtables[key])
+    for key in ((3, 1, 4), (0, 3, 4), (0, 2, 4), (0, 1, 4), (0, 0, 4), (3, 0, 4)):
+        if key in subtables:
+            return cmap_format_4(data, subtables[key])
+    raise ValueError('No Unicode cmap subtable of format 4 or 12')
+
+
+def cmap_format_4(data: bytes, offset: int) -> Dict[str, int]:
+    """Character to glyph mapping of a cmap subtable of format 4."""
+    seg_count = struct.unpack_from('>H', data, offset + 6)[0] // 2
+    end_codes = struct.unpack_from(f'>{seg_count}H', data, offset + 14)
+    start_codes = struct.unpack_from(f'>{seg_count}H', data, offset + 16 + 2 * seg_count)
+    id_deltas = struct.unpack_from(f'>{seg_count}h', data, offset + 16 + 4 * seg_count)
+    id_range_offsets_pos = offset + 16 + 6 * seg_count
+    id_range_offsets = struct.unpack_from(f'>{seg_count}H', data, id_range_offsets_pos)
+    char_glyphs = {}
+    for i in range(seg_count):
+        for code in range(start_codes[i], end_codes[i] + 1):
+            if code == 0xFFFF:
+                break
+            if id_range_offsets[i] == 0:
+                glyph = (code + id_deltas[i]) & 0xFFFF
+            else:
+                glyph_pos = id_range_offsets_pos + 2 * i + id_range_offsets[i] + 2 * (code - start_codes[i])
+                glyph, = struct.unpack_from('>H', data, glyph_pos)
+                if glyph:
+                    glyph = (glyph + id_deltas[i]) & 0xFFFF
+            if glyph and not 0xD800 <= code <= 0xDFFF:
+                char_glyphs[chr(code)] = glyph
+    return char_glyphs
+
+
+def cmap_format_12(data: bytes, offset: int) -> Dict[str, int]:
+    """Character to glyph mapping of a cmap subtable of format 12."""
+    num_groups, = struct.unpack_from('>I', data, offset + 12)
+    char_glyphs = {}
+    for start_code, end_code, start_glyph in struct.iter_unpack(
+        '>III', data[offset + 16 : offset + 16 + 12 * num_groups]
+    ):
+        for code in range(start_code, min(end_code, 0x10FFFF) + 1):
+            if not 0xD800 <= code <= 0xDFFF:
+                char_glyphs[chr(code)] = start_glyph + code - start_code
+    return char_glyphs
+
+
+def truetype_kern(data: bytes, kern_offset: int) -> Dict[Tuple[int, int], int]:
+    """Horizontal kerning pairs (of glyphs) in the format 0 subtables of
+    a (Microsoft version 0) kern table."""
+    version, num_subtables = struct.unpack_from('>HH', data, kern_offset)
+    kerning: Dict[Tuple[int, int], int] = {}
+    if version != 0:  # Apple's version 1.0 kern table isn't supported
+        return kerning
+    offset = kern_offset + 4
+    for _ in range(num_subtables):
+        _, length, coverage = struct.unpack_from('>HHH', data, offset)
+        # format 0, horizontal, kerning values (not minimum), not cross-stream
+        if coverage >> 8 == 0 and coverage & 0x7 == 0x1:
+            num_pairs, = struct.unpack_from('>H', data, offset + 6)
+            for left, right, units in struct.iter_unpack('>HHh', data[offset + 14 : offset + 14 + 6 * num_pairs]):
+                kerning[(left, right)] = kerning.get((left, right), 0) + units
+        offset += length
+    return kerning
@@ -0,0 +1,216 @@
+"""Hyphenation with Liang's patterns (as in TeX), for use with textflow.
+
+The patterns are read from a file (see load_hyphenator): a TeX
+hyphenation file (hyph-*.tex, with \\patterns{...} and optionally
+\\hyphenation{...} exceptions), a hyphen/LibreOffice .dic file, or a
+plain list of patterns separated by white space. The patterns are
+compiled into a trie, and the hyphenation points of each word are
+memoized, so repeated words cost a dict lookup.
+
+For example:
+
+    hyphenator = load_hyphenator('hyph-en-us.tex')
+    hyphenator.positions('hyphenation')  # [2, 6]: hy-phen-ation
+    words, breaks = textflow.optimal_line_breaks_hyphenated(
+        words, 47, hyphenate=hyphenator.positions)
+
+American English patterns come with this module (hyph_en_US.dic,
+from the hyphen library, see README_hyph_en_US.txt for their license),
+so default_hyphenator works offline, without any download.
+
+If pyphen is installed (it's an optional dependency: pip install
+pyphen), the .dic files that it comes with can be used instead of a
+pattern file (see pyphen_hyphenator).
+"""
+
+import codecs
+import functools
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# A pattern's letters, and the values before, between and after them
+# (e.g., 'hy3ph' is ('hyph', (0, 0, 3, 0, 0)))
+Pattern = Tuple[str, Tuple[int, ...]]
+
+
+class Hyphenator:
+    """Hyphenation points of words, from Liang's patterns.
+
+    trie: nested dicts of the patterns' letters; the values of a
+        pattern are in its last letter's dict, with key ''
+    exceptions: Dict[str, List[int]], hyphenation points of words
+        that aren't hyphenated by the patterns
+    left_min, right_min: minimum number of letters before the first
+        and after the last hyphenation point (as TeX's
+        \\lefthyphenmin, \\righthyphenmin)
+    """
+
+    def __init__(
+        self,
+        patterns: Iterable[str],
+        exceptions: Iterable[str] = (),
+        left_min: int = 2,
+        right_min: int = 3,
+        max_entries: Optional[int] = 65536,
+    ) -> None:
+        """Compile patterns (e.g., 'hy3ph') and exceptions (e.g., 'ta-ble').
+
+        The hyphenation points of the max_entries most recently used
+        words are memoized (all of them if max_entries is None).
+        """
+        self.trie: Dict = {}
+        for pattern in patterns:
+            self.add_pattern(*parse_pattern(pattern))
+        self.exceptions = {
+            exception.replace('-', '').lower(): exception_positions(exception) for exception in exceptions
+        }
+        self.left_min = left_min
+        self.right_min = right_min
+        self.positions = functools.lru_cache(maxsize=max_entries)(self.word_positions)
+
+    def add_pattern(self, letters: str, values: Tuple[int, ...]) -> None:
+        """Add a pattern to the trie."""
+        node = self.trie
+        for letter in letters:
+            node = node.setdefault(letter, {})
+        node[''] = values
+
+    def word_positions(self, word: str) -> List[int]:
+        """Offsets in word where it can be hyphenated (not memoized -
+        use positions).
+
+        Leading and trailing punctuation is ignored; a word with other
+        non-letters (e.g., 'e-mail', 'x86') isn't hyphenated.
+        """
+        start = 0
+        end = len(word)
+        while start < end and not word[start].isalpha():
+            start += 1
+        while end > start and not word[end - 1].isalpha():
+            end -= 1
+        letters = word[start:end].lower()
+        if len(letters) < self.left_min + self.right_min or not letters.isalpha():
+            return []
+        if letters in self.exceptions:
+            return [start + position for position in self.exceptions[letters]]
+
+        # values[i] is the maximum value between dotted[i-1] and dotted[i]
+        dotted = '.' + letters + '.'
+        values = [0] * (len(dotted) + 1)
+        trie = self.trie
+        for i in range(len(dotted)):
+            node = trie
+            for letter in dotted[i:]:
+                node = node.get(letter)
+                if node is None:
+                    break
+                pattern_values = node.get('')
+                if pattern_values is not None:
+                    for j, value in enumerate(pattern_values, i):
+                        if value > values[j]:
+                            values[j] = value
+        # Offset position in letters is between dotted[position] and dotted[position + 1]
+        return [
+            start + position
+            for position in range(self.left_min, len(letters) - self.right_min + 1)
+            if values[position + 1] % 2 == 1
+        ]
+
+    def hyphenate(self, word: str, hyphen: str = '-') -> str:
+        """word with hyphens at its hyphenation points (for testing patterns)."""
+        parts = []
+        prev = 0
+        for position in self.positions(word):
+            parts.append(word[prev:position])
+            prev = position
+        parts.append(word[prev:])
+        return hyphen.join(parts)
+
+
+def parse_pattern(pattern: str) -> Pattern:
+    """The letters and values of a pattern."""
+    letters = []
+    values = [0]
+    for char in pattern:
+        if char.isdigit():
+            values[-1] = int(char)
+        else:
+            letters.append(char)
+            values.append(0)
+    return ''.join(letters), tuple(values)
+
+
+def exception_positions(exception: str) -> List[int]:
+    """Hyphenation points of an exception (e.g., [2] for 'ta-ble')."""
+    positions = []
+    for part in exception.split('-')[:-1]:
+        positions.append((positions[-1] if positions else 0) + len(part))
+    return positions
+
+
+PATTERN_RE = re.compile(r"^[.']?[^\W\d_]*(?:\d[^\W\d_']*)*'?\.?$")
+TEX_GROUP_RE = re.compile(r'\\(patterns|hyphenation)\s*\{([^}]*)\}')
+
+
+def parse_patterns(text: str) -> Tuple[List[str], List[str]]:
+    """The patterns and exceptions in a pattern file's contents (see
+    module docstring)."""
+    text = '\n'.join(line.split('%', 1)[0] for line in text.splitlines())
+    groups = TEX_GROUP_RE.findall(text)
+    if groups:
+        patterns = [token for name, body in groups if name == 'patterns' for token in body.split()]
+        exceptions = [token for name, body in groups if name == 'hyphenation' for token in body.split()]
+    else:
+        patterns = text.split()
+        exceptions = []
+    # Skip anything that isn't a pattern (e.g., a .dic file's encoding
+    # and LEFTHYPHENMIN lines)
+    patterns = [
+        pattern
+        for pattern in patterns
+        if pattern == pattern.lower() and PATTERN_RE.match(pattern) and any(char.isalpha() for char in pattern)
+    ]
+    return patterns, exceptions
+
+
+def load_hyphenator(path: str, encoding: str = 'utf-8', **kwargs) -> Hyphenator:
+    """Hyphenator with the patterns (and exceptions) in a file (see
+    module docstring); kwargs are passed to Hyphenator."""
+    with open(path, encoding=encoding, errors='replace') as pattern_file:
+        patterns, exceptions = parse_patterns(pattern_file.read())
+    return Hyphenator(patterns, exceptions, **kwargs)
+
+
+# The American English patterns that come with this module
+DEFAULT_PATTERNS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hyph_en_US.dic')
+
+
+def default_hyphenator(**kwargs) -> Hyphenator:
+    """Hyphenator with the American English patterns (DEFAULT_PATTERNS);
+    kwargs are passed to Hyphenator."""
+    return load_hyphenator(DEFAULT_PATTERNS, **kwargs)
+
+
+def pyphen_hyphenator(language: str, **kwargs) -> Hyphenator:
+    """Hyphenator with the patterns of pyphen's dictionary for language
+    (e.g., 'en_US', or 'en', as pyphen.language_fallback); kwargs are
+    passed to Hyphenator. Raises KeyError if there's no dictionary for
+    language.
+
+    Requires pyphen (which is optional, and only used for its .dic files).
+    """
+    import pyphen  # pylint: disable=import-outside-toplevel
+
+    found = pyphen.language_fallback(language)
+    if found is None:
+        raise KeyError(language)
+    path = str(pyphen.LANGUAGES[found])
+    # A .dic file's first line is its encoding (e.g., 'UTF-8' or 'ISO8859-1')
+    with open(path, 'rb') as dic_file:
+        encoding = dic_file.readline().decode('ascii', 'replace').strip()
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = 'utf-8'
+    return load_hyphenator(path, encoding, **kwargs)
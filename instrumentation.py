@@ -0,0 +1,124 @@
+"""Per-paragraph timings and counters for textflow.
+
+When textflow.INSTRUMENTATION is an Instrumentation (see
+textflow.instrument), the formatting functions add to its current
+record, and each paragraph's record is sent to the sinks when the
+paragraph is done (by textflow.format_paragraph or
+textflow.reflow_buffer; otherwise, call end_paragraph). When it's None
+(the default), the cost is a test per paragraph in each function.
+
+The record of a paragraph has these items (if the phase happened):
+
+- time_tokenize: splitting the text into words and measuring them
+- time_layout: computing the line breaks, which includes:
+  - time_greedy: the greedy passes (forward and reversed)
+  - time_slack: the costs of the slacks (optimal_line_starts)
+- time_render: joining the words into lines (or copying them)
+- words, lines: number of words and lines
+- slack_size: total number of words in the slacks
+- slack_iterations: number of iterations of the inner (slack_n1) loop
+  of slack_costs, each of which computes the cost of a line
+- kept_lines: lines that textflow.format_structured_paragraph kept
+  as they were, because they were already laid out
+
+Times are in seconds (time.perf_counter). A sink is a Sink, which
+must implement add(record) (and may implement close()); Aggregator
+keeps totals and maxima in memory, JsonLinesSink writes each record as
+a line of JSON.
+
+For example:
+
+    aggregator = Aggregator()
+    previous = textflow.instrument(Instrumentation([aggregator]))
+    ... format paragraphs ...
+    textflow.instrument(previous)
+    print(aggregator.summary())
+"""
+
+import abc
+import json
+from typing import Dict, Iterable, List, TextIO
+
+# A paragraph's timings and counters
+Record = Dict[str, float]
+
+
+class Instrumentation:
+    """Collects the current paragraph's record, and sends it to sinks
+    (see module docstring)."""
+
+    def __init__(self, sinks: Iterable['Sink']) -> None:
+        self.sinks: List[Sink] = list(sinks)
+        self.record: Record = {}
+
+    def add(self, name: str, value: float) -> None:
+        """Add value to the current record's name item."""
+        self.record[name] = self.record.get(name, 0) + value
+
+    def end_paragraph(self) -> None:
+        """Send the current record to the sinks (if anything was
+        recorded), and start a new one."""
+        if self.record:
+            for sink in self.sinks:
+                sink.add(self.record)
+            self.record = {}
+
+    def close(self) -> None:
+        """end_paragraph, then close the sinks."""
+        self.end_paragraph()
+        for sink in self.sinks:
+            sink.close()
+
+
+class Sink(abc.ABC):
+    """Receives the record of each paragraph."""
+
+    @abc.abstractmethod
+    def add(self, record: Record) -> None:
+        """Process a paragraph's record."""
+
+    def close(self) -> None:
+        """No more records."""
+
+
+class Aggregator(Sink):
+    """Totals and maxima of the records' items, in memory."""
+
+    def __init__(self) -> None:
+        self.paragraphs = 0
+        self.totals: Record = {}
+        self.maxima: Record = {}
+
+    def add(self, record: Record) -> None:
+        self.paragraphs += 1
+        totals = self.totals
+        maxima = self.maxima
+        for name, value in record.items():
+            totals[name] = totals.get(name, 0) + value
+            if value > maxima.get(name, -1):
+                maxima[name] = value
+
+    def summary(self) -> Dict[str, float]:
+        """Number of paragraphs, totals, and maxima (as max_NAME) - for logging."""
+        return {
+            'paragraphs': self.paragraphs,
+            **dict(sorted(self.totals.items())),
+            **{f'max_{name}': value for name, value in sorted(self.maxima.items())},
+        }
+
+
+class JsonLinesSink(Sink):
+    """Writes each record to a file, as a line of JSON (with the
+    paragraph's number, from 0, as "paragraph")."""
+
+    def __init__(self, outfile: TextIO) -> None:
+        self.outfile = outfile
+        self.paragraphs = 0
+
+    def add(self, record: Record) -> None:
+        self.outfile.write(json.dumps({'paragraph': self.paragraphs, **record}))
+        self.outfile.write('\n')
+        self.paragraphs += 1
+
+    def close(self) -> None:
+        self.outfile.flush()
@@ -2,7 +2,7 @@
 
 # pylint: disable=invalid-name
 
-from itertools import chain
+from itertools import chain, islice
 
 
 def lines_of_words(S, W, text_words):
@@ -30,30 +30,32 @@ def line_words(S, W, text_words, i):
 def distribute_spaces(words, max_width, left_to_right):
     """words: list of words in line
     left_to_right: which direction to add blanks
-    Returns: list of lines with blanks inserted
+    Returns: line with blanks inserted
+
+    The blanks are distributed evenly between the words, with the
+    remainder going to the leftmost (or rightmost) gaps; the spaces
+    for each gap are computed arithmetically and the line is built
+    with a single join.
     """
 
-    if len(words) <= 1:
+    num_gaps = len(words) - 1
+    if num_gaps <= 0:
         return ' '.join(words)
 
-    # TODO: make this more functional
-    to_distribute = max_width - len(' '.join(words))
+    to_distribute = max_width - sum(map(len, words)) - num_gaps
+    if to_distribute <= 0:
+        return ' '.join(words)
 
+    base, remainder = divmod(to_distribute, num_gaps)
+    narrow = ' ' * (base + 1)
+    if remainder == 0:
+        return narrow.join(words)
+    wide = narrow + ' '
     if left_to_right:
-        i_range = lambda: range(0, len(words) - 1)
-        pad_word = lambda w: w + ' '
-    else:
-        i_range = lambda: range(len(words) - 1, 0, -1)
-        pad_word = lambda w: ' ' + w
-
-    padded_words = words[:]
-    while to_distribute > 0:
-        for i in i_range():
-            padded_words[i] = pad_word(padded_words[i])
-            to_distribute -= 1
-            if to_distribute <= 0:
-                break
-    return ' '.join(padded_words)
+        # the first remainder gaps are wide
+        return narrow.join([wide.join(words[:remainder + 1]), *words[remainder + 1:]])
+    # the last remainder gaps are wide
+    return wide.join([narrow.join(words[:num_gaps - remainder + 1]), *words[num_gaps - remainder + 1:]])
 
 
 def split_paragraphs(text):
@@ -80,12 +82,23 @@ def pad_lines_list(S_words, max_width):
     """S_words is list of paragraphs, which are lists of words.
     Returns list of adjusted lines."""
 
-    # TODO: S_words[:-1] => islice(S_words, 0, len(S_words)-1)
     adj_words = (distribute_spaces(line, max_width, i % 2 == 0)
-                 for i, line in enumerate(S_words[:-1]))
+                 for i, line in enumerate(islice(S_words, 0, len(S_words)-1)))
     return chain(adj_words, [' '.join(S_words[-1])])
 
 
 def pad_lines(S_words, max_width):
     """pad_lines_list, joined with newlines."""
     return '\n'.join(pad_lines_list(S_words, max_width))
+
+
+def write_padded_lines(S_words, max_width, outfile):
+    """pad_lines_list, written to outfile, each line followed by a newline.
+
+    Unlike pad_lines, the lines aren't joined in memory, so this can
+    be used for large documents (outfile can be buffered).
+    """
+    write = outfile.write
+    for line in pad_lines_list(S_words, max_width):
+        write(line)
+        write('\n')
@@ -11,18 +11,27 @@ not great programming style, but it's convenient.
 
 The code requires Python 3.7 or later, to take advantage of the
 ordering of a dict iterator being the same as collections.OrderedDict.
+
+LineBreakArrays is the same code with the dicts replaced by
+preallocated arrays (with a dummy slot 0), which is several times
+faster, for running the algorithms on large amounts of text.
 """
 
 # pylint: disable=invalid-name,fixme,line-too-long,bad-whitespace,too-many-instance-attributes,missing-function-docstring
 
+import logging
 import sys
-from typing import Dict, List, Tuple
+from array import array
+from typing import Dict, Iterator, List, Tuple
 
 # INFINITE is any number larger than maximum
 INFINITE = sys.float_info.max
 
 assert sys.version_info >= (3, 7)
 
+# Debugging output (e.g., logging.basicConfig(level=logging.DEBUG))
+logger = logging.getLogger(__name__)
+
 
 def from_to(from_i, to_i):
     return range(from_i, to_i + 1)
@@ -170,10 +179,71 @@ class LineBreak:
                             C[(I,J)] = T
         self.C = C
         self.F = F
-        # self.print_C()  # DO NOT SUBMIT
+        if logger.isEnabledFor(logging.DEBUG):
+            self.print_C()
+
+        self.DYNAMIC_S_dyn()
+
+
+    def DYNAMIC_numpy(self):
+        """DYNAMIC, using NumPy arrays for F and C.
+
+        This computes the same C and S_dyn as DYNAMIC, but C and F are
+        NumPy arrays with a dummy row and column 0 (for 1-origin
+        indexing), so self.C[(I,J)] and self.F[(I,J)] work as for the
+        dicts. F is computed from the cumulative widths, and for each
+        row I the min-products over K are computed a row slice at a
+        time, which is about 20 times faster than DYNAMIC for 300 words.
+
+        Assumes LINE_BY_LINE has been called. Requires NumPy.
+        """
+        import numpy as np  # pylint: disable=import-outside-toplevel
 
-        # retrieve optimal starting indices (this is not in the published code)
-        # into self.S_dyn.
+        if len(' '.join(self.text_words)) <= self.D or len(self.text_words) <= 1:
+            # See DYNAMIC
+            self.C = {}
+            self.S_dyn = {1:1}
+            return
+
+        N = self.N
+        W = np.array([0] + [self.W[I] for I in from_to(1, N)], dtype=np.int64)
+        # cum_W[I] = W[1] + ... + W[I]
+        cum_W = np.cumsum(W)
+        I_ = np.arange(N + 1).reshape(-1, 1)
+        J_ = np.arange(N + 1).reshape(1, -1)
+        # F[I,J] = cum_W[J] - cum_W[I-1] + (J - I), upper triangle only
+        F = np.where(J_ >= I_, cum_W[J_] - cum_W[np.maximum(I_ - 1, 0)] + (J_ - I_), 0)
+        F[0, :] = 0
+        C = np.zeros((N + 1, N + 1))
+
+        for I in from_downto(N, 1):
+            row = C[I]
+            row[I] = 1.0 + 1.0 / W[I]  # TODO: see Notes.md#Cost_function
+            if I == N:
+                continue
+            F_row = F[I]
+            # words I to J fit on line for J in I..J_fit
+            J_fit = int(np.searchsorted(F_row[I:], self.D, side='right')) + I - 1
+            row[I+1:J_fit+1] = 1.0 + 1.0 / F_row[I+1:J_fit+1]  # TODO: see Notes.md#Cost_function
+            if J_fit == N:
+                row[N] = 2.0
+                continue
+            # words I to J have to be split, for J in J_fit+1..N:
+            # C[I,J] = min(C[I,K] * C[K+1,J], I <= K < J)  # TODO: see Notes.md#Cost_function_for_line_breaks
+            row[J_fit+1:] = np.inf
+            for K in from_to(I, N - 1):
+                J_from = max(K + 1, J_fit + 1)
+                np.minimum(row[J_from:], row[K] * C[K+1, J_from:], out=row[J_from:])
+
+        self.C = C
+        self.F = F
+        self.DYNAMIC_S_dyn()
+
+
+    def DYNAMIC_S_dyn(self):
+        """Retrieve optimal starting indices from C (this is not in the published code)
+        into self.S_dyn.
+        """
 
         starts = [self.S[self.M]]
         while True:
@@ -192,7 +262,8 @@ class LineBreak:
         # match what LINE_BREAKER does.
         Cs = [(self.C[(1,K-1)]*self.C[(K,end_K)], K) for K in reversed(line_words)]  # TODO: generator
         _, point = min(Cs, key=lambda c_k: c_k[0])
-        # print('***split', (point, self.text_word(point)), 'end_K:', end_K, line_words, 'Cs:', [(c,n,self.text_word(n)) for c,n in Cs], 'F:', {K:self.F[(K,end_K)] for K in from_to(1,end_K)}, 'D:', self.D)  # DO NOT SUBMIT
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('split %s end_K: %s %s Cs: %s F: %s D: %s', (point, self.text_word(point)), end_K, line_words, [(c,n,self.text_word(n)) for c,n in Cs], {K:self.F[(K,end_K)] for K in from_to(1,end_K)}, self.D)
         return point
 
 
@@ -257,7 +328,7 @@ class LineBreak:
                             P2[I+1] = K  # TODO: not in paper
 
         # retrieve optimal starting indices
-        # print('P(1):', dd(self.P))  # DO NOT SUBMIT
+        logger.debug('P(1): %s', self.P)
         self.P[self.M] = self.S[self.M]
         J = self.P[1]
         self.P[1] = 1
@@ -265,9 +336,268 @@ class LineBreak:
             K = self.P[I]
             self.P[I] = J
             J = K
-        # print('P(2):', dd(self.P))  # DO NOT SUBMIT
+        logger.debug('P(2): %s', self.P)
         assert P2 == self.P
-        # print('S_dyn:', dd(self.S_dyn))  # DO NOT SUBMIT
+
+
+class Array1(array):
+    """A 1-origin array (element 0 is a dummy), which can be used like
+    the dicts in LineBreak: keys() are 1..len(), and "in", iteration,
+    items(), values() and == (including with a dict) are as for a dict
+    with those keys. Indexing is array's, so it's as fast."""
+
+    __slots__ = ()
+
+    def __new__(cls, typecode, size, value=0):
+        """Array of size elements (after the dummy element 0), all value."""
+        return super().__new__(cls, typecode, [value] * (size + 1))
+
+    @classmethod
+    def from_list(cls, typecode, values):
+        """Array of values[1:] (values[0] is the dummy element)."""
+        return array.__new__(cls, typecode, values)
+
+    def __len__(self):
+        return super().__len__() - 1
+
+    def keys(self):
+        return range(1, len(self) + 1)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, i):
+        return isinstance(i, int) and 1 <= i <= len(self)
+
+    def values(self):
+        return self[1:].tolist()
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, Array1)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Array1({dict(self.items())})'
+
+
+class Array2:
+    """A 1-origin N by N array, indexed like the (I,J)-keyed dicts in
+    LineBreak. The elements are in a flat array A (row-major, with a
+    dummy row and column 0), so that A[I * (N + 1) + J] is [(I,J)]."""
+
+    __slots__ = ('A', 'N')
+
+    def __init__(self, typecode, N, value=0):
+        self.A = array(typecode, [value]) * ((N + 1) * (N + 1))
+        self.N = N
+
+    def __getitem__(self, I_J):
+        I, J = I_J
+        return self.A[I * (self.N + 1) + J]
+
+    def __setitem__(self, I_J, value):
+        I, J = I_J
+        self.A[I * (self.N + 1) + J] = value
+
+    def keys(self) -> Iterator[Tuple[int, int]]:
+        return ((I, J) for I in from_to(1, self.N) for J in from_to(1, self.N))
+
+    def items(self):
+        return ((I_J, self[I_J]) for I_J in self.keys())
+
+
+class LineBreakArrays:
+    """LineBreak, with arrays (Array1, Array2) instead of dicts.
+
+    The attributes are as for LineBreak (W, S, E, L, P, C, F are Array1
+    or Array2, which can be used as the dicts), and the algorithms
+    compute the same values. CPython indexes a list faster than an
+    array (or a dict), so the linear algorithms work on preallocated
+    lists (copied from the arrays with tolist(), so with the same
+    1-origin indexes) and store their results as arrays. Because M
+    isn't known until LINE_BY_LINE is done, S and L are allocated for N
+    lines and then truncated; LINE_BREAKER's c has an INFINITE cost
+    instead of no entry for the words that aren't in a slack (which
+    doesn't change the comparisons), and doesn't compute the P2
+    cross-check.
+    """
+
+    __slots__ = ('text_words', 'D', 'N', 'W', 'M', 'L', 'E', 'C', 'F', 'S', 'S_dyn', 'P')
+
+    def __init__(self, text_words, D):
+
+        assert all(' ' not in t for t in text_words), text_words
+        self.text_words = text_words
+        self.D = D
+        self.N = len(self.text_words)
+
+        self.W = Array1('l', self.N)
+        for i, word in enumerate(self.text_words, 1):
+            self.W[i] = min(len(word), D)
+        assert all(w > 0 for w in self.W.values())
+
+    text_word = LineBreak.text_word
+
+
+    def LINE_BY_LINE(self):
+        """LineBreak.LINE_BY_LINE"""
+
+        W = self.W.tolist()
+        D = self.D
+        M = 1
+        S = [0] * (self.N + 1)
+        L = [0] * (self.N + 1)
+        S[1] = 1
+        L[1] = W[1]
+
+        for I in from_to(2, self.N):
+            # add next word to current line
+            L[M] = L[M] + 1 + W[I]
+
+            if L[M] > D:
+                L[M] = L[M] - 1 - W[I]
+
+                # start new line
+                M = M + 1
+                S[M] = I
+                L[M] = W[I]
+
+        self.M = M
+        self.S = Array1.from_list('l', S[: M + 1])
+        self.L = Array1.from_list('l', L[: M + 1])
+
+
+    def LINE_BY_LINE_reversed(self):
+        """LineBreak.LINE_BY_LINE_reversed"""
+
+        W = self.W.tolist()
+        D = self.D
+        E = [0] * (self.M + 1)
+        E[1] = 1
+        curr_L = W[self.N]
+        curr_M = self.M  # current line (counting down)
+
+        for I in from_downto(self.N - 1, 1):
+            curr_L = curr_L + 1 + W[I]
+            if curr_L > D:
+                E[curr_M] = I + 1
+                curr_L = W[I]
+                curr_M -= 1
+
+        self.E = Array1.from_list('l', E)
+        assert all(self.E[i] <= self.S[i] for i in self.S)
+
+
+    def DYNAMIC(self):
+        """LineBreak.DYNAMIC"""
+
+        if len(' '.join(self.text_words)) <= self.D or len(self.text_words) <= 1:
+            # See LineBreak.DYNAMIC
+            self.C = {}
+            self.S_dyn = {1:1}
+            return
+
+        N = self.N
+        D = self.D
+        W = self.W
+        R = N + 1  # row length: F[(I,J)] is F_[I * R + J]
+        self.F = Array2('l', N)
+        self.C = Array2('d', N, 0.0)
+        F_ = self.F.A
+        C_ = self.C.A
+        # initialize variables
+        for I in from_to(1, N):
+            F_[I * R + I] = W[I]
+            C_[I * R + I] = 1.0 + 1.0 / W[I]  # TODO: see Notes.md#Cost_function
+
+        # compute upper diagonal of L and C
+        # in reverse row order
+
+        for I in from_downto(N - 1, 1):
+            IR = I * R
+            for J in from_to(I + 1, N):
+                # calculate formatted length
+                F_IJ = F_[IR + J] = F_[IR + J - 1] + W[J] + 1
+                if F_IJ <= D:
+                    # words I to J fit on line
+                    if J == N:
+                        C_[IR + J] = 2.0
+                    else:
+                        C_[IR + J] = 1.0 + 1.0 / F_IJ  # TODO: see Notes.md#Cost_function
+                else:
+                    # words I to J have to be split
+                    C_IJ = C_[IR + I] * C_[(I + 1) * R + J]  # TODO: see Notes.md#Cost_function_for_line_breaks
+                    for K in from_to(I + 1, J - 1):
+                        T = C_[IR + K] * C_[(K + 1) * R + J]  # TODO: see Notes.md#Cost_function_for_line_breaks
+                        if T < C_IJ:
+                            C_IJ = T
+                    C_[IR + J] = C_IJ
+        if logger.isEnabledFor(logging.DEBUG):
+            self.print_C()
+
+        self.DYNAMIC_S_dyn()
+
+    DYNAMIC_numpy = LineBreak.DYNAMIC_numpy
+    DYNAMIC_S_dyn = LineBreak.DYNAMIC_S_dyn
+    split_point = LineBreak.split_point
+    print_C = LineBreak.print_C
+
+
+    def LINE_BREAKER(self):
+        """LineBreak.LINE_BREAKER"""
+
+        W = self.W.tolist()
+        S = self.S.tolist()
+        E = self.E.tolist()
+        L = self.L.tolist()
+        D = self.D
+        M = self.M
+        c = [INFINITE] * (self.N + 1)
+        c[S[M]] = 2.0
+        P = [0] * (M + 1)
+        assert len(S) == len(E)  # TODO: added
+        assert all(S[i] >= E[i] for i in from_to(1, M))  # TODO: added
+
+        # loop on lines backwards
+        for I in from_downto(M - 1, 1):
+            X = L[I] - 1 - W[S[I]]
+
+            # loop over I-th slack
+            for J in from_downto(S[I], E[I]):
+                X = X + 1 + W[J]
+                Y = X + 1 + W[S[I+1]]
+                c[J] = INFINITE
+
+                # loop over (I+1)-th slack
+                for K in from_downto(S[I+1], E[I+1]):
+                    Y = Y - 1 - W[K]
+                    if Y <= D:
+                        # update c[J]
+                        Z = (1.0 + 1.0 / Y) * c[K]  # TODO: see Notes.md#Cost_function
+                        if Z < c[J]:
+                            c[J] = Z
+                            P[I] = K  # <=== TODO: "P[J]" in the original is clearly wrong.
+
+        # retrieve optimal starting indices
+        P[M] = S[M]
+        J = P[1]
+        P[1] = 1
+        for I in from_to(2, M - 1):
+            K = P[I]
+            P[I] = J
+            J = K
+        self.P = Array1.from_list('l', P)
+        logger.debug('P: %s', self.P)
 
 
 # For debugging output of dicts:
@@ -0,0 +1,372 @@
+"""Page breaking for paragraphs formatted by textflow.
+
+page_breaks chooses where the pages of a document break, given the
+layouts of its paragraphs (ParagraphLayouts), minimizing the total
+badness of the pages:
+
+- each page but the last has (page_lines - lines) ** 2 for its unfilled
+  lines (a blank line between paragraphs counts as paragraph_skip
+  lines, except at the top or bottom of a page);
+- widow_penalty if a page starts with the last line of a paragraph (a
+  widow), and orphan_penalty if a page ends with the first line of a
+  paragraph (an orphan);
+- a paragraph can also be laid out with one line more than its
+  optimal layout, to move a line to the next page (the optimal layout
+  has the fewest lines possible, so there's no layout with one line
+  fewer), which adds looseness_penalty times the increase in its cost
+  (see textflow.layout_log_cost).
+
+As the paper does for lines, the number of pages is the fewest
+possible, which is what filling each page with the paragraphs'
+optimal layouts gives. So each page break is in a slack window: no
+later than where filling the pages from the start puts it, and no
+earlier than where filling them from the end does. The least
+badness up to each break in a window is computed from the breaks in
+the previous window (as LINE-BREAKER does for lines, but forwards), so
+the time is linear in the number of lines, plus the sum of the
+products of consecutive windows' sizes (which are at most the number
+of lines left over on the last page). Only the paragraphs in a window
+can have the looser layout, which is computed only for them (see
+ParagraphLayouts.looser).
+
+It can also be run as a command (python pagination.py LINEWIDTH
+PAGELINES), which formats standard input to pages separated by form
+feeds.
+
+For example:
+
+    paragraphs = [ParagraphLayouts(textflow.text_to_words(text), 72) for text in texts]
+    for page in format_pages(paragraphs, page_breaks(paragraphs, 60)):
+        print(page, end='\\f\\n')
+"""
+
+import argparse
+import bisect
+import sys
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import textflow
+from textflow import Width, Word
+
+# Default badness of a page that starts with a paragraph's last line
+WIDOW_PENALTY = 50.0
+
+# Default badness of a page that ends with a paragraph's first line
+ORPHAN_PENALTY = 50.0
+
+# Default badness per unit of cost (sum of logarithms) that a looser
+# layout adds to a paragraph
+LOOSENESS_PENALTY = 100.0
+
+
+class ParagraphLayout(NamedTuple):
+    """A layout of a paragraph."""
+
+    starts: List[int]  # index of the first word of each line
+    cost: float  # textflow.layout_log_cost
+
+
+class ParagraphLayouts:
+    """The layouts of a paragraph that page_breaks can choose from: the
+    optimal one (textflow.optimal_line_starts), and the best one with
+    one more line (textflow.optimal_line_starts_lines), which is only
+    computed when page_breaks needs it."""
+
+    def __init__(self, words: List[Word], max_width: Width, space_width: Width = 1) -> None:
+        """Compute the optimal layout of words."""
+        self.words = words
+        self.line_widths = textflow.LineWidths(words, max_width, space_width)
+        self.starts_fwd = textflow.line_by_line_starts(self.line_widths)
+        self.starts_bck = textflow.line_by_line_reversed_starts(self.line_widths)
+        starts = textflow.optimal_line_starts(self.line_widths, self.starts_fwd, self.starts_bck)
+        self.optimal = ParagraphLayout(starts, textflow.layout_log_cost(self.line_widths, starts))
+        self.looser_layout: Optional[ParagraphLayout] = None
+        self.looser_computed = False
+
+    def looser(self) -> Optional[ParagraphLayout]:
+        """The best layout with one more line than the optimal one, or
+        None if there isn't one (each line has one word)."""
+        if not self.looser_computed:
+            starts = textflow.optimal_line_starts_lines(
+                self.line_widths, len(self.optimal.starts) + 1, self.starts_fwd, self.starts_bck
+            )
+            if starts is not None:
+                self.looser_layout = ParagraphLayout(starts, textflow.layout_log_cost(self.line_widths, starts))
+            self.looser_computed = True
+        return self.looser_layout
+
+    def layout(self, loose: bool) -> ParagraphLayout:
+        """The optimal layout, or the looser one."""
+        layout = self.looser() if loose else self.optimal
+        assert layout is not None
+        return layout
+
+
+class PageBreaks(NamedTuple):
+    """The result of page_breaks."""
+
+    layouts: List[ParagraphLayout]  # the layout of each paragraph
+    pages: List[Tuple[int, int]]  # where each page starts: (paragraph, line)
+    badness: float
+
+
+class BreakStates:
+    """The places where a page can break in a slack window, as
+    parallel lists (see page_breaks).
+
+    A break (paragraph, line, loose) is after the line-th line (from 1)
+    of the paragraph, laid out loosely or not; line can be the last
+    line of the paragraph. With skip for each blank line between
+    paragraphs, and base_starts[p] the number of lines before the p-th
+    paragraph in the optimal layouts, the lines of a page from break A
+    to break B in different paragraphs (with the paragraphs between
+    them in their optimal layouts) are bottom[B] - top[A], where
+
+        bottom = base_starts[paragraph] + line + skip * paragraph
+        top = base_starts[paragraph + 1] - rest + skip * paragraph + (skip if rest == 0 else 0)
+
+    (rest is the number of lines of the paragraph after the break).
+    If they're in the same paragraph, the page has B's line - A's line
+    lines.
+    """
+
+    def __init__(self) -> None:
+        self.paragraphs: List[int] = []
+        self.lines: List[int] = []
+        self.loose: List[bool] = []
+        self.bottoms: List[int] = []
+        self.tops: List[int] = []
+        self.penalties: List[float] = []  # widow or orphan penalty
+        self.loose_penalties: List[float] = []  # looseness penalty (if the paragraph doesn't start before)
+
+    def add(
+        self,
+        paragraph: int,
+        line: int,
+        loose: bool,
+        num_lines: int,
+        base_starts: List[int],
+        skip: int,
+        penalty: float,
+        loose_penalty: float,
+    ) -> None:
+        """Add a break after line of paragraph, which has num_lines lines."""
+        rest = num_lines - line
+        self.paragraphs.append(paragraph)
+        self.lines.append(line)
+        self.loose.append(loose)
+        self.bottoms.append(base_starts[paragraph] + line + skip * paragraph)
+        self.tops.append(base_starts[paragraph + 1] - rest + skip * paragraph + (skip if rest == 0 else 0))
+        self.penalties.append(penalty)
+        self.loose_penalties.append(loose_penalty)
+
+    def __len__(self) -> int:
+        return len(self.paragraphs)
+
+
+def page_breaks(
+    paragraphs: Sequence[ParagraphLayouts],
+    page_lines: int,
+    paragraph_skip: int = 1,
+    widow_penalty: float = WIDOW_PENALTY,
+    orphan_penalty: float = ORPHAN_PENALTY,
+    looseness_penalty: float = LOOSENESS_PENALTY,
+) -> PageBreaks:
+    """Choose the page breaks and the paragraphs' layouts for pages of
+    page_lines lines (see module docstring)."""
+    assert page_lines >= 1
+    skip = paragraph_skip
+    base_lines = [len(paragraph.optimal.starts) for paragraph in paragraphs]
+    base_starts = [0]
+    for num_lines in base_lines:
+        base_starts.append(base_starts[-1] + num_lines)
+    if not paragraphs:
+        return PageBreaks([], [], 0.0)
+
+    # The breaks after each line of the optimal layouts, and where
+    # filling the pages from the start (fwd) and from the end (bck) breaks them
+    base = BreakStates()
+    for paragraph, num_lines in enumerate(base_lines):
+        for line in range(1, num_lines + 1):
+            base.add(paragraph, line, False, num_lines, base_starts, skip, 0.0, 0.0)
+    bottoms = base.bottoms
+    tops = base.tops
+    last = len(base) - 1
+    breaks_fwd = []
+    top = 0
+    while True:
+        state = bisect.bisect_right(bottoms, top + page_lines) - 1
+        if state >= last:
+            break
+        breaks_fwd.append(state)
+        top = tops[state]
+    breaks_bck = []
+    bottom = bottoms[last]
+    while bottom > page_lines:
+        state = bisect.bisect_left(tops, bottom - page_lines)
+        breaks_bck.append(state)
+        bottom = bottoms[state]
+    breaks_bck.reverse()
+    assert len(breaks_fwd) == len(breaks_bck)
+    assert all(bck <= fwd for bck, fwd in zip(breaks_bck, breaks_fwd))
+
+    def layout_lines(paragraph: int, loose: bool) -> int:
+        return len(paragraphs[paragraph].layout(loose).starts)
+
+    def window(first: int, last: int) -> BreakStates:
+        """The breaks from the first to the last base state (inclusive),
+        with a line of margin, and with the breaks of those paragraphs'
+        looser layouts."""
+        states = BreakStates()
+        for paragraph in range(base.paragraphs[first], base.paragraphs[last] + 1):
+            layouts = paragraphs[paragraph]
+            line_from = base.lines[first] - 1 if paragraph == base.paragraphs[first] else 1
+            line_to = base.lines[last] + 1 if paragraph == base.paragraphs[last] else base_lines[paragraph] + 1
+            for loose in (False, True):
+                if loose:
+                    looser = layouts.looser()
+                    if looser is None:
+                        continue
+                    loose_penalty = looseness_penalty * max(looser.cost - layouts.optimal.cost, 0.0)
+                else:
+                    loose_penalty = 0.0
+                num_lines = layout_lines(paragraph, loose)
+                for line in range(max(line_from, 1), min(line_to, num_lines) + 1):
+                    penalty = 0.0
+                    if line < num_lines:
+                        if line == 1:
+                            penalty += orphan_penalty
+                        if line == num_lines - 1:
+                            penalty += widow_penalty
+                    states.add(paragraph, line, loose, num_lines, base_starts, skip, penalty, loose_penalty)
+        return states
+
+    # The start of the document, as a break after paragraph -1
+    windows = [BreakStates()]
+    windows[0].paragraphs.append(-1)
+    windows[0].lines.append(0)
+    windows[0].loose.append(False)
+    windows[0].bottoms.append(0)
+    windows[0].tops.append(0)
+    windows[0].penalties.append(0.0)
+    windows[0].loose_penalties.append(0.0)
+    windows.extend(window(bck, fwd) for bck, fwd in zip(breaks_bck, breaks_fwd))
+    # The end of the document, after the last paragraph in either layout
+    end = window(last, last)
+    windows.append(BreakStates())
+    for i, paragraph in enumerate(end.paragraphs):
+        if end.lines[i] == layout_lines(paragraph, end.loose[i]):
+            windows[-1].add(
+                paragraph, end.lines[i], end.loose[i], end.lines[i], base_starts, skip, 0.0, end.loose_penalties[i]
+            )
+
+    # cost[k][i] is the least badness of the pages up to the i-th break
+    # of the k-th window, whose previous break is previous[k][i]
+    cost = [[0.0]]
+    previous: List[List[int]] = [[0]]
+    for k in range(1, len(windows)):
+        states = windows[k - 1]
+        states_n1 = windows[k]
+        cost_prev = cost[-1]
+        last_page = k == len(windows) - 1
+        window_cost = []
+        window_previous = []
+        for i_n1 in range(len(states_n1)):
+            paragraph_n1 = states_n1.paragraphs[i_n1]
+            line_n1 = states_n1.lines[i_n1]
+            loose_n1 = states_n1.loose[i_n1]
+            bottom_n1 = states_n1.bottoms[i_n1]
+            best_cost = textflow.INFINITE
+            best_i = 0
+            for i, paragraph in enumerate(states.paragraphs):
+                if paragraph == paragraph_n1:
+                    if states.loose[i] != loose_n1 or states.lines[i] >= line_n1:
+                        continue
+                    lines = line_n1 - states.lines[i]
+                    new_cost = cost_prev[i]
+                elif paragraph < paragraph_n1:
+                    lines = bottom_n1 - states.tops[i]
+                    new_cost = cost_prev[i] + states_n1.loose_penalties[i_n1]
+                else:
+                    continue
+                if lines > page_lines:
+                    continue
+                if not last_page:
+                    new_cost += (page_lines - lines) ** 2
+                if new_cost < best_cost:
+                    best_cost = new_cost
+                    best_i = i
+            window_cost.append(best_cost + states_n1.penalties[i_n1])
+            window_previous.append(best_i)
+        cost.append(window_cost)
+        previous.append(window_previous)
+
+    # retrieve the best breaks, from the end
+    best_i = min(range(len(cost[-1])), key=cost[-1].__getitem__)
+    badness = cost[-1][best_i]
+    assert badness < textflow.INFINITE
+    loose_paragraphs = set()
+    pages = []
+    for k in reversed(range(1, len(windows))):
+        states = windows[k]
+        if states.loose[best_i]:
+            loose_paragraphs.add(states.paragraphs[best_i])
+        if k < len(windows) - 1:
+            paragraph = states.paragraphs[best_i]
+            line = states.lines[best_i]
+            if line == layout_lines(paragraph, states.loose[best_i]):
+                pages.append((paragraph + 1, 0))
+            else:
+                pages.append((paragraph, line))
+        best_i = previous[k][best_i]
+    pages.append((0, 0))
+    pages.reverse()
+    layouts = [paragraph.layout(p in loose_paragraphs) for p, paragraph in enumerate(paragraphs)]
+    return PageBreaks(layouts, pages, badness)
+
+
+def format_pages(paragraphs: Sequence[ParagraphLayouts], breaks: PageBreaks, paragraph_skip: int = 1) -> List[str]:
+    """Format the pages of page_breaks, each line ending with a newline
+    (without the blank lines between paragraphs at the top or bottom
+    of a page)."""
+    pages = []
+    for page, (paragraph, line) in enumerate(breaks.pages):
+        end = breaks.pages[page + 1] if page + 1 < len(breaks.pages) else (len(paragraphs), 0)
+        lines: List[str] = []
+        while (paragraph, line) < end:
+            words = paragraphs[paragraph].words
+            starts = breaks.layouts[paragraph].starts
+            if line == 0 and lines:
+                lines.extend([''] * paragraph_skip)
+            stop = end[1] if paragraph == end[0] else len(starts)
+            ends = starts[1:] + [len(words)]
+            for i in range(line, stop):
+                lines.append(' '.join(word.text for word in words[starts[i]:ends[i]]))
+            paragraph, line = paragraph + 1, 0
+        pages.append(''.join(line + '\n' for line in lines))
+    return pages
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Main (uses sys.argv if argv is None)."""
+    parser = argparse.ArgumentParser(
+        description='Reads from standard input, formatting each paragraph to LINEWIDTH characters '
+        'and the paragraphs to pages of PAGELINES lines, separated by form feeds.'
+    )
+    parser.add_argument('max_width', metavar='LINEWIDTH', type=textflow.line_width)
+    parser.add_argument('page_lines', metavar='PAGELINES', type=int)
+    parser.add_argument(
+        '--paragraph-skip', metavar='N', type=int, default=1, help='blank lines between paragraphs'
+    )
+    args = parser.parse_args(argv)
+    paragraphs = [
+        ParagraphLayouts(textflow.text_to_words(text), args.max_width)
+        for text in textflow.split_paragraphs(sys.stdin.read())
+    ]
+    breaks = page_breaks(paragraphs, args.page_lines, args.paragraph_skip)
+    sys.stdout.write('\f\n'.join(format_pages(paragraphs, breaks, args.paragraph_skip)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
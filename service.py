@@ -0,0 +1,393 @@
+"""An asyncio service for formatting text with textflow.
+
+FormatService accepts formatting jobs (text, width, algorithm,
+justify) from coroutines, and formats them without blocking the
+event loop:
+
+- Small jobs are coalesced into batches: while a batch is being
+  formatted (in a thread), the jobs that arrive are queued, and the
+  next batch takes all of them (up to batch_size), so the per-job
+  overhead goes down as the load goes up.
+- Large jobs (at least large_job_size characters) are sent one at a
+  time to a pool of worker processes, with at most 2 jobs per worker
+  in progress.
+- The queue of jobs waiting to be dispatched is bounded (max_queued),
+  so when the service can't keep up, format() waits for room in the
+  queue (backpressure) rather than using more and more memory.
+- The latency of each job (from the call of format() to its result,
+  including the time waiting for room in the queue) is recorded in a
+  LatencyHistogram, one for the batched jobs and one for the pool's.
+
+For example:
+
+    async with FormatService(workers=4) as service:
+        text = await service.format(text, 72, justify=True)
+        print(service.stats())
+
+It can also be run as a server (python service.py --port 8765), which
+reads JSON lines ({"text": ..., "width": ..., "algorithm": ...,
+"justify": ...}, or {"stats": true}) from each connection and writes a
+JSON line for each ({"text": ...} or {"error": ...}, or the stats).
+"""
+
+import argparse
+import asyncio
+import bisect
+import concurrent.futures
+import functools
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+import textflow
+
+ALGORITHMS: Dict[str, textflow.LineIndexesFn] = {
+    'optimal': textflow.optimal_line_breaks,
+    'linear': textflow.optimal_line_breaks_linear,
+    'greedy': textflow.line_by_line_breaks,
+    'greedy_reversed': textflow.line_by_line_reversed_breaks,
+}
+
+# Jobs with at least this many characters are formatted by the worker processes
+LARGE_JOB_SIZE = 1 << 12
+
+
+class Job(NamedTuple):
+    """A formatting job (see format_job)."""
+
+    text: str
+    width: int
+    algorithm: str = 'optimal'
+    justify: bool = False
+
+
+def format_job(job: Job, cache: Optional[textflow.LayoutCache] = None) -> str:
+    """Format each paragraph of job.text (as textflow.format_paragraph),
+    separated by a blank line (as textflow.format_stream)."""
+    line_indexes = ALGORITHMS[job.algorithm]
+    return '\n'.join(
+        textflow.format_paragraph(para, job.width, line_indexes, cache, job.justify)
+        for para in textflow.split_paragraphs(job.text)
+    )
+
+
+def format_jobs(jobs: List[Job], cache: Optional[textflow.LayoutCache] = None) -> List[Union[str, Exception]]:
+    """format_job for each job (with the exception, if it fails)."""
+    results: List[Union[str, Exception]] = []
+    for job in jobs:
+        try:
+            results.append(format_job(job, cache))
+        except Exception as exc:  # pylint: disable=broad-except
+            results.append(exc)
+    return results
+
+
+def format_jobs_in_worker(jobs: List[Job]) -> List[Union[str, Exception]]:
+    """format_jobs in a worker process (with textflow.worker_cache)."""
+    return format_jobs(jobs, textflow.worker_cache)
+
+
+# Upper bounds (in seconds) of the buckets of a LatencyHistogram:
+# 4 per doubling, from 10 microseconds to about 100 seconds
+LATENCY_BUCKETS = [1e-5 * 2 ** (i / 4) for i in range(94)]
+
+
+class LatencyHistogram:
+    """Histogram of latencies, in logarithmic buckets (LATENCY_BUCKETS),
+    so the percentiles are within about 19% (and the max is exact)."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency: float) -> None:
+        """Record a latency (in seconds)."""
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, percent: float) -> float:
+        """The latency that percent of the latencies are at most (the
+        upper bound of its bucket)."""
+        if not self.count:
+            return 0.0
+        rank = percent / 100 * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                if bucket == len(LATENCY_BUCKETS):
+                    return self.max
+                return min(LATENCY_BUCKETS[bucket], self.max)
+        return self.max
+
+    def stats(self) -> Dict[str, float]:
+        """Count, mean, percentiles and max (for logging)."""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+# A job in the queue, with the future for its result
+QueueItem = Tuple[Job, 'asyncio.Future[str]']
+
+
+class FormatService:
+    """Formats jobs from coroutines, batching the small ones and sending
+    the large ones to worker processes (see module docstring).
+
+    Use as an async context manager (or call start and close).
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_queued: int = 1024,
+        batch_size: int = 256,
+        large_job_size: int = LARGE_JOB_SIZE,
+        cache: Optional[textflow.LayoutCache] = None,
+    ) -> None:
+        """workers: number of worker processes (None: number of CPUs; 0:
+            the large jobs are batched too)
+        max_queued: maximum number of jobs waiting to be dispatched
+        batch_size: maximum number of jobs in a batch
+        large_job_size: jobs with at least this many characters are
+            sent to the workers
+        cache: used for the batches; each worker gets its own
+            LayoutCache with the same limits
+        """
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.large_job_size = large_job_size
+        self.cache = cache
+        self.latency = {'batch': LatencyHistogram(), 'pool': LatencyHistogram()}
+        self.batches = 0
+        # Created by start (asyncio objects must be created in the event loop)
+        self.queue: Optional['asyncio.Queue[Optional[QueueItem]]'] = None
+        self.batch_slot: Optional[asyncio.Semaphore] = None
+        self.pool_slots: Optional[asyncio.Semaphore] = None
+        self.dispatcher: Optional['asyncio.Task[None]'] = None
+        self.in_flight: Set['asyncio.Future[List[Union[str, Exception]]]'] = set()
+        self.batch_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    async def __aenter__(self) -> 'FormatService':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        """Start the dispatcher (and the worker processes)."""
+        self.queue = asyncio.Queue(self.max_queued)
+        self.batch_slot = asyncio.Semaphore(1)
+        self.pool_slots = asyncio.Semaphore(2 * self.workers)
+        self.batch_executor = concurrent.futures.ThreadPoolExecutor(1)
+        if self.workers > 0:
+            cache_args = None if self.cache is None else (self.cache.max_entries, self.cache.max_bytes)
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=textflow.init_worker, initargs=(cache_args,)
+            )
+        self.dispatcher = asyncio.create_task(self.dispatch())
+
+    async def close(self) -> None:
+        """Finish the queued jobs, and stop the dispatcher and workers."""
+        assert self.queue is not None and self.dispatcher is not None
+        await self.queue.put(None)
+        await self.dispatcher
+        await asyncio.gather(*self.in_flight, return_exceptions=True)
+        assert self.batch_executor is not None
+        self.batch_executor.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    async def format(self, text: str, width: int, algorithm: str = 'optimal', justify: bool = False) -> str:
+        """Format text (see format_job), waiting if the queue is full."""
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f'Unknown algorithm {algorithm!r} (expected one of {", ".join(ALGORITHMS)})')
+        textflow.check_max_width(width)
+        assert self.queue is not None, 'FormatService not started'
+        start = time.perf_counter()
+        job = Job(text, width, algorithm, justify)
+        future: 'asyncio.Future[str]' = asyncio.get_running_loop().create_future()
+        await self.queue.put((job, future))
+        result = await future
+        self.latency['pool' if self.is_large(job) else 'batch'].add(time.perf_counter() - start)
+        return result
+
+    def is_large(self, job: Job) -> bool:
+        """Whether job is sent to the worker processes (if there are any)."""
+        return self.pool is not None and len(job.text) >= self.large_job_size
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue length, number of batches and latency statistics (for logging)."""
+        return {
+            'queued': self.queue.qsize() if self.queue is not None else 0,
+            'batches': self.batches,
+            **{route: histogram.stats() for route, histogram in self.latency.items()},
+        }
+
+    async def dispatch(self) -> None:
+        """Take jobs from the queue, until None, and send them to be formatted.
+
+        A batch is started only when the previous one is done, so the
+        jobs that arrive in the meantime all go into the next batch.
+        """
+        assert self.queue is not None
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            if self.is_large(item[0]):
+                await self.submit_large(item)
+                continue
+            await self.batch_slot.acquire()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is None:
+                    self.submit(self.batch_executor, self.batch_slot, batch, self.format_batch)
+                    return
+                if self.is_large(item[0]):
+                    await self.submit_large(item)
+                else:
+                    batch.append(item)
+            self.submit(self.batch_executor, self.batch_slot, batch, self.format_batch)
+
+    async def submit_large(self, item: QueueItem) -> None:
+        """Send a large job to a worker process (waiting if they're all busy)."""
+        await self.pool_slots.acquire()
+        self.submit(self.pool, self.pool_slots, [item], format_jobs_in_worker)
+
+    def format_batch(self, jobs: List[Job]) -> List[Union[str, Exception]]:
+        """format_jobs in the batches' thread (with self.cache)."""
+        return format_jobs(jobs, self.cache)
+
+    def submit(
+        self,
+        executor: Optional[concurrent.futures.Executor],
+        slot: asyncio.Semaphore,
+        items: List[QueueItem],
+        fn: Any,
+    ) -> None:
+        """Format the jobs of items with fn in executor, then set their
+        results and release slot (which the caller has acquired)."""
+        if executor is self.batch_executor:
+            self.batches += 1
+        formatted = asyncio.get_running_loop().run_in_executor(executor, fn, [job for job, _ in items])
+        self.in_flight.add(formatted)
+        formatted.add_done_callback(functools.partial(self.set_results, slot, items))
+
+    def set_results(
+        self, slot: asyncio.Semaphore, items: List[QueueItem], formatted: 'asyncio.Future[List[Union[str, Exception]]]'
+    ) -> None:
+        """Set the results of items' futures from formatted (see submit)."""
+        self.in_flight.discard(formatted)
+        slot.release()
+        exc = formatted.exception()
+        results = [exc] * len(items) if exc is not None else formatted.result()
+        for (_, future), result in zip(items, results):
+            if future.done():  # cancelled
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+async def handle_connection(
+    service: FormatService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """Format each JSON line request from reader, writing a JSON line response (see module docstring)."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            response: Dict[str, Any]
+            try:
+                request = json.loads(line)
+                if request.get('stats'):
+                    response = service.stats()
+                else:
+                    response = {
+                        'text': await service.format(
+                            request['text'],
+                            int(request['width']),
+                            request.get('algorithm', 'optimal'),
+                            bool(request.get('justify', False)),
+                        )
+                    }
+            except Exception as exc:  # pylint: disable=broad-except
+                # A bad request, or a bug in formatting it: either way, the
+                # connection (and the service) carry on
+                response = {'error': f'{exc.__class__.__name__}: {exc}'}
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(service: FormatService, host: str, port: int) -> asyncio.AbstractServer:
+    """Start a server for service (see handle_connection)."""
+    return await asyncio.start_server(functools.partial(handle_connection, service), host, port)
+
+
+async def serve_forever(args: argparse.Namespace) -> None:
+    """Run the server for main."""
+    cache = textflow.LayoutCache(args.cache) if args.cache > 0 else None
+    async with FormatService(args.workers, args.queue, args.batch_size, args.large, cache) as service:
+        server = await serve(service, args.host, args.port)
+        print('serving on', ', '.join(str(sock.getsockname()) for sock in server.sockets), file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            print('stats:', json.dumps(service.stats()), file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Main (uses sys.argv if argv is None)."""
+    parser = argparse.ArgumentParser(description='Serves formatting requests (JSON lines over TCP).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument(
+        '--workers', '-j', metavar='N', type=int, default=None,
+        help='number of processes for formatting large jobs (default: number of CPUs)',
+    )
+    parser.add_argument('--queue', metavar='N', type=int, default=1024, help='maximum number of queued jobs')
+    parser.add_argument('--batch-size', metavar='N', type=int, default=256, help='maximum number of jobs in a batch')
+    parser.add_argument(
+        '--large', metavar='N', type=int, default=LARGE_JOB_SIZE,
+        help='jobs of at least N characters are formatted by the worker processes',
+    )
+    parser.add_argument(
+        '--cache', metavar='N', type=int, default=0,
+        help='cache the layouts of up to N distinct paragraphs (in each process)',
+    )
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
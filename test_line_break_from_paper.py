@@ -133,7 +133,6 @@ def main_test():
         print(one_line_words, flush=True)
         for format_width in range(1, len(one_line_words) + 1):
             print(' ', format_width, end='', flush=True)
-            # print('---', 'width:', format_width, list(enumerate(para_words, 1))) # DO NOT SUBMIT
             para_b = line_break_from_paper.LineBreak(para_words, format_width)
             para_b.LINE_BY_LINE()
             para_b.LINE_BY_LINE_reversed()
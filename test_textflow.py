@@ -1,18 +1,76 @@
 """Test the various algorithms in textflow."""
 
+import asyncio
+import contextlib
 import functools
-from typing import List
+import io
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import struct
+import tempfile
+import unicodedata
+from typing import Dict, List, Tuple
 import unittest
+import display_width
+import font_metrics
+import hyphenation
+import instrumentation
+import line_adjust
+import line_break_from_paper
+import pagination
+import service
+import textflow
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pyphen
+except ImportError:
+    pyphen = None
 from textflow import (
+    IncrementalLayout,
+    LayoutCache,
+    LineBreaks,
+    LineRenderer,
+    LineWidths,
+    Vocabulary,
     Word,
     indexes_to_texts,
+    indexes_to_words,
+    line_by_line_breaks,
     line_by_line_indexes,
+    line_by_line_reversed_breaks,
     line_by_line_reversed_indexes,
+    line_by_line_starts,
+    optimal_line_breaks,
+    optimal_line_breaks_hyphenated,
+    optimal_line_breaks_linear,
     optimal_line_indexes,
+    optimal_line_indexes_linear,
     split_text,
     split_text_to_words,
     text_to_text_lines,
     text_to_words,
+    chunk_paragraphs,
+    format_paragraph,
+    format_paragraphs_parallel,
+    format_stream,
+    buffer_paragraphs,
+    check_layout,
+    format_structured_paragraph,
+    join_fenced_paragraphs,
+    WORD_RE,
+    REFLOW_BUFFER_SIZE,
+    main,
+    read_paragraphs,
+    reflow_buffer,
+    reflow_file,
+    split_paragraphs,
 )
 
 
@@ -93,6 +151,67 @@ class TestSplit(unittest.TestCase):
             self.words_Words,
         )
 
+    def test_line_widths(self):
+        line_widths = LineWidths(self.words_Words, self.max_line_width)
+        self.assertEqual(len(line_widths), len(self.words_Words))
+        self.assertEqual(list(line_widths.widths), [2, 3, 10, 7, 6])
+        self.assertEqual(list(line_widths.sums), [0, 3, 7, 18, 26, 33])
+        self.assertEqual(line_widths.span(0, 2), len('He was'))
+        self.assertEqual(line_widths.span(3, 5), len('without cause.'))
+        self.assertEqual(LineWidths(self.words_Words, 20, 2).span(0, 2), len('He  was'))
+        self.assertEqual(len(LineWidths([], self.max_line_width)), 0)
+
+    def test_line_breaks(self):
+        breaks = LineBreaks([0, 2, 3, 4], 5)
+        self.assertEqual(len(breaks), 4)
+        self.assertEqual(list(breaks), [range(0, 2), range(2, 3), range(3, 4), range(4, 5)])
+        self.assertEqual(breaks[0], range(0, 2))
+        self.assertEqual(breaks[-1], range(4, 5))
+        self.assertEqual(breaks.to_lists(), [[0, 1], [2], [3], [4]])
+        self.assertEqual(breaks.to_texts(self.words_Words), self.lines_text)
+        self.assertEqual(breaks.to_words(self.words_Words)[0], self.words_Words[:2])
+        self.assertEqual(LineBreaks([0], 0).to_lists(), [[]])
+
+        for breaks_fn, indexes_fn in [
+            (line_by_line_breaks, line_by_line_indexes),
+            (line_by_line_reversed_breaks, line_by_line_reversed_indexes),
+            (optimal_line_breaks, optimal_line_indexes),
+        ]:
+            for text, max_width in [
+                ('', self.max_line_width),
+                (self.text, self.max_line_width),
+                (self.PAPER_TEXT, self.PAPER_MAX_LINE_WIDTH),
+            ]:
+                words = text_to_words(text)
+                breaks = breaks_fn(words, max_width)
+                self.assertEqual(breaks.to_lists(), indexes_fn(words, max_width))
+                self.assertEqual(
+                    breaks.to_texts(words), indexes_to_texts(breaks_fn, words, max_width)
+                )
+                self.assertEqual(
+                    indexes_to_words(breaks_fn, words, max_width),
+                    indexes_to_words(indexes_fn, words, max_width),
+                )
+
+    def test_vocabulary(self):
+        texts = split_text(self.PAPER_TEXT + ' ' + self.PAPER_TEXT)
+        words = text_to_words(self.PAPER_TEXT + ' ' + self.PAPER_TEXT)
+        self.assertEqual(words, split_text_to_words(texts))
+        self.assertIs(words[0], words[len(words) // 2])
+
+        vocabulary = Vocabulary(max_entries=3, width_fn=lambda text: 2 * len(text))
+        self.assertEqual(vocabulary.words(['ab', 'c', 'ab']), [Word('ab', 4), Word('c', 2), Word('ab', 4)])
+        self.assertEqual(len(vocabulary), 2)
+        vocabulary.words(['d', 'e'])  # 'e' doesn't fit, so the table is emptied
+        self.assertEqual(sorted(vocabulary), ['e'])
+        texts, widths = vocabulary.texts_widths(['ab', 'e', 'ab'])
+        self.assertEqual(texts, ['ab', 'e', 'ab'])
+        self.assertEqual(list(widths), [4, 2, 4])
+        self.assertEqual(
+            line_by_line_starts(LineWidths.from_widths(widths, 6)),
+            list(line_by_line_breaks(vocabulary.words(texts), 6).starts),
+        )
+
     def test_line_by_line(self):
         self.assertEqual(
             line_by_line_indexes(text_to_words(''), self.max_line_width),
@@ -178,6 +297,65 @@ class TestSplit(unittest.TestCase):
             )
         )
 
+    def test_line_by_line_search(self):
+        rand = random.Random(21)
+        saved = textflow.GREEDY_SEARCH_MIN_WORDS
+        try:
+            for _ in range(500):
+                widths = [rand.randint(0, 12) for _ in range(rand.randint(0, 60))]
+                line_widths = LineWidths.from_widths(widths, rand.randint(1, 100), rand.choice([0, 1, 2]))
+                textflow.GREEDY_SEARCH_MIN_WORDS = 10**9  # add up the widths
+                expected = line_by_line_starts(line_widths), textflow.line_by_line_reversed_starts(line_widths)
+                textflow.GREEDY_SEARCH_MIN_WORDS = 0  # search the sums
+                self.assertEqual(
+                    (line_by_line_starts(line_widths), textflow.line_by_line_reversed_starts(line_widths)),
+                    expected,
+                )
+        finally:
+            textflow.GREEDY_SEARCH_MIN_WORDS = saved
+
+    def test_ranked_line_starts(self):
+        rand = random.Random(25)
+        for _ in range(300):
+            widths = [rand.randint(1, 6) for _ in range(rand.randint(1, 9))]
+            line_widths = LineWidths.from_widths(widths, rand.randint(6, 16), rand.choice([0, 1, 2]))
+            fewest = len(line_by_line_starts(line_widths))
+            k = rand.randint(1, 4)
+            costs: Dict[int, List[float]] = {}
+            for num_lines in range(fewest, len(widths) + 1):
+                for breaks in itertools.combinations(range(1, len(widths)), num_lines - 1):
+                    starts = [0, *breaks]
+                    if all(
+                        line_widths.span(start, end) <= line_widths.max_width
+                        for start, end in zip(starts, [*breaks, len(widths)])
+                    ):
+                        costs.setdefault(num_lines - fewest, []).append(
+                            textflow.layout_log_cost(line_widths, starts)
+                        )
+            ranked = textflow.ranked_line_starts(line_widths, range(-1, 4), k)
+            self.assertEqual(sorted(ranked), [-1, 0, 1, 2, 3])
+            self.assertEqual(ranked[-1], [])
+            self.assertAlmostEqual(
+                ranked[0][0][0], textflow.layout_log_cost(line_widths, textflow.optimal_line_starts(line_widths))
+            )
+            for loose in range(4):
+                expected = sorted(costs.get(loose, []))[:k]
+                self.assertEqual(len(ranked[loose]), len(expected))
+                for (cost, starts), expected_cost in zip(ranked[loose], expected):
+                    self.assertEqual(len(starts), fewest + loose)
+                    self.assertAlmostEqual(cost, expected_cost)
+                    self.assertAlmostEqual(textflow.layout_log_cost(line_widths, starts), cost)
+        ranked = textflow.ranked_line_breaks(text_to_words('aaa bb c dd eee'), 7, looseness=[-1, 0], k=2)
+        self.assertEqual(ranked[-1], [])
+        self.assertEqual(
+            [breaks.to_lists() for _, breaks in ranked[0]],
+            [[[0, 1], [2, 3], [4]], [[0], [1, 2, 3], [4]]],
+        )
+        self.assertEqual(ranked[0][0][1].to_lists(), optimal_line_indexes(text_to_words('aaa bb c dd eee'), 7))
+        ranked = textflow.ranked_line_breaks([], 7, looseness=[0, 1])
+        self.assertEqual([(cost, breaks.to_lists()) for cost, breaks in ranked[0]], [(math.log(2), [[]])])
+        self.assertEqual(ranked[1], [])
+
     def test_optimal_lines(self):
         self.assertEqual(
             optimal_line_indexes(text_to_words(''), self.max_line_width),
@@ -216,6 +394,1057 @@ class TestSplit(unittest.TestCase):
         paper_expected_optimal_lines = text_to_list_of_lines(self.PAPER_EXPECTED_TEXT)
         self.assertEqual(paper_optimal_lines, paper_expected_optimal_lines)
 
+    def test_layout_many_widths(self):
+        words = text_to_words(self.PAPER_TEXT)
+        max_widths = [47, 20, 3, 80, 20, 1, 46, 47.5, 12.25]  # unsorted, repeated, clipping words, floats
+        self.assertEqual(
+            [list(breaks.starts) for breaks in textflow.layout_many_widths(words, max_widths)],
+            [list(optimal_line_breaks(words, max_width).starts) for max_width in max_widths],
+        )
+        self.assertEqual(textflow.layout_many_widths(words, []), [])
+        self.assertEqual([list(breaks.starts) for breaks in textflow.layout_many_widths([], [5, 10])], [[0], [0]])
+
+        rand = random.Random(19)
+        for _ in range(500):
+            widths = [rand.randint(1, 12) for _ in range(rand.randint(0, 100))]
+            line_widths = LineWidths.from_widths(widths, rand.randint(1, 50))
+            other_line_widths = LineWidths.from_widths(widths, rand.randint(1, 50))
+            self.assertEqual(
+                textflow.line_by_line_starts_reusing(line_widths, line_by_line_starts(other_line_widths)),
+                line_by_line_starts(line_widths),
+            )
+            self.assertEqual(
+                textflow.line_by_line_reversed_starts_reusing(
+                    line_widths, textflow.line_by_line_reversed_starts(other_line_widths)
+                ),
+                textflow.line_by_line_reversed_starts(line_widths),
+            )
+
+    def test_slack_costs_monotone(self):
+        rand = random.Random(18)
+        cases = [
+            ([Word('a', 1)] * 5001, 1000),  # slacks of about a line
+            ([Word('a', rand.choice([1, 1, 2, 3])) for _ in range(3000)], 500),
+        ]
+        for _ in range(300):
+            words = [Word('w', rand.choice([1, 1, 2, 3, 5, rand.randint(1, 15)])) for _ in range(rand.randint(1, 200))]
+            cases.append((words, rand.randint(5, 80)))
+        aggregator = instrumentation.Aggregator()
+        max_slack_product = textflow.MAX_SLACK_PRODUCT
+        previous = textflow.instrument(instrumentation.Instrumentation([aggregator]))
+        try:
+            for words, max_width in cases:
+                expected = list(optimal_line_breaks(words, max_width).starts)
+                textflow.MAX_SLACK_PRODUCT = 0  # always slack_costs_monotone
+                starts = textflow.optimal_line_starts(LineWidths(words, max_width))
+                textflow.MAX_SLACK_PRODUCT = max_slack_product
+                textflow.INSTRUMENTATION.end_paragraph()
+                self.assertEqual(starts[-1], expected[-1])
+                self.assertAlmostEqual(layout_cost(words, starts, max_width), layout_cost(words, expected, max_width))
+        finally:
+            textflow.MAX_SLACK_PRODUCT = max_slack_product
+            textflow.instrument(previous)
+        summary = aggregator.summary()
+        self.assertGreater(summary['slack_fallbacks'], 0)
+        # Far fewer than the product of the slacks' sizes (about 10 * 500 * 500 for the first case)
+        self.assertLess(summary['max_slack_iterations'], 100_000)
+
+    def test_optimal_lines_linear(self):
+        self.assertEqual(optimal_line_indexes_linear(text_to_words(''), self.max_line_width), [[]])
+        self.assertEqual(optimal_line_indexes_linear(text_to_words('12345'), 5), [[0]])
+        self.assertEqual(
+            indexes_to_texts(optimal_line_indexes_linear, text_to_words(self.text), self.max_line_width),
+            self.lines_text,
+        )
+        self.assertEqual(
+            indexes_to_texts(
+                optimal_line_indexes_linear,
+                text_to_words(self.PAPER_TEXT),
+                self.PAPER_MAX_LINE_WIDTH,
+            ),
+            text_to_list_of_lines(self.PAPER_EXPECTED_TEXT),
+        )
+
+        # Compare with DYNAMIC: the costs must be the same; if several
+        # layouts have the same cost, rounding can decide which one
+        # is picked.
+        text_words = split_text(self.PAPER_TEXT)[:40]
+        words = split_text_to_words(text_words)
+        for max_width in range(1, 60):
+            line_break = line_break_from_paper.LineBreak(text_words, max_width)
+            line_break.LINE_BY_LINE()
+            line_break.DYNAMIC()
+            starts_dyn = [line_break.S_dyn[i] - 1 for i in sorted(line_break.S_dyn)]
+            starts_linear = list(optimal_line_breaks_linear(words, max_width).starts)
+            self.assertAlmostEqual(
+                layout_cost(words, starts_linear, max_width),
+                layout_cost(words, starts_dyn, max_width),
+                msg=dict(max_width=max_width, linear=starts_linear, dyn=starts_dyn),
+            )
+            if len(starts_dyn) == len(line_by_line_indexes(words, max_width)):
+                starts_optimal = list(optimal_line_breaks(words, max_width).starts)
+                self.assertAlmostEqual(
+                    layout_cost(words, starts_optimal, max_width),
+                    layout_cost(words, starts_dyn, max_width),
+                    msg=dict(max_width=max_width, optimal=starts_optimal, dyn=starts_dyn),
+                )
+
+        # A long paragraph
+        rand = random.Random(1)
+        words = [Word('x' * width, width) for width in (rand.randint(1, 12) for _ in range(20000))]
+        lines = optimal_line_indexes_linear(words, 72)
+        self.assertEqual(functools.reduce(lambda total, x: total + x, lines), list(range(len(words))))
+        self.assertTrue(all(len(' '.join(words[i].text for i in line)) <= 72 for line in lines))
+        self.assertLessEqual(len(lines), len(line_by_line_indexes(words, 72)) + 1)
+
+
+class TestLineBreakFromPaper(unittest.TestCase):
+    """Test line_break_from_paper's LineBreak, LineBreakArrays and DYNAMIC_numpy."""
+
+    def test_line_breaker(self):
+        # LINE_BREAKER doesn't need DYNAMIC to have been run (also with debug logging)
+        text_words = split_text(TestSplit.PAPER_TEXT)
+        for cls in line_break_from_paper.LineBreak, line_break_from_paper.LineBreakArrays:
+            for level in logging.INFO, logging.DEBUG:
+                with self.assertLogs(line_break_from_paper.logger, logging.INFO):
+                    line_break_from_paper.logger.info('%s LINE_BREAKER', cls.__name__)
+                    line_break_from_paper.logger.setLevel(level)
+                    try:
+                        line_break = cls(text_words, TestSplit.PAPER_MAX_LINE_WIDTH)
+                        line_break.LINE_BY_LINE()
+                        line_break.LINE_BY_LINE_reversed()
+                        line_break.LINE_BREAKER()
+                    finally:
+                        line_break_from_paper.logger.setLevel(logging.NOTSET)
+                self.assertEqual(
+                    line_adjust.lines_of_words(line_break.P, line_break.W, text_words),
+                    text_to_list_of_lines(TestSplit.PAPER_EXPECTED_TEXT),
+                )
+
+    def test_line_break_arrays(self):
+        # LineBreakArrays must compute the same values as LineBreak.
+        rand = random.Random(22)
+        paper_words = split_text(TestSplit.PAPER_TEXT)
+        for text_words in [paper_words] + [rand.choices(paper_words, k=rand.randint(1, 30)) for _ in range(20)]:
+            for max_width in range(14, 60, 5):  # wider than any word
+                line_break = line_break_from_paper.LineBreak(text_words, max_width)
+                line_break_arrays = line_break_from_paper.LineBreakArrays(text_words, max_width)
+                for line_b in line_break, line_break_arrays:
+                    line_b.LINE_BY_LINE()
+                    line_b.LINE_BY_LINE_reversed()
+                    line_b.DYNAMIC()
+                    line_b.LINE_BREAKER()
+                msg = dict(max_width=max_width, text_words=text_words)
+                for name in 'M', 'W', 'S', 'E', 'L', 'S_dyn', 'P':
+                    self.assertEqual(getattr(line_break_arrays, name), getattr(line_break, name), msg=msg)
+                self.assertEqual(dict(line_break_arrays.C.items()), dict(line_break.C.items()), msg=msg)
+                self.assertEqual(
+                    line_adjust.lines_of_words(line_break_arrays.P, line_break_arrays.W, text_words),
+                    line_adjust.lines_of_words(line_break.P, line_break.W, text_words),
+                )
+
+        array1 = line_break_from_paper.Array1('l', 3)
+        array1[1] = 5
+        self.assertEqual((len(array1), list(array1), array1[1], 3 in array1, 0 in array1), (3, [1, 2, 3], 5, True, False))
+        self.assertEqual(array1, {1: 5, 2: 0, 3: 0})
+        self.assertNotEqual(array1, {1: 5})
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_dynamic_numpy(self):
+        # DYNAMIC_numpy must compute exactly the same C and S_dyn as DYNAMIC.
+        text_words = split_text(TestSplit.PAPER_TEXT)
+        for max_width in range(1, len(TestSplit.PAPER_TEXT) + 1, 3):
+            line_break = line_break_from_paper.LineBreak(text_words, max_width)
+            line_break.LINE_BY_LINE()
+            line_break.DYNAMIC()
+            line_break_numpy = line_break_from_paper.LineBreak(text_words, max_width)
+            line_break_numpy.LINE_BY_LINE()
+            line_break_numpy.DYNAMIC_numpy()
+            self.assertEqual(line_break_numpy.S_dyn, line_break.S_dyn, msg=dict(max_width=max_width))
+            for (i, j), cost in line_break.C.items():
+                self.assertEqual(line_break_numpy.C[(i, j)], cost, msg=dict(max_width=max_width, I=i, J=j))
+
+
+class TestIncrementalLayout(unittest.TestCase):
+    """Test IncrementalLayout."""
+
+    def test_edits(self):
+        words = text_to_words(TestSplit.PAPER_TEXT)
+        layout = IncrementalLayout(words, TestSplit.PAPER_MAX_LINE_WIDTH)
+        self.assertEqual(
+            layout.breaks().to_texts(layout.words),
+            text_to_list_of_lines(TestSplit.PAPER_EXPECTED_TEXT),
+        )
+        layout.insert(0, text_to_words('Nowadays'))
+        layout.delete(1, 2)
+        layout.replace(len(layout) - 1, len(layout), text_to_words('mass communication.'))
+        expected_words = text_to_words('Nowadays ' + TestSplit.PAPER_TEXT.replace('We ', '', 1))
+        expected_words[-1:] = text_to_words('mass communication.')
+        self.assertEqual(layout.words, expected_words)
+        self.assertEqual(
+            layout.breaks(), optimal_line_breaks(expected_words, TestSplit.PAPER_MAX_LINE_WIDTH)
+        )
+
+        layout.delete(0, len(layout))
+        self.assertEqual(layout.breaks(), LineBreaks([0], 0))
+        layout.insert(0, text_to_words('Some words'))
+        self.assertEqual(layout.breaks().to_texts(layout.words), [['Some', 'words']])
+
+    def test_random_edits(self):
+        rand = random.Random(1)
+
+        def random_words(num_words):
+            return [
+                Word('x' * width, width)
+                for width in (rand.choice([1, 2, 3, 4, 6, 9, 14]) for _ in range(num_words))
+            ]
+
+        for _ in range(20):
+            max_width = rand.randint(3, 40)
+            words = random_words(rand.randint(0, 200))
+            layout = IncrementalLayout(words, max_width)
+            for _ in range(20):
+                start = rand.randint(0, len(words))
+                end = min(len(words), start + rand.choice([0, 1, 2, 5]))
+                new_words = random_words(rand.choice([0, 1, 2, 4]))
+                words[start:end] = new_words
+                layout.replace(start, end, new_words)
+                self.assertEqual(layout.words, words)
+                self.assertEqual(layout.breaks(), optimal_line_breaks(words, max_width))
+
+
+class TestLayoutCache(unittest.TestCase):
+    """Test LayoutCache."""
+
+    def test_layout_cache(self):
+        paragraphs = [TestSplit.text, TestSplit.PAPER_TEXT, 'Another paragraph.', TestSplit.text]
+        cache = LayoutCache()
+        for max_width in [10, 47, 10]:
+            for para in paragraphs:
+                self.assertEqual(
+                    text_to_text_lines(optimal_line_indexes, para, max_width, cache=cache),
+                    text_to_text_lines(optimal_line_indexes, para, max_width),
+                )
+        self.assertEqual(cache.stats()['misses'], 6)
+        self.assertEqual(cache.stats()['hits'], 6)
+        self.assertEqual(len(cache), 6)
+
+        # Same widths, different words: same breaks
+        self.assertEqual(
+            text_to_text_lines(line_by_line_breaks, 'ab cd ef', 5, cache=cache),
+            [['ab', 'cd'], ['ef']],
+        )
+        self.assertEqual(
+            text_to_text_lines(line_by_line_breaks, 'gh ij kl', 5, cache=cache),
+            [['gh', 'ij'], ['kl']],
+        )
+        self.assertEqual((cache.hits, cache.misses), (7, 7))
+        # ... but not for a different algorithm or space_width:
+        self.assertEqual(
+            text_to_text_lines(line_by_line_reversed_breaks, 'gh ij kl', 5, cache=cache),
+            [['gh'], ['ij', 'kl']],
+        )
+        self.assertEqual(
+            text_to_text_lines(line_by_line_breaks, 'gh ij kl', 5, space_width=3, cache=cache),
+            [['gh'], ['ij'], ['kl']],
+        )
+        self.assertEqual((cache.hits, cache.misses), (7, 9))
+
+    def test_layout_cache_eviction(self):
+        cache = LayoutCache(max_entries=2)
+        words = [text_to_words(text) for text in ['a', 'bb', 'ccc']]
+        for word in words:
+            cache.line_breaks(optimal_line_breaks, word, 10)
+        self.assertEqual(cache.stats(), dict(hits=0, misses=3, evictions=1, entries=2, bytes=cache.num_bytes))
+        cache.line_breaks(optimal_line_breaks, words[1], 10)  # 'bb' is now most recently used
+        cache.line_breaks(optimal_line_breaks, words[0], 10)  # evicts 'ccc'
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 4, 2))
+        cache.line_breaks(optimal_line_breaks, words[1], 10)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 4, 2))
+
+        cache = LayoutCache(max_bytes=2 * LayoutCache.ENTRY_OVERHEAD + 100)
+        for word in words:
+            cache.line_breaks(optimal_line_breaks, word, 10)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.num_bytes, cache.max_bytes)
+
+
+class TestDisplayWidth(unittest.TestCase):
+    """Test display_width."""
+
+    def test_text_width(self):
+        for text, width in [
+            ('', 0),
+            ('word', 4),
+            ('Ünïcödé', 7),
+            ('e\u0301', 1),  # combining acute accent
+            ('日本語', 6),
+            ('ｆｕｌｌ', 8),
+            ('한국어', 6),
+            ('a\u200bb', 2),  # zero width space
+            ('\U0001F600', 2),
+            ('\u2764\ufe0f', 2),  # emoji presentation
+            ('\U0001F44D\U0001F3FD', 2),  # skin tone modifier
+            ('\U0001F468\u200d\U0001F469\u200d\U0001F467', 2),  # ZWJ sequence
+            ('\U0001F1EF\U0001F1F5', 2),  # flag
+            ('\U00020000', 2),
+        ]:
+            self.assertEqual(display_width.text_width(text), width, msg=text)
+            self.assertEqual(display_width.text_width(text), width, msg=text)  # memoized
+        self.assertEqual(display_width.char_width('\x00'), 0)
+        self.assertEqual(display_width.char_width('\u00ad'), 1)  # soft hyphen
+
+        table = display_width.WIDTH_TABLE
+        self.assertEqual(table[0][0], 0)
+        self.assertTrue(all(start < next_start for (start, _), (next_start, _) in zip(table, table[1:])))
+        self.assertTrue(all(width != next_width for (_, width), (_, next_width) in zip(table, table[1:])))
+        if unicodedata.unidata_version == display_width.UNICODE_VERSION:
+            self.assertEqual(tuple(display_width.build_table()), table)
+
+        self.assertEqual(text_to_words('日本語 text'), [Word('日本語', 6), Word('text', 4)])
+        self.assertEqual(split_text_to_words(['é', '漢字']), [Word('é', 1), Word('漢字', 4)])
+        self.assertEqual(format_paragraph('日本語の 文章は 幅が 二倍です', 12), '日本語の\n文章は 幅が\n二倍です\n')
+
+
+    def test_zero_width_words(self):
+        # A word of display width 0 is laid out with width 1, so that a
+        # line of it doesn't have an infinite cost
+        self.assertEqual(display_width.text_width('\u200b'), 0)
+        self.assertEqual(text_to_words('a \u200b b')[1], Word('\u200b', 1))
+        self.assertEqual(split_text_to_words(['\u0301']), [Word('\u0301', 1)])
+        self.assertEqual(optimal_line_indexes(text_to_words('a \u200b b'), 1), [[0], [1], [2]])
+        self.assertEqual(optimal_line_indexes(text_to_words('aa \u0301 bb cc'), 2), [[0], [1], [2], [3]])
+        self.assertEqual(format_paragraph('aa \u0301 bb cc', 2), 'aa\n\u0301\nbb\ncc\n')
+
+
+class TestFontMetrics(unittest.TestCase):
+    """Test font_metrics and float widths."""
+
+    AFM = '\n'.join([
+        'StartFontMetrics 4.1',
+        'FontName Test-Roman',
+        'StartCharMetrics 5',
+        'C -1 ; WX 600 ; N .notdef ; B 0 0 0 0 ;',
+        'C 32 ; WX 250 ; N space ; B 0 0 0 0 ;',
+        'C 65 ; WX 722 ; N A ; B 15 0 706 674 ;',
+        'C 86 ; WX 722 ; N V ; B 16 -11 697 662 ;',
+        'C 39 ; WX 333 ; N quoteright ; B 79 433 218 676 ;',
+        'EndCharMetrics',
+        'StartKernData',
+        'StartKernPairs 2',
+        'KPX A V -135',
+        'KPX V A -105',
+        'EndKernPairs',
+        'EndKernData',
+        'EndFontMetrics',
+    ])
+
+    def test_afm(self):
+        metrics = font_metrics.parse_afm(self.AFM)
+        self.assertEqual(metrics.name, 'Test-Roman')
+        self.assertEqual(metrics.advances, {' ': 250, 'A': 722, 'V': 722, '\u2019': 333})
+        self.assertEqual(metrics.default_advance, 600)
+        self.assertEqual(metrics.text_units('AVA'), 3 * 722 - 135 - 105)
+        self.assertEqual(metrics.text_units('AxV'), 722 + 600 + 722)
+
+    def test_truetype(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'Test.ttf')
+            with open(path, 'wb') as font_file:
+                font_file.write(truetype_font(
+                    2048, [1000, 500, 1200, 1300], {' ': 1, 'A': 2, 'V': 3}, {(2, 3): -150}))
+            metrics = font_metrics.load_metrics(path)
+        self.assertEqual(metrics.name, 'Test')
+        self.assertEqual(metrics.units_per_em, 2048)
+        self.assertEqual(metrics.advances, {' ': 500, 'A': 1200, 'V': 1300})
+        self.assertEqual(metrics.default_advance, 1000)
+        self.assertEqual(metrics.kerning, {('A', 'V'): -150})
+        measurer = font_metrics.WidthMeasurer(metrics, 20.48)
+        self.assertAlmostEqual(measurer.width('AVx'), 12.0 + 13.0 - 1.5 + 10.0)
+
+    def test_measurer(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'test.json')
+            with open(path, 'w') as json_file:
+                json.dump(dict(name='test', units_per_em=1000, default_width=500,
+                               widths={' ': 250, 'a': 400, 'b': 600, 'T': 700, 'o': 500},
+                               kerning={'To': -100}), json_file)
+            metrics = font_metrics.load_metrics(path)
+        cache = font_metrics.WidthCache(max_entries=3)
+        measurer = font_metrics.WidthMeasurer(metrics, 12.0, cache=cache)
+        self.assertEqual(measurer.text_to_words('ab To ab'),
+                         [Word('ab', 12.0), Word('To', 13.2), Word('ab', 12.0)])
+        self.assertEqual(cache.stats(), dict(hits=1, misses=2, evictions=0, entries=2))
+        fixed_measurer = font_metrics.WidthMeasurer(metrics, 12.0, fixed_point=64, cache=cache)
+        self.assertEqual(fixed_measurer.words(['ab', 'To']), [Word('ab', 768), Word('To', 845)])
+        self.assertEqual(cache.stats(), dict(hits=1, misses=4, evictions=1, entries=3))
+        self.assertEqual(fixed_measurer.space_width, 192)
+        self.assertEqual(fixed_measurer.to_units(72.0), 4608)
+        with self.assertRaises(ValueError):
+            font_metrics.load_metrics('font.pfb')
+
+    def test_measurer_unnamed_fonts(self):
+        # Fonts without names share a cache without sharing widths
+        narrow = font_metrics.parse_json(dict(widths={}, default_width=500))
+        wide = font_metrics.parse_json(dict(widths={}, default_width=1000))
+        self.assertEqual(narrow.name, wide.name)
+        cache = font_metrics.WidthCache()
+        self.assertEqual(font_metrics.WidthMeasurer(narrow, 10.0, cache=cache).width('ab'), 10.0)
+        self.assertEqual(font_metrics.WidthMeasurer(wide, 10.0, cache=cache).width('ab'), 20.0)
+        self.assertEqual(cache.stats(), dict(hits=0, misses=2, evictions=0, entries=2))
+
+    def test_width_cache(self):
+        cache = font_metrics.WidthCache(max_entries=2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', 1.0)
+        cache.put('b', 2.0)
+        self.assertEqual(cache.get('a'), 1.0)
+        cache.put('c', 3.0)  # removes 'b', the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get('a'), cache.get('c')], [1.0, 3.0])
+        self.assertEqual(cache.stats(), dict(hits=3, misses=2, evictions=1, entries=2))
+
+    def test_float_widths(self):
+        # Integral float widths give the same breaks as ints
+        rand = random.Random(2)
+        for _ in range(50):
+            widths = [rand.randint(1, 12) for _ in range(rand.randint(1, 100))]
+            max_width = rand.randint(12, 40)
+            words = [Word('x', width) for width in widths]
+            float_words = [Word('x', float(width)) for width in widths]
+            for line_indexes in (line_by_line_indexes, optimal_line_indexes, optimal_line_indexes_linear):
+                self.assertEqual(line_indexes(float_words, float(max_width), 1.0),
+                                 line_indexes(words, max_width))
+
+        # Widths that aren't exact in binary (e.g., 0.1) mustn't make the
+        # greedy and optimal passes disagree on which lines fit
+        for _ in range(50):
+            float_words = [Word('x', rand.choice([0.1, 0.2, 0.3, 1.7])) for _ in range(rand.randint(1, 200))]
+            max_width = rand.choice([1.0, 2.3, 3.3])
+            space_width = rand.choice([0.1, 0.25])
+            lines = optimal_line_indexes(float_words, max_width, space_width)
+            self.assertEqual(len(lines), len(line_by_line_indexes(float_words, max_width, space_width)))
+            self.assertEqual(sum(len(line) for line in lines), len(float_words))
+            for line in lines:
+                line_len = sum(float_words[i].width_min(max_width) for i in line) + space_width * (len(line) - 1)
+                self.assertLessEqual(line_len, max_width + 1e-9)
+            self.assertEqual(optimal_line_breaks(float_words, max_width, space_width),
+                             IncrementalLayout(float_words, max_width, space_width).breaks())
+
+    def test_fixed_point_widths(self):
+        # 16.16 fixed-point widths give the same breaks as ints (without
+        # computing the costs of every line length up to max_width)
+        words = text_to_words(TestSplit.PAPER_TEXT)
+        fixed_words = [Word(word.text, word[1] << 16) for word in words]
+        for max_width in [*range(20, 120, 7), 300]:
+            for line_indexes in (line_by_line_indexes, optimal_line_indexes):
+                self.assertEqual(line_indexes(fixed_words, max_width << 16, 1 << 16),
+                                 line_indexes(words, max_width), msg=dict(max_width=max_width))
+        self.assertEqual(optimal_line_indexes(fixed_words[:60], 300 << 16, 1 << 16),
+                         optimal_line_indexes(words[:60], 300))
+
+
+class TestHyphenation(unittest.TestCase):
+    """Test hyphenation and optimal_line_breaks_hyphenated."""
+
+    # The example from Liang's thesis
+    PATTERNS = ['hy3ph', 'he2n', 'hena4', 'hen5at', '1na', 'n2at', '1tio', '2io', 'o2n']
+
+    def test_hyphenator(self):
+        hyphenator = hyphenation.Hyphenator(self.PATTERNS, ['ta-ble'])
+        self.assertEqual(hyphenator.positions('hyphenation'), [2, 6])
+        self.assertEqual(hyphenator.hyphenate('hyphenation'), 'hy-phen-ation')
+        self.assertEqual(hyphenator.hyphenate('(Hyphenation),'), '(Hy-phen-ation),')
+        self.assertEqual(hyphenator.hyphenate('tables'), 'tables')
+        self.assertEqual(hyphenator.hyphenate('Table.'), 'Ta-ble.')
+        self.assertEqual(hyphenator.hyphenate('hyphen-ation'), 'hyphen-ation')
+        self.assertEqual(hyphenation.Hyphenator(self.PATTERNS, right_min=6).hyphenate('hyphenation'), 'hy-phenation')
+        hyphenator.positions('hyphenation')
+        self.assertEqual(hyphenator.positions.cache_info().hits, 2)
+
+    def test_default_hyphenator(self):
+        hyphenator = hyphenation.default_hyphenator()
+        self.assertEqual(
+            [hyphenator.hyphenate(word) for word in ['hyphenation', 'typography', 'algorithm', 'information']],
+            ['hy-phen-ation', 'ty-pog-ra-phy', 'al-go-rithm', 'in-for-ma-tion'],
+        )
+        words, breaks = optimal_line_breaks_hyphenated(
+            text_to_words(TestSplit.PAPER_TEXT), 20, hyphenate=hyphenator.positions
+        )
+        self.assertTrue(any(word.text.endswith('-') for word in words))
+        self.assertTrue(all(sum(words[i][1] for i in line) + len(line) - 1 <= 20 for line in breaks.to_lists()))
+
+    @unittest.skipIf(pyphen is None, 'pyphen is not installed')
+    def test_pyphen_hyphenator(self):
+        hyphenator = hyphenation.pyphen_hyphenator('en_US')
+        self.assertEqual(hyphenator.hyphenate('hyphenation'), 'hy-phen-ation')
+        self.assertEqual(hyphenation.pyphen_hyphenator('de').hyphenate('Silbentrennung'), 'Sil-ben-tren-nung')
+        with self.assertRaises(KeyError):
+            hyphenation.pyphen_hyphenator('xx_YY')
+
+    def test_parse_patterns(self):
+        tex = '% comment\n\\patterns{ % more\n.hy3ph he2n\n}\n\\hyphenation{ta-ble}\n'
+        self.assertEqual(hyphenation.parse_patterns(tex), (['.hy3ph', 'he2n'], ['ta-ble']))
+        dic = 'UTF-8\nLEFTHYPHENMIN 2\n.hy3ph\nhe2n\n'
+        self.assertEqual(hyphenation.parse_patterns(dic), (['.hy3ph', 'he2n'], []))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'patterns.txt')
+            with open(path, 'w') as pattern_file:
+                pattern_file.write(' '.join(self.PATTERNS))
+            self.assertEqual(hyphenation.load_hyphenator(path).hyphenate('hyphenation'), 'hy-phen-ation')
+
+    def test_optimal_line_breaks_hyphenated(self):
+        words = text_to_words(TestSplit.PAPER_TEXT)
+        # Without hyphenation points, the same as optimal_line_breaks
+        self.assertEqual(
+            optimal_line_breaks_hyphenated(words, 47, hyphenate=lambda text: []),
+            (words, optimal_line_breaks(words, 47)),
+        )
+
+        rand = random.Random(3)
+        for _ in range(100):
+            texts = [''.join(rand.choice('abcdefgh') for _ in range(rand.randint(1, 9)))
+                     for _ in range(rand.randint(1, 12))]
+            words = split_text_to_words(texts)
+            max_width = rand.randint(5, 20)
+            hyphenated = []
+
+            def hyphenate(text):
+                hyphenated.append(text)
+                return list(range(2, len(text) - 1))
+
+            new_words, breaks = optimal_line_breaks_hyphenated(
+                words, max_width, hyphenate=hyphenate, hyphen_penalty=0.001)
+            msg = dict(texts=texts, max_width=max_width, lines=breaks.to_texts(new_words))
+            # The words are only broken, and only slack words are hyphenated
+            self.assertEqual(''.join(word.text.rstrip('-') for word in new_words), ''.join(texts), msg=msg)
+            starts_fwd = line_by_line_breaks(words, max_width).starts
+            starts_bck = line_by_line_reversed_breaks(words, max_width).starts
+            slack_words = {
+                texts[word] for lineno in range(1, len(starts_fwd) - 1)
+                for word in range(starts_bck[lineno], starts_fwd[lineno] + 1)
+            }
+            self.assertLessEqual(set(hyphenated), slack_words)
+            # Same number of lines, which all fit, and the minimum cost
+            self.assertEqual(len(breaks), len(starts_fwd), msg=msg)
+            for line in breaks:
+                self.assertLessEqual(sum(new_words[i].width_min(max_width) + 1 for i in line) - 1, max_width, msg=msg)
+            self.assertAlmostEqual(
+                hyphenated_layout_cost(new_words, breaks, max_width, 0.001),
+                min_hyphenated_layout_cost(texts, starts_bck, starts_fwd, max_width, 0.001),
+                msg=msg,
+            )
+
+
+class TestLineAdjust(unittest.TestCase):
+    """Test line_adjust's justification."""
+
+    def test_distribute_spaces(self):
+        words = ['a', 'bb', 'c', 'dd']
+        self.assertEqual(line_adjust.distribute_spaces(words, 14, True), 'a   bb   c  dd')
+        self.assertEqual(line_adjust.distribute_spaces(words, 14, False), 'a  bb   c   dd')
+        self.assertEqual(line_adjust.distribute_spaces(words, 15, True), 'a   bb   c   dd')
+        self.assertEqual(line_adjust.distribute_spaces(words, 9, True), 'a bb c dd')
+        self.assertEqual(line_adjust.distribute_spaces(words, 5, False), 'a bb c dd')
+        self.assertEqual(line_adjust.distribute_spaces(['word'], 10, True), 'word')
+        self.assertEqual(line_adjust.distribute_spaces([], 10, True), '')
+        self.assertEqual(len(line_adjust.distribute_spaces(['x'] * 1000, 100_000, False)), 100_000)
+
+    def test_pad_lines(self):
+        lines = text_to_list_of_lines(TestSplit.PAPER_EXPECTED_TEXT)
+        padded = line_adjust.pad_lines(lines, TestSplit.PAPER_MAX_LINE_WIDTH)
+        self.assertEqual([line.split() for line in padded.split('\n')], lines)
+        self.assertEqual(padded.split('\n')[2], 'material,   ranging  from  handbills  to  heavy')
+        self.assertEqual(padded.split('\n')[3], 'reference books. Despite  the  mushroom  growth')
+        self.assertTrue(all(len(line) == TestSplit.PAPER_MAX_LINE_WIDTH for line in padded.split('\n')[:-1]))
+        outfile = io.StringIO()
+        line_adjust.write_padded_lines(lines, TestSplit.PAPER_MAX_LINE_WIDTH, outfile)
+        self.assertEqual(outfile.getvalue(), padded + '\n')
+
+
+class TestStream(unittest.TestCase):
+    """Test read_paragraphs, format_stream, etc."""
+
+    PARAS = 'A line\nAnother line\n\n\nStart new para\n\nAnother para\n  with a 2nd indented line\n\n'
+
+    PARAS_SPLIT_EXPECTED = ['A line\nAnother line', 'Start new para', 'Another para\n  with a 2nd indented line']
+
+    def test_read_paragraphs(self):
+        self.assertEqual(list(split_paragraphs(self.PARAS)), self.PARAS_SPLIT_EXPECTED)
+        self.assertEqual(list(read_paragraphs(io.StringIO(self.PARAS))), self.PARAS_SPLIT_EXPECTED)
+        self.assertEqual(list(read_paragraphs(io.StringIO('no newline'))), ['no newline'])
+        self.assertEqual(list(read_paragraphs(io.StringIO(''))), [])
+
+        def lines():
+            yield 'first\n'
+            yield '\n'
+            raise AssertionError('read past the first paragraph')
+
+        self.assertEqual(next(read_paragraphs(lines())), 'first')
+
+    def test_format_stream(self):
+        self.assertEqual(format_paragraph('He was defenestrated\nwithout cause.', 10),
+                         'He was\ndefenestrated\nwithout\ncause.\n')
+        outfile = io.StringIO()
+        format_stream(io.StringIO(self.PARAS), outfile, 12)
+        self.assertEqual(
+            outfile.getvalue(),
+            'A line\nAnother line\n\nStart new\npara\n\nAnother para\nwith a 2nd\nindented\nline\n',
+        )
+
+    def test_format_paragraphs_parallel(self):
+        self.assertEqual(list(chunk_paragraphs(['ab', 'cde', 'f', 'g'], 4)), [['ab', 'cde'], ['f', 'g']])
+        self.assertEqual(list(chunk_paragraphs([], 4)), [])
+
+        rand = random.Random(1)
+        paragraphs = [
+            ' '.join('x' * rand.randint(1, 10) for _ in range(rand.randint(1, 100)))
+            for _ in range(50)
+        ]
+        expected = [format_paragraph(para, 30) for para in paragraphs]
+        self.assertEqual(list(format_paragraphs_parallel(paragraphs, 30, 1)), expected)
+        self.assertEqual(list(format_paragraphs_parallel(paragraphs, 30, 2)), expected)
+        self.assertEqual(
+            list(format_paragraphs_parallel(iter(paragraphs), 30, 2, chunk_size=100)), expected
+        )
+        cache = LayoutCache()
+        self.assertEqual(
+            list(format_paragraphs_parallel(paragraphs * 2, 30, 2, chunk_size=100, cache=cache)),
+            expected * 2,
+        )
+        # The workers' caches' statistics are added to cache's
+        stats = cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 100)
+        self.assertGreaterEqual(stats['entries'], 50)
+        self.assertEqual(len(cache), 0)
+
+        outfile = io.StringIO()
+        format_stream(io.StringIO(self.PARAS), outfile, 12, jobs=2)
+        self.assertEqual(
+            outfile.getvalue(),
+            'A line\nAnother line\n\nStart new\npara\n\nAnother para\nwith a 2nd\nindented\nline\n',
+        )
+
+    def test_reflow(self):
+        self.assertEqual(
+            [self.PARAS[start:end] for start, end in buffer_paragraphs(self.PARAS.encode())],
+            self.PARAS_SPLIT_EXPECTED,
+        )
+        self.assertEqual(list(buffer_paragraphs(b'\n\n')), [])
+        self.assertEqual(list(buffer_paragraphs(b'')), [])
+
+        for text in [
+            self.PARAS, '', '\n', 'one', 'Ünïcödé wörds\n  ärë cöüntëd\n\n\nby chäräctërs', '日本語の 文章は 幅が 二倍です',
+            'non\u00a0breaking\u00a0spaces, ideographic\u3000spaces', 'unit\x1fseparators\x1cand more',
+            'invalid \udcff utf-8',
+        ]:
+            expected = io.StringIO()
+            format_stream(io.StringIO(text), expected, 12)
+            outfile = io.BytesIO()
+            reflow_buffer(text.encode('utf-8', 'surrogateescape'), outfile, 12)
+            self.assertEqual(outfile.getvalue().decode('utf-8', 'surrogateescape'), expected.getvalue())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, 'input.txt')
+            output_path = os.path.join(tmp_dir, 'output.txt')
+            with open(input_path, 'w') as input_file:
+                input_file.write(self.PARAS)
+            self.assertEqual(main(['reflow', input_path, output_path, '--width', '12']), 0)
+            with open(output_path) as output_file:
+                self.assertEqual(
+                    output_file.read(),
+                    'A line\nAnother line\n\nStart new\npara\n\nAnother para\nwith a 2nd\nindented\nline\n',
+                )
+            with open(input_path, 'w'):
+                pass
+            reflow_file(input_path, output_path, 12)
+            self.assertEqual(os.path.getsize(output_path), 0)
+            for width in ['0', '-3']:
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                    main(['reflow', input_path, output_path, '--width', width])
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                    main([width])
+            with self.assertRaises(ValueError):
+                reflow_file(input_path, output_path, 0)
+            with self.assertRaises(ValueError):
+                reflow_buffer(b'some text', io.BytesIO(), -1)
+            with self.assertRaises(ValueError):
+                format_stream(io.StringIO('some text'), io.StringIO(), 0)
+
+    def test_line_renderer(self):
+        rand = random.Random(15)
+        for _ in range(200):
+            words = [''.join(rand.choices('abcdé', k=rand.randint(1, 6))) for _ in range(rand.randint(0, 30))]
+            separators = [rand.choice([' ', ' ', ' ', '\n', '\t', '  ', ' \n ']) for _ in words]
+            buffer = ''.join(separator + word for separator, word in zip(separators, words)).encode()
+            spans = [match.span() for match in WORD_RE.finditer(buffer)]
+            line_starts = sorted({0, *rand.sample(range(len(words) + 1), min(len(words), 5))} - {len(words)})
+            expected = b''.join(
+                b' '.join(word.encode() for word in words[start:end]) + b'\n'
+                for start, end in zip(line_starts, line_starts[1:] + [len(words)])
+            )
+            for buffer_size in [1, 7, 64, REFLOW_BUFFER_SIZE]:
+                outfile = io.BytesIO()
+                with LineRenderer(outfile, buffer_size) as renderer:
+                    renderer.write(b'>')
+                    renderer.write_lines(buffer, [start for start, _ in spans], [end for _, end in spans], line_starts)
+                self.assertEqual(outfile.getvalue(), b'>' + expected)
+
+
+    def test_structured(self):
+        self.assertEqual(format_structured_paragraph('    code  line\n\tmore', 10), '    code  line\n\tmore\n')
+        self.assertEqual(
+            list(join_fenced_paragraphs(['a', '```\nx', 'y\n```', 'b', '~~~', 'c'])),
+            ['a', '```\nx\n\ny\n```', 'b', '~~~\n\nc'],
+        )
+        self.assertEqual(format_structured_paragraph('```\nx  = 1\n\n```', 5), '```\nx  = 1\n\n```\n')
+        self.assertEqual(
+            format_structured_paragraph('- first item is long\n- second\n  item\n1. third one', 12),
+            '- first item\n  is long\n- second\n  item\n1. third one\n',
+        )
+        self.assertEqual(
+            format_structured_paragraph('> quoted text that is longer\n> than the width', 14),
+            '> quoted text\n> that is\n> longer than\n> the width\n',
+        )
+
+        # The greedy layout fits in as few lines, but isn't the optimal one
+        greedy = 'xx\nxxx x\nxx\nxxx\nxxx x'
+        optimal = 'xx\nxxx\nx xx\nxxx\nxxx x\n'
+        self.assertEqual(format_structured_paragraph(greedy, 5), optimal)
+        self.assertEqual(format_structured_paragraph(greedy, 5, keep_fitting=True), greedy + '\n')
+        self.assertEqual(format_structured_paragraph(optimal, 5, keep_fitting=True), optimal)
+        self.assertEqual(format_structured_paragraph('xx xxx x\nxx xxx xxx x', 5, keep_fitting=True), optimal)
+        words = text_to_words('xx xxx x xx xxx xxx x')
+        self.assertEqual(check_layout(LineWidths(words, 5), [0, 1, 3, 4, 5]), (True, False))
+        self.assertEqual(check_layout(LineWidths(words, 5), [0, 1, 2, 4, 5]), (True, False))
+        self.assertEqual(check_layout(LineWidths(words, 5), [0, 2, 3, 4, 5]), (False, False))
+        self.assertEqual(check_layout(LineWidths(words, 5), [0, 1, 1, 3, 4, 5]), (False, False))
+        self.assertEqual(check_layout(LineWidths(words, 5), [0, 1, 3, 4]), (False, False))
+        self.assertEqual(check_layout(LineWidths(text_to_words('aaa bb c dd'), 6), [0, 2]), (True, True))
+
+        text = 'Some text\nto reflow.\n\n```\nint  x;\n\nint  y;\n```\n\n- an item\n- another\n'
+        outfile = io.StringIO()
+        format_stream(io.StringIO(text), outfile, 30, structured=True)
+        self.assertEqual(
+            outfile.getvalue(),
+            'Some text to reflow.\n\n```\nint  x;\n\nint  y;\n```\n\n- an item\n- another\n',
+        )
+        outfile = io.StringIO()
+        format_stream(io.StringIO(greedy), outfile, 5, keep_fitting=True)
+        self.assertEqual(outfile.getvalue(), greedy + '\n')
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Test instrumentation and textflow.instrument."""
+
+    def test_instrumentation(self):
+        paras = [TestSplit.PAPER_TEXT, 'one', 'two words', TestSplit.PAPER_TEXT * 3]
+        aggregator = instrumentation.Aggregator()
+        json_file = io.StringIO()
+        previous = textflow.instrument(
+            instrumentation.Instrumentation([aggregator, instrumentation.JsonLinesSink(json_file)])
+        )
+        try:
+            formatted = [format_paragraph(para, 30) for para in paras]
+            outfile = io.BytesIO()
+            reflow_buffer('\n\n'.join(paras).encode(), outfile, 30)
+        finally:
+            textflow.instrument(previous).close()
+        self.assertIsNone(textflow.INSTRUMENTATION)
+        self.assertEqual(formatted, [format_paragraph(para, 30) for para in paras])
+        self.assertEqual(outfile.getvalue().decode(), '\n'.join(formatted))
+
+        records = [json.loads(line) for line in json_file.getvalue().splitlines()]
+        self.assertEqual([record['paragraph'] for record in records], list(range(2 * len(paras))))
+        for para, record in zip(paras * 2, records):
+            words = text_to_words(para)
+            line_widths = LineWidths(words, 30)
+            starts_fwd = line_by_line_starts(line_widths)
+            sizes = [fwd - bck + 1 for fwd, bck in zip(starts_fwd, textflow.line_by_line_reversed_starts(line_widths))]
+            self.assertEqual(record['words'], len(words))
+            self.assertEqual(record['lines'], len(starts_fwd))
+            self.assertEqual(record.get('slack_size', 1), sum(sizes))
+            self.assertEqual(record.get('slack_iterations', 0), sum(a * b for a, b in zip(sizes, sizes[1:])))
+            for phase in ['tokenize', 'layout', 'greedy', 'render']:
+                self.assertGreater(record[f'time_{phase}'], 0.0)
+            self.assertGreaterEqual(record['time_layout'], record['time_greedy'] + record.get('time_slack', 0.0))
+
+        summary = aggregator.summary()
+        self.assertEqual(summary['paragraphs'], len(records))
+        self.assertEqual(summary['words'], sum(record['words'] for record in records))
+        self.assertEqual(summary['max_lines'], max(record['lines'] for record in records))
+
+    def test_sink(self):
+        # A sink must implement add
+        class NoAdd(instrumentation.Sink):  # pylint: disable=abstract-method
+            pass
+
+        with self.assertRaises(TypeError):
+            NoAdd()  # pylint: disable=abstract-class-instantiated
+
+
+class TestService(unittest.TestCase):
+    """Test service.FormatService."""
+
+    def test_format(self):
+        rand = random.Random(16)
+        words = text_to_words(TestSplit.PAPER_TEXT)
+        texts = [
+            ' '.join(word.text for word in words[start : start + rand.randint(0, 40)])
+            for start in rand.choices(range(len(words)), k=300)
+        ]
+        texts.append(TestSplit.PAPER_TEXT * 8 + '\n\n' + TestSplit.PAPER_TEXT)  # a large job
+        jobs = [
+            service.Job(text, rand.randint(10, 60), rand.choice(list(service.ALGORITHMS)), rand.random() < 0.5)
+            for text in texts
+        ]
+
+        async def format_jobs(format_service):
+            async with format_service:
+                results = await asyncio.gather(*(format_service.format(*job) for job in jobs))
+                with self.assertRaises(ValueError):
+                    await format_service.format('text', 10, 'no such algorithm')
+                with self.assertRaises(ValueError):
+                    await format_service.format('text', 0)
+            return results
+
+        for workers in [0, 1]:
+            format_service = service.FormatService(workers, max_queued=8, batch_size=50, large_job_size=2000)
+            results = asyncio.run(format_jobs(format_service))
+            for job, result in zip(jobs, results):
+                line_indexes = service.ALGORITHMS[job.algorithm]
+                self.assertEqual(
+                    result,
+                    '\n'.join(
+                        format_paragraph(para, job.width, line_indexes, justify=job.justify)
+                        for para in split_paragraphs(job.text)
+                    ),
+                )
+            stats = format_service.stats()
+            self.assertEqual(stats['batch']['count'], len(jobs) - workers)
+            self.assertEqual(stats['pool']['count'], workers)
+            self.assertLess(stats['batches'], len(jobs) - workers)  # coalesced
+            self.assertGreaterEqual(stats['batches'], (len(jobs) - workers) / 50)
+
+    def test_server(self):
+        def broken(*args):
+            raise AssertionError('broken')
+
+        async def requests():
+            async with service.FormatService(0) as format_service:
+                server = await service.serve(format_service, '127.0.0.1', 0)
+                async with server:
+                    reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+                    responses = []
+                    for request in [
+                        {'text': 'aaa bb c dd', 'width': 6},
+                        {'text': 'aaa bb c dd', 'width': 7, 'justify': True, 'algorithm': 'greedy'},
+                        {'text': 'aaa', 'width': 6, 'algorithm': 'no such algorithm'},
+                        {'width': 6},
+                        {'text': 'aaa', 'width': 0},
+                        {'text': 'aaa', 'width': 6, 'algorithm': 'broken'},
+                        {'text': 'aaa', 'width': 6},
+                        {'stats': True},
+                    ]:
+                        writer.write(json.dumps(request).encode() + b'\n')
+                        responses.append(json.loads(await reader.readline()))
+                    writer.close()
+                    await writer.wait_closed()
+            return responses
+
+        service.ALGORITHMS['broken'] = broken
+        try:
+            responses = asyncio.run(requests())
+        finally:
+            del service.ALGORITHMS['broken']
+        self.assertEqual(responses[0], {'text': 'aaa bb\nc dd\n'})
+        self.assertEqual(responses[1], {'text': 'aaa  bb\nc dd\n'})
+        self.assertIn('ValueError', responses[2]['error'])
+        self.assertIn('KeyError', responses[3]['error'])
+        self.assertIn('ValueError', responses[4]['error'])
+        self.assertEqual(responses[5], {'error': 'AssertionError: broken'})
+        self.assertEqual(responses[6], {'text': 'aaa\n'})
+        self.assertEqual(responses[7]['batch']['count'], 3)
+
+    def test_latency_histogram(self):
+        histogram = service.LatencyHistogram()
+        self.assertEqual(histogram.percentile(99), 0.0)
+        for latency in range(1, 1001):
+            histogram.add(latency / 1000)
+        stats = histogram.stats()
+        self.assertEqual(stats['count'], 1000)
+        self.assertAlmostEqual(stats['mean'], 0.5005)
+        self.assertEqual(stats['max'], 1.0)
+        for percent in [50, 90, 99]:
+            self.assertGreaterEqual(histogram.percentile(percent), percent / 100)
+            self.assertLess(histogram.percentile(percent), percent / 100 * 1.19)
+        histogram.add(1000.0)
+        self.assertEqual(histogram.percentile(100), 1000.0)
+
+
+class TestPagination(unittest.TestCase):
+    """Test textflow.optimal_line_starts_lines and pagination."""
+
+    def test_optimal_line_starts_lines(self):
+        rand = random.Random(24)
+        for _ in range(300):
+            widths = [rand.randint(1, 6) for _ in range(rand.randint(1, 9))]
+            line_widths = LineWidths.from_widths(widths, rand.randint(6, 16))
+            fewest = len(line_by_line_starts(line_widths))
+            self.assertEqual(
+                textflow.optimal_line_starts_lines(line_widths, fewest), textflow.optimal_line_starts(line_widths)
+            )
+            self.assertIsNone(textflow.optimal_line_starts_lines(line_widths, fewest - 1))
+            self.assertIsNone(textflow.optimal_line_starts_lines(line_widths, len(widths) + 1))
+            for num_lines in range(fewest + 1, len(widths) + 1):
+                costs = [
+                    textflow.layout_log_cost(line_widths, [0, *breaks])
+                    for breaks in itertools.combinations(range(1, len(widths)), num_lines - 1)
+                    if all(
+                        line_widths.sums[end] - line_widths.sums[start] <= line_widths.max_width + 1
+                        for start, end in zip([0, *breaks], [*breaks, len(widths)])
+                    )
+                ]
+                starts = textflow.optimal_line_starts_lines(line_widths, num_lines)
+                self.assertEqual(len(starts), num_lines)
+                self.assertAlmostEqual(textflow.layout_log_cost(line_widths, starts), min(costs))
+        # Each layout in 2 lines has a line of width 0
+        self.assertIsNone(textflow.optimal_line_starts_lines(LineWidths.from_widths([0, 0, 5], 5, 0), 2))
+
+    def test_page_breaks(self):
+        # One word per line: 5 lines, a blank line and a line, on pages of 4 lines
+        paragraphs = [pagination.ParagraphLayouts(text_to_words(text), 1) for text in ['a b c d e', 'f']]
+        breaks = pagination.page_breaks(paragraphs, 4)
+        self.assertEqual(breaks.pages, [(0, 0), (0, 3)])
+        self.assertEqual(breaks.badness, 1)
+        self.assertEqual(pagination.format_pages(paragraphs, breaks), ['a\nb\nc\n', 'd\ne\n\nf\n'])
+        breaks = pagination.page_breaks(paragraphs, 4, widow_penalty=0)
+        self.assertEqual(breaks.pages, [(0, 0), (0, 4)])
+        self.assertEqual(breaks.badness, 0)
+        self.assertEqual(pagination.format_pages(paragraphs, breaks), ['a\nb\nc\nd\n', 'e\n\nf\n'])
+        self.assertEqual(
+            pagination.format_pages(paragraphs, pagination.page_breaks(paragraphs, 3, paragraph_skip=0), 0),
+            ['a\nb\nc\n', 'd\ne\nf\n'],
+        )
+        self.assertEqual(pagination.page_breaks([], 4), pagination.PageBreaks([], [], 0.0))
+
+        # The second paragraph's layout with a line more avoids a widow
+        texts = ['and lazy the fox', 'fox jumps an of quick brown jumps quick and']
+        paragraphs = [pagination.ParagraphLayouts(text_to_words(text), 16) for text in texts]
+        breaks = pagination.page_breaks(paragraphs, 4)
+        self.assertEqual(breaks.layouts[0], paragraphs[0].optimal)
+        self.assertEqual(breaks.layouts[1], paragraphs[1].looser())
+        self.assertEqual(
+            pagination.format_pages(paragraphs, breaks),
+            ['and lazy the fox\n\nfox jumps an\nof quick brown\n', 'jumps quick\nand\n'],
+        )
+        self.assertAlmostEqual(
+            breaks.badness,
+            pagination.LOOSENESS_PENALTY * (paragraphs[1].looser().cost - paragraphs[1].optimal.cost),
+        )
+
+    def test_page_breaks_document(self):
+        rand = random.Random(24)
+        words = text_to_words(' '.join(rand.choice(['a', 'bb', 'ccc', 'dddd', 'eeeee']) for _ in range(200)))
+        paragraphs = [
+            pagination.ParagraphLayouts(words[:rand.randint(1, len(words))], rand.randint(10, 30))
+            for _ in range(100)
+        ]
+        for page_lines in [1, 7, 60]:
+            breaks = pagination.page_breaks(paragraphs, page_lines)
+            pages = pagination.format_pages(paragraphs, breaks)
+            # As many pages as filling each page (with no blank line at the top)
+            lines = '\n\n'.join(textflow.format_paragraph(' '.join(word.text for word in paragraph.words),
+                                                          paragraph.line_widths.max_width).rstrip('\n')
+                                for paragraph in paragraphs).split('\n')
+            num_pages = 0
+            while lines:
+                lines = lines[page_lines:]
+                while lines and not lines[0]:
+                    lines.pop(0)
+                num_pages += 1
+            self.assertEqual(len(pages), num_pages)
+            for page in pages:
+                self.assertLessEqual(page.count('\n'), page_lines)
+                self.assertFalse(page.startswith('\n') or page.endswith('\n\n'))
+            self.assertEqual(
+                ' '.join(''.join(pages).split()), ' '.join(word.text for p in paragraphs for word in p.words)
+            )
+
+
+def layout_cost(words: List[Word], starts: List[int], max_width: int) -> float:
+    """Cost of a layout, as computed by DYNAMIC (see Notes.md#Cost_function)."""
+    cost = 1.0
+    for start, end in zip(starts, starts[1:]):
+        line_len = sum(word.width_min(max_width) + 1 for word in words[start:end]) - 1
+        assert line_len <= max_width
+        cost *= 1.0 + 1.0 / line_len
+    return 2.0 * cost
+
+
+def hyphenated_layout_cost(words: List[Word], breaks: LineBreaks, max_width: int, hyphen_penalty: float) -> float:
+    """Cost of a layout (as layout_cost, with hyphen_penalty for each hyphenated line)."""
+    cost = layout_cost(words, list(breaks.starts), max_width)
+    return cost * math.exp(hyphen_penalty * sum(words[start - 1].text.endswith('-') for start in breaks.starts[1:]))
+
+
+def min_hyphenated_layout_cost(
+    texts: List[str], starts_bck: List[int], starts_fwd: List[int], max_width: int, hyphen_penalty: float
+) -> float:
+    """Minimum cost of a layout of texts (of all those with lines
+    starting in the slacks, including at hyphenation points of words
+    that aren't clipped, as in optimal_line_breaks_hyphenated)."""
+    slacks = [[(0, 0)]]
+    for lineno in range(1, len(starts_fwd) - 1):
+        slacks.append([(word, offset) for word in range(starts_bck[lineno], starts_fwd[lineno] + 1)
+                       for offset in [0] + (list(range(2, len(texts[word]) - 1))
+                                            if len(texts[word]) <= max_width else [])])
+    if len(starts_fwd) > 1:
+        slacks.append([(starts_fwd[-1], 0)])
+    best = math.inf
+    for line_starts in itertools.product(*slacks):
+        words = []
+        starts = []
+        for (word, offset), (end_word, end_offset) in zip(line_starts, line_starts[1:] + ((len(texts), 0),)):
+            starts.append(len(words))
+            line = [texts[word][offset:]] + texts[word + 1 : end_word] if word < end_word else []
+            if end_offset:
+                line = line + [texts[end_word][:end_offset]] if word < end_word else [texts[word][offset:end_offset]]
+                line[-1] += '-'
+            words.extend(line)
+        if all(starts[i] < starts[i + 1] for i in range(len(starts) - 1)):
+            words = split_text_to_words(words)
+            if all(sum(words[i].width_min(max_width) + 1 for i in line) - 1 <= max_width
+                   for line in LineBreaks(starts, len(words))):
+                best = min(best, hyphenated_layout_cost(words, LineBreaks(starts, len(words)), max_width, hyphen_penalty))
+    return best
+
+
+def truetype_font(
+    units_per_em: int, advances: List[int], char_glyphs: Dict[str, int], kerning: Dict[Tuple[int, int], int]
+) -> bytes:
+    """A minimal TrueType font (head, hhea, hmtx, cmap (format 4) and kern tables)."""
+    head = struct.pack('>18xH34x', units_per_em)
+    hhea = struct.pack('>34xH', len(advances))
+    hmtx = b''.join(struct.pack('>Hh', advance, 0) for advance in advances)
+    # one segment per character, plus the final 0xFFFF segment
+    codes = sorted(ord(char) for char in char_glyphs) + [0xFFFF]
+    seg_count = len(codes)
+    deltas = [(char_glyphs[chr(code)] - code) & 0xFFFF if code != 0xFFFF else 1 for code in codes]
+    cmap_4 = struct.pack(f'>7H{seg_count}HH{seg_count}H{seg_count}H{seg_count}H',
+                         4, 16 + 8 * seg_count, 0, 2 * seg_count, 0, 0, 0,
+                         *codes, 0, *codes, *deltas, *(seg_count * [0]))
+    cmap = struct.pack('>HHHHI', 0, 1, 3, 1, 12) + cmap_4
+    kern_pairs = b''.join(struct.pack('>HHh', left, right, value) for (left, right), value in sorted(kerning.items()))
+    kern = struct.pack('>HHHHHHHHH', 0, 1, 0, 14 + len(kern_pairs), 0x0001, len(kerning), 0, 0, 0) + kern_pairs
+    tables = dict(cmap=cmap, head=head, hhea=hhea, hmtx=hmtx, kern=kern)
+    offset = 12 + 16 * len(tables)
+    directory, data = b'', b''
+    for tag, table in sorted(tables.items()):
+        directory += struct.pack('>4sIII', tag.encode(), 0, offset + len(data), len(table))
+        data += table
+    return struct.pack('>IHHHH', 0x00010000, len(tables), 0, 0, 0) + directory + data
+
 
 def text_to_list_of_lines(text: str) -> List[List[str]]:
     """Convert text into a list of (Unix-style) lines, each being a list of words."""
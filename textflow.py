@@ -15,33 +15,90 @@ end "slacks"). It is also O(N) in space.
 The algorithm is designed for fixed-width text, but can be fairly
 easily extended to work with proportional fonts and to handle
 hyphenation. To allow this, the API allows specifying a list of words
-with custom-computed widths.
+with custom-computed widths (ints, or floats); font_metrics computes
+the widths of words for proportional fonts. By default, the width of a
+word is the number of columns it takes in a terminal (see
+display_width), which is its length unless it has East Asian wide
+characters, combining marks, or emoji, but at least 1 (see word_width).
 """
 
 # TODO: pytype -V 3.8 --protocols --precise-return --check-attribute-types --check-container-types --check-parameter-types --check-variable-types textflow.py
 
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import functools
+import itertools
+import math
+import mmap
+import operator
+import os
+import re
 import sys
-from typing import Any, Callable, Iterable, List, Optional, Type, TypeVar
+import time
+from array import array
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+import display_width
+import instrumentation
+import line_adjust
 
 assert sys.version_info >= (3, 8)  # TODO: 3.9 (pytype doesn't support 3.9)
 
 # INFINITE is any number larger than maximum
 INFINITE = sys.float_info.max
 
+# Where the formatting functions record timings and counters (see
+# instrumentation.py), or None (use instrument to set it)
+INSTRUMENTATION: Optional[instrumentation.Instrumentation] = None
+
+
+def instrument(
+    new_instrumentation: Optional[instrumentation.Instrumentation],
+) -> Optional[instrumentation.Instrumentation]:
+    """Set INSTRUMENTATION, returning its previous value."""
+    global INSTRUMENTATION  # pylint: disable=global-statement
+    previous = INSTRUMENTATION
+    INSTRUMENTATION = new_instrumentation
+    return previous
+
+
+# The width of a word or line: usually an int (number of columns for
+# fixed-width text, see display_width, or a fixed-point width for a
+# proportional font); floats are also allowed (see LineWidths)
+Width = Union[int, float]
+
 
 class Word(tuple):
     """A word with its attributes (width).
 
     text: str
-    width: int
+    width: int, or float (e.g., for a proportional font, see font_metrics)
     """
 
-    def __new__(cls: Type['Word'], text: str, width: int) -> 'Word':
+    def __new__(cls: Type['Word'], text: str, width: Width) -> 'Word':
         """Create a Word object (immutable)."""
         return tuple.__new__(cls, (text, width))
 
-    def __init__(self, text: str, width: int) -> None:
+    def __init__(self, text: str, width: Width) -> None:
         """A do-nothing __init__ to make pytype happy."""
         pass
 
@@ -50,7 +107,7 @@ class Word(tuple):
         """Alias Word.text."""
         return self[0]
 
-    def width_min(self, max_width: int) -> int:
+    def width_min(self, max_width: Width) -> Width:
         """Get Word.width, but no larger than max_width."""
         return min(self[1], max_width)
 
@@ -63,6 +120,206 @@ class Word(tuple):
         return f'Word({self[0]!r}, {self[1]!r})'
 
 
+# Get Word.text, Word's width (faster than the property and method)
+WORD_TEXT = operator.itemgetter(0)
+WORD_WIDTH = operator.itemgetter(1)
+
+
+def word_width(text: str) -> int:
+    """Width of a word for line breaking: its display width (see
+    display_width.text_width), but at least 1.
+
+    A word such as U+200B (zero width space) or a lone combining mark
+    has a display width of 0, and a line of only such words would have
+    width 0, whose cost is infinite (see log_line_costs), so that every
+    layout would have an infinite cost.
+    """
+    return max(display_width.text_width(text), 1)
+
+
+class LineWidths:
+    """Word widths (no larger than max_width) and their cumulative sums.
+
+    The widths are computed once, so the line breaking passes don't
+    need to call Word.width_min in their inner loops; the cumulative
+    sums (which include a trailing space_width for each word) give the
+    formatted length of any span of words in O(1).
+
+    The widths are normally ints. If any width (or max_width or
+    space_width) is a float, all of them are kept as floats, rounded
+    to a multiple of FLOAT_WIDTH_RESOLUTION (max_width rounded down),
+    so that the sums are exact and all the line breaking passes agree
+    on whether a line fits.
+
+    widths: array of int (or float), widths[i] = words[i].width_min(max_width)
+    sums: array of int (or float), sums[i] = sum(widths[k] + space_width for k < i)
+    """
+
+    __slots__ = ('widths', 'sums', 'max_width', 'space_width')
+
+    def __init__(self, words: Iterable[Word], max_width: Width, space_width: Width = 1) -> None:
+        """Compute the widths and cumulative sums for words."""
+        self.init_widths(list(map(WORD_WIDTH, words)), max_width, space_width)
+
+    @classmethod
+    def from_widths(cls, widths: Iterable[Width], max_width: Width, space_width: Width = 1) -> 'LineWidths':
+        """Create from the widths of the words (instead of Word's)."""
+        line_widths = cls.__new__(cls)
+        line_widths.init_widths(widths, max_width, space_width)
+        return line_widths
+
+    def init_widths(self, widths: Iterable[Width], max_width: Width, space_width: Width) -> None:
+        """Set widths (clipped to max_width) and their cumulative sums."""
+        self.widths = widths_array(widths)
+        if self.widths.typecode == 'd' or isinstance(max_width, float) or isinstance(space_width, float):
+            max_width = math.floor(max_width / FLOAT_WIDTH_RESOLUTION) * FLOAT_WIDTH_RESOLUTION
+            space_width = round_width(space_width)
+            self.widths = array('d', (round_width(width) for width in self.widths))
+        if self.widths and max(self.widths) > max_width:
+            self.widths = array(self.widths.typecode, (min(width, max_width) for width in self.widths))
+        self.sums = cumulative_sums(self.widths, space_width)
+        self.max_width = max_width
+        self.space_width = space_width
+
+    def __len__(self) -> int:
+        """Number of words."""
+        return len(self.widths)
+
+    def span(self, start: int, end: int) -> Width:
+        """Formatted length of words[start:end] (start < end)."""
+        return self.sums[end] - self.sums[start] - self.space_width
+
+    def with_max_width(self, max_width: Width) -> 'LineWidths':
+        """LineWidths for the same words and space_width with another
+        max_width, sharing the widths and sums unless max_width clips
+        any of the widths (or makes them floats)."""
+        if self.widths.typecode == 'd':
+            max_width = math.floor(max_width / FLOAT_WIDTH_RESOLUTION) * FLOAT_WIDTH_RESOLUTION
+        elif isinstance(max_width, float):
+            return LineWidths.from_widths(self.widths, max_width, self.space_width)
+        if self.widths and max(self.widths) > max_width:
+            return LineWidths.from_widths(self.widths, max_width, self.space_width)
+        line_widths = LineWidths.__new__(LineWidths)
+        line_widths.widths = self.widths
+        line_widths.sums = self.sums
+        line_widths.max_width = max_width
+        line_widths.space_width = self.space_width
+        return line_widths
+
+
+# Float widths are rounded to a multiple of this (a power of 2), so
+# that sums of them are exact (up to about 10^11)
+FLOAT_WIDTH_RESOLUTION = 1.0 / 65536
+
+
+def round_width(width: Width) -> float:
+    """width as a float, rounded to a multiple of FLOAT_WIDTH_RESOLUTION."""
+    return round(width / FLOAT_WIDTH_RESOLUTION) * FLOAT_WIDTH_RESOLUTION
+
+
+def widths_array(widths: Iterable[Width]) -> array:
+    """widths as an array of int, or of float if any of them is a float."""
+    if not isinstance(widths, (list, array)):
+        widths = list(widths)
+    try:
+        return array('l', widths)
+    except TypeError:  # float widths
+        return array('d', widths)
+
+
+def word_widths(words: Iterable[Word], max_width: Width) -> array:
+    """Array of words[i].width_min(max_width) (see widths_array)."""
+    widths = widths_array(list(map(WORD_WIDTH, words)))
+    if widths and max(widths) > max_width:
+        widths = array(widths.typecode, (min(width, max_width) for width in widths))
+    return widths
+
+
+def cumulative_sums(widths: array, space_width: Width) -> array:
+    """Cumulative sums of widths, each followed by a space (starting with 0)."""
+    return array(widths.typecode, itertools.accumulate((width + space_width for width in widths), initial=0))
+
+
+class LineBreaks:
+    """The lines computed by a line breaking algorithm, as the index
+    of the first word of each line.
+
+    This is a compact alternative to a list of lists of word indexes:
+    only the line starts are stored (in an array), and the word indexes
+    of each line are produced on demand, as a range.
+
+    starts: array of int, starts[I] = index of first word in I-th line
+    num_words: number of words in the paragraph
+    """
+
+    __slots__ = ('starts', 'num_words')
+
+    def __init__(self, starts: Iterable[int], num_words: int) -> None:
+        """Create from the index of first word of each line."""
+        self.starts = array('l', starts)
+        self.num_words = num_words
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[Iterable[int]], num_words: int) -> 'LineBreaks':
+        """Create from lines of word indexes (as returned by the *_indexes functions)."""
+        if isinstance(lines, LineBreaks):
+            return lines
+        return cls((next(iter(line), 0) for line in lines), num_words)
+
+    def __len__(self) -> int:
+        """Number of lines."""
+        return len(self.starts)
+
+    def __getitem__(self, lineno: int) -> range:
+        """Indexes of the words in a line."""
+        start = self.starts[lineno]
+        if lineno == -1 or lineno == len(self.starts) - 1:
+            return range(start, self.num_words)
+        return range(start, self.starts[lineno + 1])
+
+    def __iter__(self) -> Iterator[range]:
+        """Iterate over the lines, each being a range of word indexes."""
+        starts = self.starts
+        for i in range(1, len(starts)):
+            yield range(starts[i - 1], starts[i])
+        if starts:
+            yield range(starts[-1], self.num_words)
+
+    def __eq__(self, other: Any) -> bool:
+        """Equality test."""
+        return (
+            isinstance(other, LineBreaks)
+            and self.num_words == other.num_words
+            and self.starts == other.starts
+        )
+
+    def __repr__(self) -> str:
+        """String representation of LineBreaks(starts, num_words)."""
+        return f'LineBreaks({list(self.starts)!r}, {self.num_words!r})'
+
+    def to_lists(self) -> List[List[int]]:
+        """The lines as lists of word indexes (as returned by the *_indexes functions)."""
+        return [list(line) for line in self]
+
+    def to_words(self, words: List[Word]) -> List[List[Word]]:
+        """The lines as lists of Word's."""
+        return [words[line.start : line.stop] for line in self]
+
+    def to_texts(self, words: List[Word]) -> List[List[str]]:
+        """The lines as lists of str's."""
+        return [[word.text for word in words[line.start : line.stop]] for line in self]
+
+
+# A line breaking algorithm (e.g., optimal_line_indexes, optimal_line_breaks)
+LineIndexesFn = Callable[[List[Word], Width, Width], Iterable[Iterable[int]]]
+
+# A line breaking algorithm on LineWidths (e.g., optimal_line_starts)
+LineStartsFn = Callable[[LineWidths], List[int]]
+
+# Formats a paragraph (e.g., format_paragraph), given max_width, a
+# LineIndexesFn and an optional LayoutCache
+FormatParagraphFn = Callable[[str, int, LineIndexesFn, Optional['LayoutCache']], str]
+
 T1 = TypeVar('T1')
 T2 = TypeVar('T2')
 
@@ -75,103 +332,1208 @@ def map_line_words(
 
 
 def indexes_to_words(
-    line_indexes: Callable[[List[Word], int, int], List[List[int]]],
+    line_indexes: LineIndexesFn,
     words: List[Word],
-    max_width: int,
-    space_width=1,
+    max_width: Width,
+    space_width: Width = 1,
 ) -> List[List[Word]]:
     """Apply line_indexes algorithm (with max_width lines) to words, outputting lines of Word's."""
     return map_line_words(lambda i: words[i], line_indexes(words, max_width, space_width))
 
 
 def indexes_to_texts(
-    line_indexes: Callable[[List[Word], int, int], List[List[int]]],
+    line_indexes: LineIndexesFn,
     words: List[Word],
-    max_width: int,
-    space_width=1,
+    max_width: Width,
+    space_width: Width = 1,
 ) -> List[List[str]]:
     """Apply line_indexes algorithm (with max_width lines) to words, outputting lines of str's."""
     return map_line_words(lambda i: words[i].text, line_indexes(words, max_width, space_width))
 
 
 def text_to_text_lines(
-    line_indexes: Callable[[List[Word], int, int], List[List[int]]],
+    line_indexes: LineIndexesFn,
     text: str,
     max_width: int,
     space_width=1,
+    cache: Optional['LayoutCache'] = None,
 ) -> List[List[str]]:
-    """Apply line_indexes algorithm (with max_width lines) to text, outputting lines of str's."""
-    return indexes_to_texts(line_indexes, text_to_words(text), max_width, space_width)
+    """Apply line_indexes algorithm (with max_width lines) to text, outputting lines of str's.
+
+    If cache is given, the line breaks are looked up in it (or added to it).
+    """
+    if cache is not None:
+        line_indexes = cache.wrap(line_indexes)
+    instr = INSTRUMENTATION
+    if instr is None:
+        return indexes_to_texts(line_indexes, text_to_words(text), max_width, space_width)
+    start_time = time.perf_counter()
+    words = text_to_words(text)
+    tokenize_time = time.perf_counter()
+    lines = indexes_to_texts(line_indexes, words, max_width, space_width)
+    instr.add('time_tokenize', tokenize_time - start_time)
+    instr.add('time_layout', time.perf_counter() - tokenize_time)
+    instr.add('words', len(words))
+    instr.add('lines', len(lines))
+    return lines
+
+
+class LayoutCache:
+    """A cache of line breaks, for paragraphs that are formatted repeatedly.
+
+    The line breaks (as LineBreaks) are keyed by the algorithm,
+    max_width, space_width and the widths of the words (the result of
+    a line breaking algorithm depends only on these). The widths are
+    part of the key (not just their hash), so a cached result is
+    always the same as recomputing it.
+
+    The least recently used entries are removed when there are more
+    than max_entries, or (if max_bytes is given) the approximate
+    memory used by the keys and LineBreaks is more than max_bytes.
+
+    hits, misses, evictions: counts of cache lookups and removals
+    worker_stats: totals of the statistics of the worker processes'
+        caches (see format_paragraphs_parallel), included in stats()
+    """
+
+    # Approximate overhead (bytes) of an entry, in addition to its arrays
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None) -> None:
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: 'collections.OrderedDict[Tuple[Any, Width, Width, str, bytes], LineBreaks]' = (
+            collections.OrderedDict()
+        )
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.worker_stats: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        """Number of entries."""
+        return len(self.entries)
+
+    def line_breaks(
+        self, line_indexes: LineIndexesFn, words: List[Word], max_width: Width, space_width: Width = 1
+    ) -> LineBreaks:
+        """Apply line_indexes algorithm (with max_width lines) to words,
+        using the cached result if there is one."""
+        widths = word_widths(words, max_width)
+        key = (line_indexes, max_width, space_width, widths.typecode, widths.tobytes())
+        breaks = self.entries.get(key)
+        if breaks is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return breaks
+        self.misses += 1
+        breaks = LineBreaks.from_lines(line_indexes(words, max_width, space_width), len(words))
+        self.entries[key] = breaks
+        self.num_bytes += self.entry_bytes(key, breaks)
+        while len(self.entries) > self.max_entries or (
+            self.max_bytes is not None and self.num_bytes > self.max_bytes and len(self.entries) > 1
+        ):
+            old_key, old_breaks = self.entries.popitem(last=False)
+            self.num_bytes -= self.entry_bytes(old_key, old_breaks)
+            self.evictions += 1
+        return breaks
 
+    def wrap(self, line_indexes: LineIndexesFn) -> LineIndexesFn:
+        """line_indexes algorithm, using this cache."""
+        return functools.partial(self.line_breaks, line_indexes)
 
-def optimal_line_indexes(words: List[Word], max_width: int, space_width=1) -> List[List[int]]:
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss statistics and size of the cache (and of the worker
+        processes' caches, see add_worker_stats)."""
+        stats = dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self.entries),
+            bytes=self.num_bytes,
+        )
+        for name, value in self.worker_stats.items():
+            stats[name] += value
+        return stats
+
+    def add_worker_stats(self, stats: Dict[str, int]) -> None:
+        """Add the statistics of a worker process's cache (which has this
+        cache's limits, see format_paragraphs_parallel) to stats()."""
+        for name, value in stats.items():
+            self.worker_stats[name] = self.worker_stats.get(name, 0) + value
+
+    def entry_bytes(self, key: Tuple[Any, Width, Width, str, bytes], breaks: LineBreaks) -> int:
+        """Approximate memory used by an entry."""
+        return self.ENTRY_OVERHEAD + len(key[4]) + breaks.starts.itemsize * len(breaks.starts)
+
+
+def optimal_line_indexes(words: List[Word], max_width: Width, space_width: Width = 1) -> List[List[int]]:
     """Optimal algorithm for flowing text in a paragraph."""
+    return optimal_line_breaks(words, max_width, space_width).to_lists()
 
-    lines_fwd = line_by_line_indexes(words, max_width)
-    lines_bck = line_by_line_reversed_indexes(words, max_width)
-    assert len(lines_fwd) == len(lines_bck)
-    assert all(fwd >= bck for fwd, bck in zip(lines_fwd, lines_bck))
 
-    # optimal_break[I]: is optimal line start for line I (0-origin into words)
-    optimal_break = len(lines_fwd) * [-1]  # An invalid index
-    optimal_break[0] = 0
-    if len(lines_fwd) > 1:
-        optimal_break[-1] = lines_fwd[-1][0]
-    else:
-        assert lines_fwd == lines_bck
-        return lines_fwd
+def optimal_line_breaks(words: List[Word], max_width: Width, space_width: Width = 1) -> LineBreaks:
+    """Optimal algorithm for flowing text in a paragraph - returns LineBreaks."""
+    return LineBreaks(optimal_line_starts(LineWidths(words, max_width, space_width)), len(words))
+
+
+def layout_many_widths(
+    words: List[Word], max_widths: Iterable[Width], space_width: Width = 1
+) -> List[LineBreaks]:
+    """optimal_line_breaks for each of max_widths (in the same order),
+    sharing the work between them.
+
+    The words' widths and their cumulative sums are computed once
+    (see LineWidths.with_max_width), and the max_widths are done in
+    increasing order, with the greedy passes reusing the lines for the
+    previous max_width where they're the same (see
+    line_by_line_starts_reusing). Repeated max_widths are computed once.
+    """
+    max_widths = list(max_widths)
+    if not max_widths:
+        return []
+    all_line_widths = LineWidths(words, max(max_widths), space_width)
+    breaks: Dict[Width, LineBreaks] = {}
+    starts_fwd: Optional[List[int]] = None
+    starts_bck: Optional[List[int]] = None
+    for max_width in sorted(set(max_widths)):
+        line_widths = all_line_widths.with_max_width(max_width)
+        if starts_fwd is None or starts_bck is None:
+            starts_fwd = line_by_line_starts(line_widths)
+            starts_bck = line_by_line_reversed_starts(line_widths)
+        else:
+            starts_fwd = line_by_line_starts_reusing(line_widths, starts_fwd)
+            starts_bck = line_by_line_reversed_starts_reusing(line_widths, starts_bck)
+        breaks[max_width] = LineBreaks(optimal_line_starts(line_widths, starts_fwd, starts_bck), len(words))
+    return [breaks[max_width] for max_width in max_widths]
+
+
+def line_cost(line_len: Width) -> float:
+    """Cost of a line (other than the last) of formatted length line_len.
+
+    The cost of a paragraph is the product of the costs of its lines
+    (see Notes.md#Cost_function).
+    """
+    return 1.0 + 1.0 / line_len
+
+
+class LogLineCosts(dict):
+    """log(cost_fn(line_len)) indexed by line_len (infinite if line_len
+    is 0), computed when a line_len is first looked up (see log_line_costs)."""
 
-    # cost[i] is cost function = C[(i,len(words)], i ranging over indexes of words
+    __slots__ = ('cost_fn',)
+
+    def __init__(self, cost_fn: Callable[[Width], float]) -> None:
+        super().__init__()
+        self.cost_fn = cost_fn
+
+    def __missing__(self, line_len: Width) -> float:
+        """Compute (and memoize) log(cost_fn(line_len))."""
+        log_cost = math.log(self.cost_fn(line_len)) if line_len > 0 else math.inf
+        self[line_len] = log_cost
+        return log_cost
+
+
+def log_line_costs(cost_fn: Callable[[Width], float] = line_cost) -> LogLineCosts:
+    """log(cost_fn(line_len)), indexed by line_len (infinite for 0).
+
+    Only the line lengths that are looked up are computed (see
+    LogLineCosts): with fixed-point widths (see font_metrics), the
+    maximum line length can be 10**7 or more, while a paragraph has
+    far fewer distinct line lengths.
+    """
+    return LogLineCosts(cost_fn)
+
+
+def layout_log_cost(line_widths: LineWidths, starts: Sequence[int]) -> float:
+    """Cost of the layout with lines starting at starts, as
+    optimal_line_starts computes it: the sum of the logarithms of the
+    lines' costs, with the last line's cost 2 (see Notes.md#Cost_function)."""
+    sums = line_widths.sums
+    space_width = line_widths.space_width
+    log_costs = log_line_costs()
+    return LOG_LAST_LINE_COST + sum(
+        log_costs[sums[end] - sums[start] - space_width] for start, end in zip(starts, starts[1:])
+    )
+
+
+def optimal_line_starts(
+    line_widths: LineWidths, starts_fwd: Optional[List[int]] = None, starts_bck: Optional[List[int]] = None
+) -> List[int]:
+    """Optimal algorithm for flowing text in a paragraph - returns index of first word in each line.
+
+    starts_fwd and starts_bck are the results of line_by_line_starts
+    and line_by_line_reversed_starts, if they're already known.
+
+    The costs are summed as logarithms rather than multiplied (see
+    Notes.md#Cost_function), so that they don't overflow for long
+    paragraphs. For each word index in the slacks, the start of the
+    following line in the best layout from there is kept (line_words),
+    and the optimal layout is read off from the start of the paragraph
+    (see Notes.md#P_in_LINE-BREAKER).
+    """
+
+    instr = INSTRUMENTATION
+    if instr is not None:
+        start_time = time.perf_counter()
+    if starts_fwd is None:
+        starts_fwd = line_by_line_starts(line_widths)
+    if starts_bck is None:
+        starts_bck = line_by_line_reversed_starts(line_widths)
+    if instr is not None:
+        greedy_time = time.perf_counter()
+        instr.add('time_greedy', greedy_time - start_time)
+    assert len(starts_fwd) == len(starts_bck)
+    assert all(fwd >= bck for fwd, bck in zip(starts_fwd, starts_bck))
+    if len(starts_fwd) == 1:
+        assert starts_fwd == starts_bck
+        return starts_fwd
+
+    # cost[i] is cost function = log(C[(i,len(words)]), i ranging over indexes of words
     #     where C is the cost function from the "DYNAMIC" algorithm.
-    cost = len(words) * [INFINITE]
-    cost[lines_fwd[-1][0]] = 2.0
+    # line_words[i] is the number of words in the line starting at i, for cost[i].
+    cost = len(line_widths) * [INFINITE]
+    cost[starts_fwd[-1]] = LOG_LAST_LINE_COST
+    line_words = array('l', len(line_widths) * [0])
+    log_costs = log_line_costs()
 
     # loop on lines backwards
-    for lineno in reversed(range(0, len(lines_fwd) - 1)):
-        line_len = (
-            functools.reduce(
-                lambda total, width: total + space_width + width,
-                (words[i].width_min(max_width) for i in lines_fwd[lineno]),
-            )
-            - 1 - words[lines_fwd[lineno][0]].width_min(max_width)
+    iterations = 0
+    for lineno in reversed(range(0, len(starts_fwd) - 1)):
+        iterations += slack_costs(
+            line_widths,
+            0,
+            range(starts_bck[lineno], starts_fwd[lineno] + 1),
+            range(starts_bck[lineno + 1], starts_fwd[lineno + 1] + 1),
+            log_costs,
+            cost,
+            line_words,
         )
 
-        # loop over lineno-th slack
-        for slack in reversed(range(lines_bck[lineno][0], lines_fwd[lineno][0] + 1)):
-            line_len += space_width + words[slack].width_min(max_width)
-            line_and_slack_len = (
-                line_len + space_width + words[lines_fwd[lineno + 1][0]].width_min(max_width)
-            )
-            # cost[slack] has been already initialized to INFINITE
-
-            # loop over (lineno+1)-th slack
-            for slack_n1 in reversed(
-                range(lines_bck[lineno + 1][0], lines_fwd[lineno + 1][0] + 1)
-            ):
-                line_and_slack_len = (
-                    line_and_slack_len - space_width - words[slack_n1].width_min(max_width)
-                )
-                if line_and_slack_len <= max_width:
-                    # update cost[slack]  # TODO: see Notes.md#Cost_function
-                    new_cost = (1.0 + 1.0 / line_and_slack_len) * cost[slack_n1]
-                    if new_cost < cost[slack]:
-                        cost[slack] = new_cost
-                        optimal_break[lineno + 1] = slack_n1
-            # print('***', dict(lineno=lineno, slack=slack, slack_n1=slack_n1, optimal={lineno+1:optimal_break[lineno+1]}, cost={i:c for i,c in enumerate(cost) if c != INFINITE}))  # DO NOT SUBMIT
-
-    return [list(range(i, j)) for i, j in zip(optimal_break, optimal_break[1:])] + [
-        list(range(lines_fwd[-1][0], len(words)))
+    # retrieve optimal starting indices
+    starts = [0]
+    for _ in range(1, len(starts_fwd)):
+        starts.append(starts[-1] + line_words[starts[-1]])
+    assert starts[-1] == starts_fwd[-1]
+    if instr is not None:
+        instr.add('time_slack', time.perf_counter() - greedy_time)
+        record_slacks(instr, starts_fwd, starts_bck, iterations)
+    return starts
+
+
+def record_slacks(
+    instr: instrumentation.Instrumentation, starts_fwd: List[int], starts_bck: List[int], iterations: int
+) -> None:
+    """Record the slacks' size, the number of iterations of slack_costs'
+    inner loop, and the number of slacks for which slack_costs_monotone
+    was used."""
+    sizes = [fwd - bck + 1 for fwd, bck in zip(starts_fwd, starts_bck)]
+    instr.add('slack_size', sum(sizes))
+    instr.add('slack_iterations', iterations)
+    instr.add('slack_fallbacks', sum(product > MAX_SLACK_PRODUCT for product in map(operator.mul, sizes, sizes[1:])))
+
+
+# log(C[(I,N)]) for the last line (see Notes.md#Cost_function)
+LOG_LAST_LINE_COST = math.log(2.0)
+
+# Costs (logarithms) that differ by less than this are treated as
+# equal, so that rounding doesn't decide between equally good breaks.
+# It must be well below the differences between the costs of layouts
+# with fixed-point widths (e.g., 16.16, see font_metrics), where the
+# lines' costs are all close to 1, and their logarithms to 0.
+COST_EPSILON = 1e-13
+
+# If the product of the sizes of a line's slack and the following
+# line's slack is more than this, slack_costs uses slack_costs_monotone.
+MAX_SLACK_PRODUCT = 1 << 12
+
+
+def slack_costs(
+    line_widths: LineWidths,
+    offset: int,
+    slack_range: range,
+    slack_n1_range: range,
+    log_costs: LogLineCosts,
+    cost: List[float],
+    line_words: array,
+) -> int:
+    """Compute cost[slack] and line_words[slack] for each slack in a
+    line's slack, from cost[slack_n1] for the following line's slack.
+    Returns the number of line costs computed.
+
+    This is the body of the "loop on lines backwards" in LINE-BREAKER.
+    line_widths has the widths of words[offset:]; log_costs is from
+    log_line_costs. Of costs that are equal (within COST_EPSILON), the
+    one with the longest line is chosen.
+
+    The time is the product of the sizes of the slacks, which can be
+    quadratic in the number of words (e.g., for many 1-letter words
+    and a large max_width, when the greedy and reversed greedy breaks
+    are almost a line apart); above MAX_SLACK_PRODUCT,
+    slack_costs_monotone is used instead.
+    """
+    if len(slack_range) * len(slack_n1_range) > MAX_SLACK_PRODUCT:
+        return slack_costs_monotone(
+            line_widths, offset, slack_range, slack_n1_range, log_costs, cost, line_words
+        )
+    sums = line_widths.sums
+    max_width = line_widths.max_width
+    space_width = line_widths.space_width
+
+    # loop over lineno-th slack
+    for slack in reversed(slack_range):
+        line_start = sums[slack - offset] + space_width
+        best_cost = INFINITE
+        best_n1 = slack
+
+        # loop over (lineno+1)-th slack
+        for slack_n1 in reversed(slack_n1_range):
+            line_len = sums[slack_n1 - offset] - line_start  # == line_widths.span(slack, slack_n1)
+            if line_len <= max_width:
+                # update cost[slack]  # TODO: see Notes.md#Cost_function
+                new_cost = log_costs[line_len] + cost[slack_n1]
+                if new_cost < best_cost - COST_EPSILON:
+                    best_cost = new_cost
+                    best_n1 = slack_n1
+        cost[slack] = best_cost
+        line_words[slack] = best_n1 - slack
+    return len(slack_range) * len(slack_n1_range)
+
+
+def slack_costs_monotone(
+    line_widths: LineWidths,
+    offset: int,
+    slack_range: range,
+    slack_n1_range: range,
+    log_costs: LogLineCosts,
+    cost: List[float],
+    line_words: array,
+) -> int:
+    """slack_costs, in O((S + S_n1) log S) time rather than O(S * S_n1),
+    for slacks of size S and S_n1.
+
+    Because log(cost_fn(line_len)) is convex (see
+    Notes.md#Linear-time_optimal_breaks), the best slack_n1 for a slack
+    never decreases as slack increases. So the best slack_n1 for the
+    middle slack splits the remaining slacks into two halves, each with
+    part of the following line's slack to search (divide and conquer).
+    """
+    sums = line_widths.sums
+    max_width = line_widths.max_width
+    space_width = line_widths.space_width
+    iterations = 0
+
+    # (first slack, last slack, first slack_n1, last slack_n1)
+    pending = [(slack_range.start, slack_range.stop - 1, slack_n1_range.start, slack_n1_range.stop - 1)]
+    while pending:
+        first, last, first_n1, last_n1 = pending.pop()
+        slack = (first + last) // 2
+        line_start = sums[slack - offset] + space_width
+        best_cost = INFINITE
+        best_n1 = slack
+        for slack_n1 in range(last_n1, first_n1 - 1, -1):
+            line_len = sums[slack_n1 - offset] - line_start
+            if line_len <= max_width:
+                new_cost = log_costs[line_len] + cost[slack_n1]
+                if new_cost < best_cost - COST_EPSILON:
+                    best_cost = new_cost
+                    best_n1 = slack_n1
+        iterations += last_n1 - first_n1 + 1
+        cost[slack] = best_cost
+        line_words[slack] = best_n1 - slack
+        if best_cost == INFINITE:
+            # Every slack_n1 that has a cost is too far for a line from
+            # slack, so also from the slacks before it
+            for before in range(first, slack):
+                cost[before] = INFINITE
+                line_words[before] = 0
+            if slack < last:
+                pending.append((slack + 1, last, first_n1, last_n1))
+            continue
+        if first < slack:
+            pending.append((first, slack - 1, first_n1, best_n1))
+        if slack < last:
+            pending.append((slack + 1, last, best_n1, last_n1))
+    return iterations
+
+
+def optimal_line_starts_lines(
+    line_widths: LineWidths,
+    num_lines: int,
+    starts_fwd: Optional[List[int]] = None,
+    starts_bck: Optional[List[int]] = None,
+) -> Optional[List[int]]:
+    """The optimal layout with exactly num_lines lines (as
+    optimal_line_starts, which has the fewest lines) - returns index of
+    first word in each line, or None if there's no such layout (fewer
+    lines than line_by_line_starts, or more lines than words, or each
+    layout has a line of width 0, whose cost is infinite).
+
+    The slacks are as in optimal_line_starts, for extra lines more than
+    the fewest: the i-th line can start no later than starts_fwd[i]
+    (so that the lines before it can hold the words before it) and no
+    earlier than starts_bck[i - extra] (so that the lines from it can
+    hold the rest), and each line has at least one word. With extra
+    lines, the slacks of consecutive lines overlap, so the costs are
+    kept for each line's slack rather than for each word.
+    """
+    num_words = len(line_widths)
+    if starts_fwd is None:
+        starts_fwd = line_by_line_starts(line_widths)
+    if starts_bck is None:
+        starts_bck = line_by_line_reversed_starts(line_widths)
+    fewest = len(starts_fwd)
+    extra = num_lines - fewest
+    if extra < 0 or num_lines > max(num_words, 1):
+        return None
+    if extra == 0:
+        return optimal_line_starts(line_widths, starts_fwd, starts_bck)
+    sums = line_widths.sums
+    space_width = line_widths.space_width
+    limit = line_widths.max_width + space_width  # words[i:j] fit if sums[j] - sums[i] <= limit
+    log_costs = log_line_costs()
+    # The i-th line's slack is range(lows[i], highs[i] + 1)
+    lows = [max(lineno, starts_bck[lineno - extra]) if lineno >= extra else lineno for lineno in range(num_lines)]
+    highs = [
+        min(starts_fwd[lineno] if lineno < fewest else num_words, num_words - num_lines + lineno)
+        for lineno in range(num_lines)
+    ]
+
+    # cost_n1[k] is the cost of the best layout of the words from
+    # lows[lineno + 1] + k in the lines from lineno + 1; starts_n1[lineno][k]
+    # is the start of the line after the one starting at lows[lineno] + k
+    cost_n1 = [LOG_LAST_LINE_COST] * (highs[-1] - lows[-1] + 1)
+    starts_n1: List[array] = []
+    for lineno in reversed(range(num_lines - 1)):
+        low_n1 = lows[lineno + 1]
+        high_n1 = highs[lineno + 1]
+        # As in slack_costs_monotone, the best start_n1 never decreases
+        # as start increases, so the best start_n1 for the middle start
+        # bounds the search for the starts before and after it
+        low = lows[lineno]
+        cost = [INFINITE] * (highs[lineno] - low + 1)
+        line_starts_n1 = array('l', range(low, highs[lineno] + 1))
+        pending = [(low, highs[lineno], low_n1, high_n1)]
+        while pending:
+            first, last, first_n1, last_n1 = pending.pop()
+            start = (first + last) // 2
+            line_start = sums[start] + space_width
+            best_cost = INFINITE
+            best_n1 = start
+            stop_n1 = min(last_n1, bisect.bisect_right(sums, sums[start] + limit, start + 1, num_words + 1) - 1)
+            for start_n1 in range(stop_n1, max(first_n1, start + 1) - 1, -1):
+                # TODO: see Notes.md#Cost_function
+                new_cost = log_costs[sums[start_n1] - line_start] + cost_n1[start_n1 - low_n1]
+                if new_cost < best_cost - COST_EPSILON:
+                    best_cost = new_cost
+                    best_n1 = start_n1
+            cost[start - low] = best_cost
+            line_starts_n1[start - low] = best_n1
+            # If no line from start leads to the end (the lines are too
+            # long or too short), there's no bound
+            bound_low, bound_high = (first_n1, last_n1) if best_cost == INFINITE else (best_n1, best_n1)
+            if first < start:
+                pending.append((first, start - 1, first_n1, bound_high))
+            if start < last:
+                pending.append((start + 1, last, bound_low, last_n1))
+        starts_n1.append(line_starts_n1)
+        cost_n1 = cost
+    starts_n1.reverse()
+    if cost_n1[0] >= INFINITE:
+        return None
+
+    starts = [0]
+    for lineno in range(num_lines - 1):
+        starts.append(starts_n1[lineno][starts[-1] - lows[lineno]])
+    return starts
+
+
+def ranked_line_breaks(
+    words: List[Word], max_width: Width, space_width: Width = 1, looseness: Iterable[int] = (0,), k: int = 1
+) -> Dict[int, List[Tuple[float, LineBreaks]]]:
+    """ranked_line_starts for words - returns (cost, LineBreaks) for each layout."""
+    ranked = ranked_line_starts(LineWidths(words, max_width, space_width), looseness, k)
+    return {
+        loose: [(cost, LineBreaks(starts, len(words))) for cost, starts in layouts]
+        for loose, layouts in ranked.items()
+    }
+
+
+def ranked_line_starts(
+    line_widths: LineWidths,
+    looseness: Iterable[int] = (0,),
+    k: int = 1,
+    starts_fwd: Optional[List[int]] = None,
+    starts_bck: Optional[List[int]] = None,
+) -> Dict[int, List[Tuple[float, List[int]]]]:
+    """The k best layouts with the fewest lines plus each of looseness
+    (as TeX's \\looseness), from best to worst - returns, for each
+    looseness, a list of (cost, index of first word in each line), the
+    cost as layout_log_cost.
+
+    The fewest lines are those of line_by_line_starts, so there are no
+    layouts for a negative looseness, nor for more lines than words;
+    layouts with a line of width 0 (whose cost is infinite) are left
+    out. Of equal costs (within COST_EPSILON if k is 1), the layout
+    with the longest first line is ranked first.
+
+    All the numbers of lines are done in one backward pass over the
+    words. words[:start] takes at least as many lines as
+    line_by_line_starts gives it (fewest_to[start]), and words[start:]
+    at least as many as line_by_line_reversed_starts does
+    (fewest_from[start]). So for each start, the k best layouts of
+    words[start:] are kept for each number of lines from
+    fewest_from[start] to the most lines (fewest + the largest
+    looseness) less fewest_to[start], as (cost, start of the next line,
+    rank of the layout from there); the layouts are then read off from
+    the start of the paragraph. With only looseness 0, these are the
+    words in the slacks of optimal_line_starts.
+    """
+    looseness = sorted(set(looseness))
+    num_words = len(line_widths)
+    if starts_fwd is None:
+        starts_fwd = line_by_line_starts(line_widths)
+    if starts_bck is None:
+        starts_bck = line_by_line_reversed_starts(line_widths)
+    fewest = len(starts_fwd)
+    ranked: Dict[int, List[Tuple[float, List[int]]]] = {loose: [] for loose in looseness}
+    most_lines = fewest + (looseness[-1] if looseness else -1)
+    if most_lines < fewest or k < 1:
+        return ranked
+    if num_words == 0:
+        if 0 in ranked:
+            ranked[0].append((LOG_LAST_LINE_COST, [0]))
+        return ranked
+    sums = line_widths.sums
+    space_width = line_widths.space_width
+    limit = line_widths.max_width + space_width  # words[i:j] fit if sums[j] - sums[i] <= limit
+    log_costs = log_line_costs()
+
+    fewest_to = [0] * (num_words + 1)
+    fewest_from = [0] * (num_words + 1)
+    for lineno, (start_fwd, end_fwd) in enumerate(zip(starts_fwd, starts_fwd[1:] + [num_words])):
+        fewest_to[start_fwd + 1:end_fwd + 1] = [lineno + 1] * (end_fwd - start_fwd)
+    for lineno, (start_bck, end_bck) in enumerate(zip(starts_bck, starts_bck[1:] + [num_words])):
+        fewest_from[start_bck:end_bck] = [fewest - lineno] * (end_bck - start_bck)
+
+    # best[start][lines - fewest_from[start]] is the k best layouts of
+    # words[start:] in lines lines (the end of the paragraph is in 0 lines)
+    best: List[List[List[Tuple[float, int, int]]]] = [[]] * num_words + [[[(0.0, num_words, 0)]]]
+    by_cost = operator.itemgetter(0)
+    for start in reversed(range(num_words)):
+        fewest_lines = fewest_from[start]
+        num_counts = min(most_lines - fewest_to[start], num_words - start) - fewest_lines + 1
+        if num_counts <= 0:
+            continue
+        line_start = sums[start] + space_width
+        end = bisect.bisect_right(sums, sums[start] + limit, start + 1, num_words + 1) - 1
+        best_start: List[List[Tuple[float, int, int]]] = [[] for _ in range(num_counts)]
+        if k == 1:
+            # As in slack_costs_monotone, the best start of the next line
+            # doesn't decrease as start increases, nor as the number of
+            # lines decreases, so it's between the best with one more
+            # line and the best from start + 1 (Notes.md#Ranked_layouts)
+            best_after = best[start + 1]
+            count_after = fewest_lines - fewest_from[start + 1]
+            low_n1 = start + 1
+            for count in reversed(range(num_counts)):
+                high_n1 = end
+                if 0 <= count + count_after < len(best_after) and best_after[count + count_after][0][0] < INFINITE:
+                    high_n1 = min(best_after[count + count_after][0][1], end)
+                best_cost = INFINITE
+                best_n1 = low_n1
+                for start_n1 in range(high_n1, low_n1 - 1, -1):
+                    best_n1_layouts = best[start_n1]
+                    count_n1 = fewest_lines + count - 1 - fewest_from[start_n1]
+                    if 0 <= count_n1 < len(best_n1_layouts):
+                        # TODO: see Notes.md#Cost_function
+                        if start_n1 == num_words:
+                            cost_of_line = LOG_LAST_LINE_COST
+                        else:
+                            cost_of_line = log_costs[sums[start_n1] - line_start]
+                        new_cost = cost_of_line + best_n1_layouts[count_n1][0][0]
+                        if new_cost < best_cost - COST_EPSILON:
+                            best_cost = new_cost
+                            best_n1 = start_n1
+                best_start[count] = [(best_cost, best_n1, 0)]
+                if best_cost < INFINITE:
+                    low_n1 = best_n1
+        else:
+            # longest line first, so that it's ranked first of equal costs
+            for start_n1 in range(end, start, -1):
+                # TODO: see Notes.md#Cost_function
+                cost_of_line = LOG_LAST_LINE_COST if start_n1 == num_words else log_costs[sums[start_n1] - line_start]
+                best_n1_layouts = best[start_n1]
+                # lines - 1 == fewest_from[start_n1] + count_n1
+                count_n1 = fewest_lines - 1 - fewest_from[start_n1]
+                for count in range(max(-count_n1, 0), min(len(best_n1_layouts) - count_n1, num_counts)):
+                    best_start[count].extend(
+                        (cost_of_line + cost_n1, start_n1, rank)
+                        for rank, (cost_n1, _, _) in enumerate(best_n1_layouts[count + count_n1])
+                    )
+            best_start = [sorted(layouts, key=by_cost)[:k] for layouts in best_start]
+        best[start] = best_start
+
+    for loose in looseness:
+        if loose < 0 or loose >= len(best[0]):
+            continue
+        for rank, (cost, _, _) in enumerate(best[0][loose]):
+            if cost >= INFINITE:
+                break
+            starts = []
+            start = 0
+            count = loose
+            while start < num_words:
+                starts.append(start)
+                _, start_n1, rank = best[start][count][rank]
+                count += fewest_from[start] - 1 - fewest_from[start_n1]
+                start = start_n1
+            ranked[loose].append((cost, starts))
+    return ranked
+
+
+class IncrementalLayout:
+    """Optimal line breaks (as optimal_line_breaks) for a paragraph that
+    is being edited.
+
+    The greedy breaks (forward and reversed), the cost and line_words
+    for each word in the slacks (see optimal_line_starts) and the
+    optimal layout are kept between edits. After an edit:
+
+    - the greedy passes are redone from the edit, until their breaks
+      are the same as before (shifted by the change in the number of
+      words);
+
+    - the slack costs are redone for the lines whose slacks changed,
+      and then for the preceding lines until the new costs of a slack
+      differ from the previous ones by the same amount for all its
+      words (so the choices for the lines before it can't change);
+
+    - the layout is read off from that line until it rejoins the
+      previous layout.
+
+    So the work for an edit is proportional to the size of the edited
+    region rather than of the paragraph, apart from shifting the
+    indexes after the edit.
+
+    Because of the early stop, the costs of the slacks before an edit
+    can be off by a constant (per slack), which doesn't affect the
+    choice of breaks.
+
+    words: List[Word]
+    widths: array of int (or float), as in LineWidths
+    starts_fwd: array of int, from line_by_line_starts
+    starts_bck: array of int, from line_by_line_reversed_starts
+    cost, line_words: as in optimal_line_starts
+    starts: array of int, index of first word in each line of the optimal layout
+    """
+
+    # Maximum difference in the change of costs in a slack for the
+    # change to be considered the same for all its words
+    COST_TOLERANCE = 1e-9
+
+    def __init__(self, words: Iterable[Word], max_width: Width, space_width: Width = 1) -> None:
+        """Compute the layout of words.
+
+        If the widths are floats (see LineWidths), the words that are
+        inserted later must also have float widths.
+        """
+        self.words = list(words)
+        line_widths = LineWidths(self.words, max_width, space_width)
+        self.max_width = line_widths.max_width
+        self.space_width = line_widths.space_width
+        self.log_costs = log_line_costs()
+        self.widths = line_widths.widths
+        self.relayout()
+
+    def __len__(self) -> int:
+        """Number of words."""
+        return len(self.words)
+
+    def breaks(self) -> LineBreaks:
+        """The optimal line breaks."""
+        return LineBreaks(self.starts, len(self.words))
+
+    def insert(self, index: int, new_words: Iterable[Word]) -> None:
+        """Insert words before words[index]."""
+        self.replace(index, index, new_words)
+
+    def delete(self, start: int, end: int) -> None:
+        """Delete words[start:end]."""
+        self.replace(start, end, [])
+
+    def relayout(self) -> None:
+        """Compute the layout from scratch."""
+        line_widths = LineWidths.from_widths(self.widths, self.max_width, self.space_width)
+        self.starts_fwd = array('l', line_by_line_starts(line_widths))
+        self.starts_bck = array('l', line_by_line_reversed_starts(line_widths))
+        self.cost = len(self.words) * [INFINITE]
+        self.line_words = array('l', len(self.words) * [0])
+        self.set_last_line_cost()
+        for lineno in reversed(range(0, len(self.starts_fwd) - 1)):
+            self.slack_costs(lineno)
+        self.starts = self.read_layout(array('l', [0]), 0, 0, 0)
+
+    def replace(self, start: int, end: int, new_words: Iterable[Word]) -> None:
+        """Replace words[start:end] by new_words and update the layout."""
+        new_words = list(new_words)
+        old_num_words = len(self.words)
+        delta = len(new_words) - (end - start)
+        new_end = start + len(new_words)  # end of the replaced words, after the edit
+        self.words[start:end] = new_words
+        self.widths[start:end] = LineWidths(new_words, self.max_width, self.space_width).widths
+        self.cost[start:end] = len(new_words) * [INFINITE]
+        self.line_words[start:end] = array('l', len(new_words) * [0])
+        if old_num_words == 0 or not self.words:
+            self.relayout()
+            return
+
+        old_num_lines = len(self.starts_fwd)
+        fwd_lineno, fwd_tail = self.redo_line_by_line(start, new_end, delta)
+        bck_lineno, bck_tail = self.redo_line_by_line_reversed(start, end, delta)
+        num_lines = len(self.starts_fwd)
+        assert num_lines == len(self.starts_bck)
+        lines_delta = num_lines - old_num_lines
+
+        # Lines before first_changed have the same slacks as before, and
+        # all their words are before the edit; lines from first_unchanged
+        # on have the same slacks (shifted) and all their words are after it.
+        first_changed = min(fwd_lineno, bck_lineno)
+        while first_changed > 0 and self.starts_fwd[first_changed - 1] >= start:
+            first_changed -= 1
+        first_unchanged = max(fwd_tail, bck_tail)
+
+        if first_unchanged >= num_lines:
+            self.set_last_line_cost()
+        converged_lineno = 0
+        for lineno in reversed(range(0, min(first_unchanged, num_lines - 1))):
+            slack = range(self.starts_bck[lineno], self.starts_fwd[lineno] + 1)
+            if lineno < first_changed:
+                old_cost = [self.cost[i] for i in slack]
+            self.slack_costs(lineno)
+            if lineno < first_changed:
+                cost_deltas = [self.cost[i] - cost for i, cost in zip(slack, old_cost)]
+                if max(cost_deltas) - min(cost_deltas) <= self.COST_TOLERANCE:
+                    converged_lineno = lineno
+                    break
+
+        self.starts = self.read_layout(
+            self.starts[: converged_lineno + 1], first_unchanged, lines_delta, delta
+        )
+
+    def redo_line_by_line(self, start: int, new_end: int, delta: int) -> Tuple[int, int]:
+        """Update starts_fwd after replacing words before new_end,
+        starting from start, and changing the number of words by delta.
+
+        Returns the first line whose start can differ and the first
+        line of the unchanged (shifted) remainder.
+        """
+        old_fwd = self.starts_fwd
+        widths = self.widths
+        max_width = self.max_width
+        space_width = self.space_width
+        # Line lineno-1 changes only if its following word (lineno's first word) changes
+        lineno = bisect.bisect_right(old_fwd, start) - 1
+        if lineno > 0 and old_fwd[lineno] == start:
+            lineno -= 1
+        starts = old_fwd[: lineno + 1]
+        tail_lineno = None
+        line_width = -space_width
+        for i in range(old_fwd[lineno], len(widths)):
+            line_width += space_width + widths[i]
+            if line_width > max_width:
+                starts.append(i)
+                line_width = widths[i]
+                if i >= new_end:
+                    old_lineno = bisect.bisect_left(old_fwd, i - delta)
+                    if old_lineno < len(old_fwd) and old_fwd[old_lineno] == i - delta:
+                        tail_lineno = len(starts) - 1
+                        starts.extend(old_start + delta for old_start in old_fwd[old_lineno + 1 :])
+                        break
+        self.starts_fwd = starts
+        return lineno + 1, len(starts) if tail_lineno is None else tail_lineno
+
+    def redo_line_by_line_reversed(self, start: int, end: int, delta: int) -> Tuple[int, int]:
+        """Update starts_bck after replacing words[start:end] (before
+        the edit), changing the number of words by delta.
+
+        Returns the first line whose start can differ and the first
+        line of the unchanged (shifted) remainder.
+        """
+        old_bck = self.starts_bck
+        widths = self.widths
+        max_width = self.max_width
+        space_width = self.space_width
+        # Lines that start after the first word after the edit don't change
+        old_tail = bisect.bisect_right(old_bck, end)
+        tail = array('l', (old_start + delta for old_start in old_bck[old_tail:]))
+        rev_starts = array('l')  # in reverse order
+        head_len = 1
+        line_width = -space_width
+        for i in reversed(range(0, tail[0] if tail else len(widths))):
+            line_width += space_width + widths[i]
+            if line_width > max_width:
+                line_width = widths[i]
+                if i + 1 <= start:
+                    old_lineno = bisect.bisect_left(old_bck, i + 1)
+                    if old_lineno < len(old_bck) and old_bck[old_lineno] == i + 1:
+                        head_len = old_lineno + 1
+                        break
+                rev_starts.append(i + 1)
+        rev_starts.reverse()
+        self.starts_bck = old_bck[:head_len] + rev_starts + tail
+        return head_len, head_len + len(rev_starts)
+
+    def set_last_line_cost(self) -> None:
+        """Set the costs for the slack of the last line."""
+        if not self.words:
+            return
+        for i in range(self.starts_bck[-1], self.starts_fwd[-1]):
+            self.cost[i] = INFINITE
+        self.cost[self.starts_fwd[-1]] = LOG_LAST_LINE_COST
+
+    def slack_costs(self, lineno: int) -> None:
+        """Compute cost and line_words for lineno's slack (see slack_costs)."""
+        offset = self.starts_bck[lineno]
+        end = self.starts_fwd[lineno + 1] + 1
+        slack_costs(
+            LineWidths.from_widths(self.widths[offset:end], self.max_width, self.space_width),
+            offset,
+            range(self.starts_bck[lineno], self.starts_fwd[lineno] + 1),
+            range(self.starts_bck[lineno + 1], self.starts_fwd[lineno + 1] + 1),
+            self.log_costs,
+            self.cost,
+            self.line_words,
+        )
+
+    def read_layout(self, starts: array, first_unchanged: int, lines_delta: int, delta: int) -> array:
+        """Read off the optimal layout, continuing from starts (the
+        previous layout's first lines) until it rejoins the previous
+        layout in line first_unchanged or later (where the line numbers
+        have changed by lines_delta and the word indexes by delta)."""
+        num_lines = len(self.starts_fwd)
+        for lineno in range(len(starts), num_lines):
+            start = starts[-1] + self.line_words[starts[-1]]
+            starts.append(start)
+            if lineno >= first_unchanged > 0:
+                old_lineno = lineno - lines_delta
+                if self.starts[old_lineno] + delta == start:
+                    starts.extend(old_start + delta for old_start in self.starts[old_lineno + 1 :])
+                    break
+        assert len(starts) == num_lines and starts[-1] == self.starts_fwd[-1]
+        return starts
+
+
+def optimal_line_indexes_linear(
+    words: List[Word], max_width: Width, space_width: Width = 1
+) -> List[List[int]]:
+    """Optimal algorithm for flowing text in a paragraph, over all possible breaks."""
+    return optimal_line_breaks_linear(words, max_width, space_width).to_lists()
+
+
+def optimal_line_breaks_linear(words: List[Word], max_width: Width, space_width: Width = 1) -> LineBreaks:
+    """Optimal algorithm for flowing text in a paragraph, over all possible breaks - returns LineBreaks."""
+    return LineBreaks(
+        optimal_line_starts_linear(LineWidths(words, max_width, space_width)), len(words)
+    )
+
+
+def optimal_line_starts_linear(
+    line_widths: LineWidths, cost_fn: Callable[[int], float] = line_cost
+) -> List[int]:
+    """Optimal algorithm for flowing text in a paragraph, over all possible
+    breaks - returns index of first word in each line.
+
+    This computes the same breaks as DYNAMIC in line_break_from_paper
+    (the last line is the same as for the greedy algorithm and the
+    other lines minimize the product of their costs), but in
+    O(N log(words per line)) time and O(N) space, instead of O(N^3)
+    and O(N^2).
+
+    best[j] is the minimum cost of formatting words[:j] as complete
+    lines; it is the minimum over i of best[i] * cost_fn(span(i, j)).
+    The costs are kept as logarithms (sums instead of products), so
+    that they don't overflow for long paragraphs. Because
+    log(cost_fn(line_len)) is convex (which must also hold for any
+    other cost_fn), the best i is nondecreasing in j: once a later i
+    is at least as good as an earlier one for some j, it stays so for
+    all larger j. So the candidates can be kept in a queue, each with
+    the first j for which it's the best, and the point at which a new
+    candidate overtakes the last one found by binary search. Ties are
+    resolved in favor of the later i (the shorter line), as in
+    LineBreak.split_point.
+    """
+    last_start = line_by_line_starts(line_widths)[-1]
+    if last_start == 0:
+        return [0]
+
+    sums = line_widths.sums
+    max_width = line_widths.max_width
+    space_width = line_widths.space_width
+    infinite = math.inf
+    log_cost = log_line_costs(cost_fn)
+
+    best = (last_start + 1) * [infinite]
+    best[0] = 0.0
+    best_start = array('l', (last_start + 1) * [0])  # best_start[j]: first word of line ending at j
+
+    def cost_to(i: int, j: int) -> float:
+        line_len = sums[j] - sums[i] - space_width
+        return best[i] + log_cost[line_len] if line_len <= max_width else infinite
+
+    # The queue of candidates (starting at queue_head), with queue_from[k]
+    # being the first j for which queue[k] is the best.
+    queue: List[int] = []
+    queue_from: List[int] = []
+    queue_head = 0
+    for j in range(1, last_start + 1):
+        # Add i = j - 1, whose best[i] is now known, as a candidate
+        i = j - 1
+        while len(queue) > queue_head:
+            prev = queue[-1]
+            prev_from = max(queue_from[-1], j)
+            if cost_to(i, prev_from) <= cost_to(prev, prev_from):
+                queue.pop()
+                queue_from.pop()
+                continue
+            # Beyond prev's longest line, i is better; search up to there
+            lo = prev_from + 1
+            hi = min(bisect.bisect_right(sums, sums[prev] + space_width + max_width), last_start + 1)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if cost_to(i, mid) <= cost_to(prev, mid):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            if lo <= last_start:
+                queue.append(i)
+                queue_from.append(lo)
+            break
+        else:
+            queue.append(i)
+            queue_from.append(j)
+        while queue_head + 1 < len(queue) and queue_from[queue_head + 1] <= j:
+            queue_head += 1
+        best_start[j] = queue[queue_head]
+        best[j] = cost_to(queue[queue_head], j)
+
+    # retrieve the optimal starting indices, from the last line backwards
+    starts = [last_start]
+    while starts[-1] > 0:
+        starts.append(best_start[starts[-1]])
+    starts.reverse()
+    return starts
+
+
+# Added to the cost (a logarithm) of a line that ends with a hyphen;
+# for line widths of about 50 characters, this allows about one line
+# in 10 to be hyphenated.
+HYPHEN_PENALTY = 0.002
+
+# Hyphenation points of a word: the offsets in its text where it can
+# be broken with a hyphen (e.g., [2, 6] for 'hyphenation'; see
+# hyphenation.Hyphenator.positions)
+HyphenateFn = Callable[[str], Sequence[int]]
+
+
+def optimal_line_breaks_hyphenated(
+    words: List[Word],
+    max_width: Width,
+    space_width: Width = 1,
+    hyphenate: Optional[HyphenateFn] = None,
+    text_width: Callable[[str], Width] = word_width,
+    hyphen_penalty: float = HYPHEN_PENALTY,
+) -> Tuple[List[Word], LineBreaks]:
+    """Optimal algorithm for flowing text in a paragraph, also breaking
+    words at their hyphenation points - returns the words (with each
+    broken word replaced by its parts, all but the last ending in '-')
+    and LineBreaks for them.
+
+    As suggested in section 5 of the paper, the hyphenation points are
+    ignored by the greedy passes (so there are as many lines as for
+    optimal_line_breaks) and are only considered when computing the
+    costs of the slacks: a line can start at a hyphenation point of a
+    word in its slack, as well as at the word. So only the words in
+    the slacks are hyphenated, as they're needed; hyphenate should be
+    memoized (as Hyphenator.positions is).
+
+    text_width measures the parts of broken words; it must give the
+    same widths as the words have (a word whose width is different,
+    e.g. because it's wider than max_width, isn't broken).
+    hyphen_penalty is added to the cost (a logarithm, see
+    optimal_line_starts) of each line that ends with a hyphen.
+    """
+    line_widths = LineWidths(words, max_width, space_width)
+    starts_fwd = line_by_line_starts(line_widths)
+    starts_bck = line_by_line_reversed_starts(line_widths)
+    if hyphenate is None or len(starts_fwd) <= 2:
+        # There are no slacks to hyphenate (the first and last lines' starts are fixed)
+        return words, LineBreaks(optimal_line_starts(line_widths), len(words))
+
+    widths = line_widths.widths
+    sums = line_widths.sums
+    max_width = line_widths.max_width
+    space_width = line_widths.space_width
+    log_costs = log_line_costs()
+    last_lineno = len(starts_fwd) - 1
+
+    def measure(text: str) -> Width:
+        """text_width(text), rounded as in LineWidths."""
+        width = text_width(text)
+        return round_width(width) if widths.typecode == 'd' else width
+
+    def cut_width(word: int, offset: int) -> Width:
+        """Width of words[word] that's before offset, if a line starts there."""
+        return widths[word] - measure(words[word].text[offset:]) if offset else 0
+
+    def end_width(word: int, offset: int) -> Width:
+        """Width of words[word] (and the space before it) that's before
+        offset, if a line ends there - less a space_width."""
+        return measure(words[word].text[:offset] + '-') if offset else -space_width
+
+    def slack_positions(lineno: int) -> List[Tuple[int, int, Width, Width]]:
+        """The places where the lineno-th line can start: (word, offset, cut_width, end_width)."""
+        positions = []
+        for word in range(starts_bck[lineno], starts_fwd[lineno] + 1):
+            positions.append((word, 0, 0, -space_width))
+            text = words[word].text
+            offsets = hyphenate(text)
+            if offsets and measure(text) == widths[word]:
+                for offset in offsets:
+                    positions.append((word, offset, cut_width(word, offset), end_width(word, offset)))
+        return positions
+
+    # As in optimal_line_starts, but over the positions of each slack
+    # (slacks[lineno]), with choices[lineno][k] being the index in
+    # slacks[lineno + 1] of the start of the line following the k-th
+    # position.
+    slacks = [[(starts_fwd[last_lineno], 0, 0, -space_width)]]
+    choices = []
+    n1_costs = [LOG_LAST_LINE_COST]
+    for lineno in reversed(range(0, last_lineno)):
+        positions = [(0, 0, 0, -space_width)] if lineno == 0 else slack_positions(lineno)
+        positions_n1 = slacks[-1]
+        costs = []
+        line_choices = array('l')
+        for word, _, word_cut_width, _ in positions:
+            line_start = sums[word] + word_cut_width
+            best_cost = INFINITE
+            best_k = 0
+            for k in reversed(range(len(positions_n1))):
+                word_n1, offset_n1, _, word_n1_end_width = positions_n1[k]
+                line_len = sums[word_n1] + word_n1_end_width - line_start
+                if line_len <= max_width:
+                    # TODO: see Notes.md#Cost_function
+                    new_cost = log_costs[line_len] + n1_costs[k]
+                    if offset_n1:
+                        new_cost += hyphen_penalty
+                    if new_cost < best_cost - COST_EPSILON:
+                        best_cost = new_cost
+                        best_k = k
+            costs.append(best_cost)
+            line_choices.append(best_k)
+        slacks.append(positions)
+        choices.append(line_choices)
+        n1_costs = costs
+    slacks.reverse()
+    choices.reverse()
+
+    # retrieve the optimal starts, as (word, offset)
+    line_starts = []
+    k = 0
+    for lineno in range(0, last_lineno):
+        line_starts.append(slacks[lineno][k][:2])
+        k = choices[lineno][k]
+    line_starts.append((starts_fwd[last_lineno], 0))
+
+    # split the broken words into their parts
+    cuts: Dict[int, List[int]] = {}
+    for word, offset in line_starts:
+        if offset:
+            cuts.setdefault(word, []).append(offset)
+    new_words: List[Word] = []
+    part_index: Dict[Tuple[int, int], int] = {}  # index in new_words of (word, offset)
+    done = 0
+    for word in sorted(cuts):
+        new_words.extend(words[done:word])
+        text = words[word].text
+        offsets = [0] + cuts[word]
+        for offset, end_offset in zip(offsets, offsets[1:]):
+            part_index[(word, offset)] = len(new_words)
+            part_width = end_width(word, end_offset) - cut_width(word, offset)
+            new_words.append(Word(text[offset:end_offset] + '-', part_width))
+        part_index[(word, offsets[-1])] = len(new_words)
+        new_words.append(Word(text[offsets[-1]:], widths[word] - cut_width(word, offsets[-1])))
+        done = word + 1
+    new_words.extend(words[done:])
+    cut_words = sorted(cuts)
+    num_parts_before = list(itertools.accumulate((len(cuts[word]) for word in cut_words), initial=0))
+    new_starts = [
+        part_index.get((word, offset), word + num_parts_before[bisect.bisect_left(cut_words, word)])
+        for word, offset in line_starts
     ]
+    return new_words, LineBreaks(new_starts, len(new_words))
 
 
 def text_to_words(text: str) -> List[Word]:
-    """Split arbitrary text into list of Word."""
-    return split_text_to_words(split_text(text))
+    """Split arbitrary text into list of Word.
+
+    Repeated words are the same Word (see Vocabulary).
+    """
+    return VOCABULARY.words(split_text(text))
 
 
 def split_text_to_words(words: Iterable[str]) -> List[Word]:
-    """Transform split text into list of Word."""
-    return [Word(word, len(word)) for word in words]
+    """Transform split text into list of Word (with word_width)."""
+    return [Word(word, word_width(word)) for word in words]
+
+
+class Vocabulary(dict):
+    """A table of Word's, by their text, so that repeated words share
+    the same (interned) str and Word.
+
+    This makes tokenizing faster (a Word is only created the first
+    time its text is seen) and reduces the memory and garbage
+    collection for long texts. The table is emptied when it has
+    max_entries words, so its size is bounded but the common words
+    are soon back in it.
+
+    Looking up a text (vocabulary[text]) adds it if it's missing, with
+    width width_fn(text) (by default, word_width).
+    """
+
+    def __init__(
+        self, max_entries: int = 1 << 16, width_fn: Callable[[str], Width] = word_width
+    ) -> None:
+        """Create an empty vocabulary."""
+        super().__init__()
+        self.max_entries = max_entries
+        self.width_fn = width_fn
+
+    def __missing__(self, text: str) -> Word:
+        """Add a Word for text."""
+        if len(self) >= self.max_entries:
+            self.clear()
+        text = sys.intern(text)
+        word = self[text] = Word(text, self.width_fn(text))
+        return word
+
+    def words(self, texts: Iterable[str]) -> List[Word]:
+        """Transform split text into list of Word (as split_text_to_words)."""
+        return list(map(self.__getitem__, texts))
+
+    def texts_widths(self, texts: Iterable[str]) -> Tuple[List[str], array]:
+        """Transform split text into parallel lists of the (interned)
+        texts and of their widths, without creating Word's (the widths
+        can be used for LineWidths.from_widths)."""
+        words = self.words(texts)
+        return list(map(WORD_TEXT, words)), widths_array(list(map(WORD_WIDTH, words)))
+
+
+# The Vocabulary used by text_to_words
+VOCABULARY = Vocabulary()
 
 
 def split_text(text: str) -> List[str]:
@@ -179,29 +1541,17 @@ def split_text(text: str) -> List[str]:
     return text.split()
 
 
-def line_by_line_indexes(words: Iterable[Word], max_width: int, space_width=1) -> List[List[int]]:
+def line_by_line_indexes(words: Iterable[Word], max_width: Width, space_width: Width = 1) -> List[List[int]]:
     """Greedy algorithm for flowing text in a paragraph - returns indexes into words.
 
     Assumes words has been run through adjust_words or produced by
     split_text_to_words with max_width specified.
     """
-    curr_line: List[int] = []
-    lines: List[List[int]] = []
-    line_width = -space_width
-    for i, word in enumerate(words):
-        line_width += space_width + word.width_min(max_width)
-        if line_width > max_width:
-            lines.append(curr_line)
-            line_width = word.width_min(max_width)
-            curr_line = [i]
-        else:
-            curr_line.append(i)
-    lines.append(curr_line)
-    return lines
+    return line_by_line_breaks(words, max_width, space_width).to_lists()
 
 
 def line_by_line_reversed_indexes(
-    words: List[Word], max_width: int, space_width=1
+    words: List[Word], max_width: Width, space_width: Width = 1
 ) -> List[List[int]]:
     """Greedy algorithm for flowing text in a paragraph, with the lines
     being assigned in reverse order - returns indexes into words.
@@ -209,62 +1559,894 @@ def line_by_line_reversed_indexes(
     Assumes words has been run through adjust_words or produced by
     split_text_to_words with max_width specified.
     """
-    curr_line: List[int] = []
-    lines: List[List[int]] = []
+    return line_by_line_reversed_breaks(words, max_width, space_width).to_lists()
+
+
+def line_by_line_breaks(words: Iterable[Word], max_width: Width, space_width: Width = 1) -> LineBreaks:
+    """Greedy algorithm for flowing text in a paragraph - returns LineBreaks."""
+    line_widths = LineWidths(words, max_width, space_width)
+    return LineBreaks(line_by_line_starts(line_widths), len(line_widths))
+
+
+def line_by_line_reversed_breaks(words: List[Word], max_width: Width, space_width: Width = 1) -> LineBreaks:
+    """Greedy algorithm for flowing text in a paragraph, with the lines
+    being assigned in reverse order - returns LineBreaks.
+    """
+    return LineBreaks(
+        line_by_line_reversed_starts(LineWidths(words, max_width, space_width)), len(words)
+    )
+
+
+# The greedy passes search the cumulative widths for each line's end
+# (or start) if the lines average at least this many words; for fewer,
+# adding up the words' widths one at a time is faster
+GREEDY_SEARCH_MIN_WORDS = 12
+
+
+def line_by_line_starts(line_widths: LineWidths) -> List[int]:
+    """Greedy algorithm for flowing text in a paragraph - returns index of first word in each line."""
+    max_width = line_widths.max_width
+    space_width = line_widths.space_width
+    sums = line_widths.sums
+    num_words = len(line_widths)
+    limit = max_width + space_width  # words[i:j] fit if sums[j] - sums[i] <= limit
+    if limit * num_words >= GREEDY_SEARCH_MIN_WORDS * sums[num_words]:
+        # A line has at most limit // space_width words, which bounds the search
+        span = int(limit // space_width) + 1 if space_width > 0 else num_words
+        starts = [0]
+        start = 0
+        while True:
+            end = bisect.bisect_right(sums, sums[start] + limit, start + 2, min(start + span, num_words) + 1) - 1
+            if end >= num_words:
+                return starts
+            starts.append(end)
+            start = end
+    starts = [0]
     line_width = -space_width
-    for i, word in reversed(list(enumerate(words))):
-        line_width += space_width + word.width_min(max_width)
+    for i, width in enumerate(line_widths.widths):
+        line_width += space_width + width
         if line_width > max_width:
-            lines.insert(0, curr_line)
-            line_width = word.width_min(max_width)
-            curr_line = [i]
+            starts.append(i)
+            line_width = width
+    return starts
+
+
+def line_by_line_reversed_starts(line_widths: LineWidths) -> List[int]:
+    """Greedy algorithm for flowing text in a paragraph, with the lines
+    being assigned in reverse order - returns index of first word in each line.
+    """
+    max_width = line_widths.max_width
+    space_width = line_widths.space_width
+    widths = line_widths.widths
+    sums = line_widths.sums
+    num_words = len(widths)
+    limit = max_width + space_width
+    starts = []  # in reverse order; the first line's start (0) is added at the end
+    if limit * num_words >= GREEDY_SEARCH_MIN_WORDS * sums[num_words]:  # as line_by_line_starts
+        span = int(limit // space_width) + 1 if space_width > 0 else num_words
+        end = num_words
+        while True:
+            start = bisect.bisect_left(sums, sums[end] - limit, max(end - span, 0), end - 1)
+            if start <= 0:
+                break
+            starts.append(start)
+            end = start
+        starts.append(0)
+        starts.reverse()
+        return starts
+    line_width = -space_width
+    for i in reversed(range(len(widths))):
+        line_width += space_width + widths[i]
+        if line_width > max_width:
+            starts.append(i + 1)
+            line_width = widths[i]
+    starts.append(0)
+    starts.reverse()
+    return starts
+
+
+def line_by_line_starts_reusing(line_widths: LineWidths, prev_starts: Sequence[int]) -> List[int]:
+    """line_by_line_starts, reusing the lines in prev_starts (the greedy
+    line starts for other widths, e.g., the next smaller max_width)
+    where they're the same.
+
+    A line from prev_starts is the same if it fits and the following
+    word doesn't, which takes O(1) rather than a pass over its words;
+    after a line that differs, the lines are computed until a line
+    starts where one in prev_starts does.
+    """
+    sums = line_widths.sums
+    num_words = len(line_widths)
+    limit = line_widths.max_width + line_widths.space_width  # words[i:j] fit if sums[j] - sums[i] <= limit
+    num_prev = len(prev_starts)
+    starts = [0]
+    start = 0
+    prev_i = 0
+    while True:
+        while prev_i < num_prev and prev_starts[prev_i] < start:
+            prev_i += 1
+        line_limit = sums[start] + limit
+        if prev_i < num_prev and prev_starts[prev_i] == start:
+            end = prev_starts[prev_i + 1] if prev_i + 1 < num_prev else num_words
+            if not (sums[end] <= line_limit and (end == num_words or sums[end + 1] > line_limit)):
+                end = start + 1
+                while end < num_words and sums[end + 1] <= line_limit:
+                    end += 1
         else:
-            curr_line.insert(0, i)
-    lines.insert(0, curr_line)
-    return lines
+            end = start + 1
+            while end < num_words and sums[end + 1] <= line_limit:
+                end += 1
+        if end >= num_words:
+            return starts
+        starts.append(end)
+        start = end
+
+
+def line_by_line_reversed_starts_reusing(line_widths: LineWidths, prev_starts: Sequence[int]) -> List[int]:
+    """line_by_line_reversed_starts, reusing the lines in prev_starts
+    where they're the same (as line_by_line_starts_reusing)."""
+    sums = line_widths.sums
+    num_words = len(line_widths)
+    limit = line_widths.max_width + line_widths.space_width
+    bounds = list(prev_starts)  # start of each line in prev_starts, and the end of the last one
+    bounds.append(num_words)
+    starts = []  # in reverse order, as in line_by_line_reversed_starts
+    end = num_words
+    prev_i = len(bounds) - 1
+    while end > 0:
+        while prev_i > 0 and bounds[prev_i] > end:
+            prev_i -= 1
+        line_limit = sums[end] - limit
+        if prev_i > 0 and bounds[prev_i] == end:
+            start = bounds[prev_i - 1]
+            if not (sums[start] >= line_limit and (start == 0 or sums[start - 1] < line_limit)):
+                start = end - 1
+                while start > 0 and sums[start - 1] >= line_limit:
+                    start -= 1
+        else:
+            start = end - 1
+            while start > 0 and sums[start - 1] >= line_limit:
+                start -= 1
+        if start == 0:
+            break
+        starts.append(start)
+        end = start
+    starts.append(0)
+    starts.reverse()
+    return starts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Main (uses sys.argv if argv is None)."""
+    # TODO: move this to __main__.py
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['reflow']:
+        return reflow_main(argv[1:])
+    parser = argparse.ArgumentParser(
+        description='Reads from standard input, formatting each paragraph to LINEWIDTH characters.',
+        epilog='See also: "reflow --help" for formatting a file to another file.',
+    )
+    parser.add_argument('max_width', metavar='LINEWIDTH', type=line_width)
+    parser.add_argument(
+        '--jobs', '-j', metavar='N', type=int, default=1,
+        help='number of processes for formatting paragraphs (0: number of CPUs)',
+    )
+    parser.add_argument(
+        '--cache', metavar='N', type=int, default=0,
+        help='cache the layouts of up to N distinct paragraphs (in each process)',
+    )
+    parser.add_argument(
+        '--cache-stats', action='store_true',
+        help='output the cache statistics to standard error',
+    )
+    parser.add_argument(
+        '--structured', action='store_true',
+        help='keep code blocks, list items and indentation, and paragraphs that are already formatted',
+    )
+    parser.add_argument(
+        '--keep-fitting', action='store_true',
+        help='as --structured, also keeping paragraphs whose lines fit and are as few as possible',
+    )
+    add_stats_arguments(parser)
+    args = parser.parse_args(argv)
+    cache = LayoutCache(args.cache) if args.cache > 0 else None
+    with instrumented(args):
+        format_stream(
+            sys.stdin,
+            sys.stdout,
+            args.max_width,
+            jobs=args.jobs or os.cpu_count() or 1,
+            cache=cache,
+            structured=args.structured,
+            keep_fitting=args.keep_fitting,
+        )
+    if cache is not None and args.cache_stats:
+        print('cache:', ' '.join(f'{name}={value}' for name, value in cache.stats().items()),
+              file=sys.stderr)
+    return 0
+
+
+def reflow_main(argv: List[str]) -> int:
+    """Main for "reflow INPUT OUTPUT --width N"."""
+    parser = argparse.ArgumentParser(
+        prog=f'{os.path.basename(sys.argv[0])} reflow',
+        description='Formats each paragraph in INPUT to N characters, writing to OUTPUT.',
+    )
+    parser.add_argument('input_path', metavar='INPUT')
+    parser.add_argument('output_path', metavar='OUTPUT')
+    parser.add_argument('--width', '-w', metavar='N', type=line_width, required=True)
+    add_stats_arguments(parser)
+    args = parser.parse_args(argv)
+    with instrumented(args):
+        reflow_file(args.input_path, args.output_path, args.width)
+    return 0
+
+
+def line_width(text: str) -> int:
+    """argparse type for a line width (an int, at least 1)."""
+    width = int(text)
+    try:
+        check_max_width(width)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from exc
+    return width
+
+
+def add_stats_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the --stats and --stats-file options (see instrumented)."""
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='output timings and counters (totals and maxima over the paragraphs) to standard error',
+    )
+    parser.add_argument(
+        '--stats-file', metavar='FILE',
+        help="write each paragraph's timings and counters to FILE, as JSON lines",
+    )
+
+
+@contextlib.contextmanager
+def instrumented(args: argparse.Namespace) -> Iterator[None]:
+    """Set INSTRUMENTATION for the --stats and --stats-file options.
+
+    Paragraphs formatted by worker processes (--jobs) aren't included.
+    """
+    if not args.stats and not args.stats_file:
+        yield
+        return
+    aggregator = instrumentation.Aggregator()
+    with contextlib.ExitStack() as stack:
+        sinks: List[instrumentation.Sink] = [aggregator]
+        if args.stats_file:
+            sinks.append(instrumentation.JsonLinesSink(stack.enter_context(open(args.stats_file, 'w'))))
+        previous = instrument(instrumentation.Instrumentation(sinks))
+        try:
+            yield
+        finally:
+            instrument(previous).close()
+    if args.stats:
+        summary = aggregator.summary()
+        print('stats:', ' '.join(f'{name}={round(value, 6)}' for name, value in summary.items()), file=sys.stderr)
+
+
+def check_max_width(max_width: Width) -> None:
+    """Raise ValueError if max_width (a line width) is less than 1."""
+    if max_width < 1:
+        raise ValueError(f'Width must be at least 1 (got {max_width})')
+
+
+def format_stream(
+    infile: TextIO,
+    outfile: TextIO,
+    max_width: int,
+    line_indexes: LineIndexesFn = optimal_line_breaks,
+    jobs=1,
+    cache: Optional[LayoutCache] = None,
+    structured: bool = False,
+    keep_fitting: bool = False,
+) -> None:
+    """Format each paragraph from infile to outfile, as soon as it has been read.
+
+    Only one paragraph at a time is held in memory (or, with jobs > 1,
+    the paragraphs being formatted by the worker processes). The
+    paragraphs are separated by a blank line in the output.
+
+    If structured (or keep_fitting), the paragraphs are formatted with
+    format_structured_paragraph.
+    """
+    check_max_width(max_width)
+    paragraphs: Iterable[str] = read_paragraphs(infile)
+    format_fn: FormatParagraphFn = format_paragraph
+    if structured or keep_fitting:
+        paragraphs = join_fenced_paragraphs(paragraphs)
+        format_fn = functools.partial(format_structured_paragraph, keep_fitting=keep_fitting)
+    para_break = ''
+    for formatted in format_paragraphs_parallel(
+        paragraphs, max_width, jobs, line_indexes, cache=cache, format_fn=format_fn
+    ):
+        outfile.write(para_break)
+        para_break = '\n'
+        outfile.write(formatted)
+
 
+# Number of characters of paragraphs sent to a worker process at a time
+# by format_paragraphs_parallel.
+PARALLEL_CHUNK_SIZE = 1 << 16
 
-def main() -> int:
-    """Main (uses sys.argv)."""
-    # TODO: move this to __main__.py with proper options processing
-    if len(sys.argv) == 2 and sys.argv[1].isdigit():
-        max_width = int(sys.argv[1])
-        para_break = ''
-        for para in split_paragraphs(sys.stdin.read()):
-            print(para_break, end='')
-            para_break = '\n'
-            # print('===')
-            # print(para)
-            # print('===')
-            # print(text_to_words(para))
-            # print('===')
-            # print(optimal_line_indexes(text_to_words(para), max_width))
-            # print('===')
-            for line in indexes_to_texts(
-                    optimal_line_indexes, text_to_words(para), max_width):
-                # TODO: line_adjust.distribute_spaces, etc.
-                print(' '.join(line))
-        return 0
+
+def format_paragraphs_parallel(
+    paragraphs: Iterable[str],
+    max_width: int,
+    workers: int,
+    line_indexes: LineIndexesFn = optimal_line_breaks,
+    chunk_size: int = PARALLEL_CHUNK_SIZE,
+    cache: Optional[LayoutCache] = None,
+    format_fn: Optional[FormatParagraphFn] = None,
+) -> Iterator[str]:
+    """Format paragraphs (with format_fn, by default format_paragraph)
+    using a pool of worker processes, yielding the formatted paragraphs
+    in their original order.
+
+    The paragraphs are sent to the workers in chunks of about
+    chunk_size characters, with at most 2 chunks per worker in
+    progress at a time. If there's only one chunk (or only one
+    worker), the paragraphs are formatted in this process, because
+    the cost of sending them to a worker is more than the savings.
+
+    If cache is given, it's used for the paragraphs formatted in this
+    process; each worker process gets its own LayoutCache with the
+    same limits, whose statistics are added to cache's when the worker
+    processes are done (see LayoutCache.add_worker_stats).
+    """
+    if format_fn is None:
+        format_fn = format_paragraph
+    if workers <= 1:
+        for para in paragraphs:
+            yield format_fn(para, max_width, line_indexes, cache)
+        return
+    chunks = chunk_paragraphs(paragraphs, chunk_size)
+    first_chunks = list(itertools.islice(chunks, 2))
+    if len(first_chunks) <= 1:
+        for chunk in first_chunks:
+            yield from format_paragraphs(chunk, max_width, line_indexes, cache, format_fn)
+        return
+    initargs = None if cache is None else (cache.max_entries, cache.max_bytes)
+    # The latest statistics of each worker process's cache, by process id
+    worker_stats: Dict[int, Dict[str, int]] = {}
+
+    def result(future: 'concurrent.futures.Future[WorkerResult]') -> List[str]:
+        """The formatted paragraphs from future, keeping its worker's statistics."""
+        formatted, stats = future.result()
+        if stats is not None:
+            worker_stats[stats[0]] = stats[1]
+        return formatted
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(initargs,)
+        ) as executor:
+            pending: Deque['concurrent.futures.Future[WorkerResult]'] = collections.deque()
+            for chunk in itertools.chain(first_chunks, chunks):
+                pending.append(
+                    executor.submit(format_paragraphs_in_worker, chunk, max_width, line_indexes, format_fn)
+                )
+                if len(pending) >= 2 * workers:
+                    yield from result(pending.popleft())
+            while pending:
+                yield from result(pending.popleft())
+    finally:
+        if cache is not None:
+            for stats in worker_stats.values():
+                cache.add_worker_stats(stats)
+
+
+def chunk_paragraphs(paragraphs: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    """Group paragraphs into lists of about chunk_size characters."""
+    chunk: List[str] = []
+    chunk_len = 0
+    for para in paragraphs:
+        chunk.append(para)
+        chunk_len += len(para)
+        if chunk_len >= chunk_size:
+            yield chunk
+            chunk = []
+            chunk_len = 0
+    if chunk:
+        yield chunk
+
+
+# The LayoutCache of a worker process of format_paragraphs_parallel
+worker_cache: Optional[LayoutCache] = None
+
+
+def init_worker(cache_args: Optional[Tuple[int, Optional[int]]]) -> None:
+    """Initialize a worker process of format_paragraphs_parallel."""
+    global worker_cache  # pylint: disable=global-statement
+    worker_cache = None if cache_args is None else LayoutCache(*cache_args)
+    instrument(None)  # the sinks are the parent process's
+
+
+# The formatted paragraphs from a worker process, and its process id
+# and cache statistics (if it has a cache)
+WorkerResult = Tuple[List[str], Optional[Tuple[int, Dict[str, int]]]]
+
+
+def format_paragraphs_in_worker(
+    paragraphs: Iterable[str],
+    max_width: int,
+    line_indexes: LineIndexesFn,
+    format_fn: Optional[FormatParagraphFn] = None,
+) -> WorkerResult:
+    """Format each paragraph in a worker process of format_paragraphs_parallel."""
+    formatted = format_paragraphs(paragraphs, max_width, line_indexes, worker_cache, format_fn)
+    return formatted, None if worker_cache is None else (os.getpid(), worker_cache.stats())
+
+
+def format_paragraphs(
+    paragraphs: Iterable[str],
+    max_width: int,
+    line_indexes: LineIndexesFn = optimal_line_breaks,
+    cache: Optional[LayoutCache] = None,
+    format_fn: Optional[FormatParagraphFn] = None,
+) -> List[str]:
+    """Format each paragraph (with format_fn, by default format_paragraph)."""
+    if format_fn is None:
+        format_fn = format_paragraph
+    return [format_fn(para, max_width, line_indexes, cache) for para in paragraphs]
+
+
+def format_paragraph(
+    para: str,
+    max_width: int,
+    line_indexes: LineIndexesFn = optimal_line_breaks,
+    cache: Optional[LayoutCache] = None,
+    justify: bool = False,
+) -> str:
+    """Format a paragraph into lines of max_width, each line ending with a newline.
+
+    If justify, spaces are added between the words of each line but the
+    last, to make them max_width (see line_adjust.pad_lines_list).
+    """
+    lines = text_to_text_lines(line_indexes, para, max_width, cache=cache)
+    instr = INSTRUMENTATION
+    if instr is not None:
+        start_time = time.perf_counter()
+    if justify and lines:
+        formatted = ''.join(line + '\n' for line in line_adjust.pad_lines_list(lines, max_width))
     else:
-        for help in [
-                f'{sys.argv[0]} LINEWIDTH',
-                f'  Reads from standard input, formatting each',
-                f'  paragraph to LINEWIDTH characters']:
-            print(help, file=sys.stderr)
-        return 1
+        formatted = ''.join(' '.join(line) + '\n' for line in lines)
+    if instr is not None:
+        instr.add('time_render', time.perf_counter() - start_time)
+        instr.end_paragraph()
+    return formatted
+
+
+# A code fence (``` or ~~~) at the start of a line
+FENCE_RE = re.compile(r' {0,3}(?:```|~~~)')
+# The marker of a list item (and the spaces after it) at the start of a line
+LIST_ITEM_RE = re.compile(r'[ \t]*(?:[-*+\u2022]|\d{1,9}[.)])[ \t]+(?=\S)')
+# Indentation, including block quote markers
+INDENT_RE = re.compile(r'[ \t]*(?:>[ \t]*)*')
+
+
+def format_structured_paragraph(
+    para: str,
+    max_width: int,
+    line_indexes: LineIndexesFn = optimal_line_breaks,
+    cache: Optional[LayoutCache] = None,
+    keep_fitting: bool = False,
+) -> str:
+    """Format a paragraph (as format_paragraph), keeping its structure,
+    and its lines where they're already formatted:
+
+    - code (starting with a fence, see join_fenced_paragraphs, or with
+      all lines indented by 4 spaces or a tab) is kept as is;
+    - list items (lines starting with -, *, +, a bullet, or a number
+      followed by . or ), then a space) are formatted separately, with
+      their following lines indented to the item's text;
+    - if all lines have the same indentation (which can include >
+      block quote markers), it's kept, and the text is formatted to
+      the remaining width;
+    - the lines of an item or paragraph are kept if they're already
+      formatted as line_indexes would (or, if keep_fitting, if they
+      fit and are as few as possible - see check_layout).
+    """
+    lines = para.split('\n')
+    if FENCE_RE.match(lines[0]) or all(line.startswith(('    ', '\t')) for line in lines):
+        return para + '\n'
+    if cache is not None:
+        line_indexes = cache.wrap(line_indexes)
+    formatted: List[str] = []
+    if LIST_ITEM_RE.match(lines[0]):
+        for marker, item_lines in list_items(lines):
+            indent = ' ' * len(marker)
+            texts = [item_lines[0]]
+            keep = True
+            for line in item_lines[1:]:
+                keep = keep and line.startswith(indent) and not line[len(indent) : len(indent) + 1].isspace()
+                texts.append(line.strip())
+            formatted.extend(
+                reflow_lines(texts, marker, indent, max_width, line_indexes, keep_fitting, keep)
+            )
+    else:
+        indent = os.path.commonprefix([INDENT_RE.match(line).group() for line in lines])
+        formatted = reflow_lines(
+            [line[len(indent) :] for line in lines], indent, indent, max_width, line_indexes, keep_fitting
+        )
+    if INSTRUMENTATION is not None:
+        INSTRUMENTATION.end_paragraph()
+    return ''.join(line + '\n' for line in formatted)
+
+
+def list_items(lines: List[str]) -> Iterator[Tuple[str, List[str]]]:
+    """The marker (see LIST_ITEM_RE) and lines of each list item in lines
+    (the first of which must start with a marker), without the marker."""
+    marker = ''
+    item_lines: List[str] = []
+    for line in lines:
+        match = LIST_ITEM_RE.match(line)
+        if match:
+            if item_lines:
+                yield marker, item_lines
+            marker = match.group()
+            item_lines = [line[match.end() :]]
+        else:
+            item_lines.append(line)
+    if item_lines:
+        yield marker, item_lines
+
+
+def reflow_lines(
+    texts: List[str],
+    first_prefix: str,
+    prefix: str,
+    max_width: int,
+    line_indexes: LineIndexesFn,
+    keep_fitting: bool,
+    keep: bool = True,
+) -> List[str]:
+    """Format the words of texts (the lines of a paragraph, without
+    their prefixes) to max_width, with first_prefix before the first
+    line and prefix before the others (which must be the same width).
+
+    If keep, texts are kept if they're already formatted (see
+    format_structured_paragraph).
+    """
+    line_texts = [text.split() for text in texts]
+    words = VOCABULARY.words(list(itertools.chain.from_iterable(line_texts)))
+    width = max(max_width - display_width.text_width(prefix), 1)
+    breaks = None
+    if keep and all(text == ' '.join(text_words) for text, text_words in zip(texts, line_texts)):
+        starts = list(itertools.accumulate(map(len, line_texts[:-1]), initial=0))
+        fits, unique = check_layout(LineWidths(words, width), starts)
+        if fits and (unique or keep_fitting):
+            breaks = starts
+        elif fits:
+            breaks = [line[0] for line in line_indexes(words, width, 1)]
+            if breaks != starts:
+                breaks = None
+        if breaks is not None:
+            lines = texts
+            if INSTRUMENTATION is not None:
+                INSTRUMENTATION.add('kept_lines', len(lines))
+    if breaks is None:
+        lines = [' '.join([words[i].text for i in line]) for line in line_indexes(words, width, 1)]
+    return [(first_prefix if i == 0 else prefix) + line for i, line in enumerate(lines)]
+
 
+def check_layout(line_widths: LineWidths, starts: Sequence[int]) -> Tuple[bool, bool]:
+    """Whether the lines starting at starts fit, and are as few as
+    possible, and whether that's the only such layout.
 
-def split_paragraphs(text):
+    The lines are as few as possible if there are as many as for
+    line_by_line_starts, and each line starts in its slack (between
+    line_by_line_reversed_starts and line_by_line_starts). It's the
+    only such layout (and so the optimal one) if all the slacks are
+    single words.
+    """
+    if any(end <= start for start, end in zip(starts, starts[1:])):  # a line without words
+        return False, False
+    starts_fwd = line_by_line_starts(line_widths)
+    if len(starts) != len(starts_fwd):
+        return False, False
+    starts_bck = line_by_line_reversed_starts(line_widths)
+    if not all(bck <= start <= fwd for bck, start, fwd in zip(starts_bck, starts, starts_fwd)):
+        return False, False
+    sums = line_widths.sums
+    limit = line_widths.max_width + line_widths.space_width
+    ends = list(starts[1:])
+    ends.append(len(line_widths))
+    if not all(sums[end] - sums[start] <= limit for start, end in zip(starts, ends)):
+        return False, False
+    return True, starts_fwd == starts_bck
+
+
+def join_fenced_paragraphs(paragraphs: Iterable[str]) -> Iterator[str]:
+    """paragraphs, with those from one that starts with a code fence
+    (``` or ~~~) to the one that closes it joined into one (with a
+    blank line between them), for format_structured_paragraph.
+
+    (Several blank lines in a code block become one, as read_paragraphs
+    doesn't keep them.)
+    """
+    fenced: List[str] = []
+    for para in paragraphs:
+        odd_fences = sum(1 for line in para.split('\n') if FENCE_RE.match(line)) % 2 == 1
+        if fenced:
+            fenced.append(para)
+            if odd_fences:
+                yield '\n\n'.join(fenced)
+                fenced = []
+        elif odd_fences and FENCE_RE.match(para):
+            fenced = [para]
+        else:
+            yield para
+    if fenced:
+        yield '\n\n'.join(fenced)
+
+
+# Size of the output buffer for reflow_file
+REFLOW_BUFFER_SIZE = 1 << 20
+
+# The ASCII whitespace that str.split splits at (bytes' \s doesn't include \x1c-\x1f)
+WORD_RE = re.compile(rb'[^ \t\n\v\f\r\x1c-\x1f]+')
+NON_ASCII_RE = re.compile(rb'[\x80-\xff]')
+NON_SPACE_WHITESPACE_RE = re.compile(rb'[\t\n\v\f\r\x1c-\x1f]')
+# Words in decoded text (str's \s is the whitespace that str.split splits at)
+UNICODE_WORD_RE = re.compile(r'\S+')
+
+
+def reflow_file(
+    input_path: str,
+    output_path: str,
+    max_width: int,
+    line_starts: LineStartsFn = optimal_line_starts,
+    space_width=1,
+) -> None:
+    """Format each paragraph in a (UTF-8) file, writing to another file.
+
+    This gives the same output as format_stream, but is meant for
+    large files: the input is memory-mapped and the words of ASCII
+    paragraphs are found in it without creating str's for the
+    paragraphs or words (other paragraphs are decoded, to split them
+    at the same whitespace, e.g., U+00A0 or U+3000); the output goes
+    through one large buffer.
+    """
+    check_max_width(max_width)
+    with open(input_path, 'rb') as infile, open(
+        output_path, 'wb', buffering=REFLOW_BUFFER_SIZE
+    ) as outfile:
+        if os.fstat(infile.fileno()).st_size == 0:
+            return  # mmap doesn't allow an empty file
+        with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            reflow_buffer(buffer, outfile, max_width, line_starts, space_width)
+
+
+def reflow_buffer(
+    buffer: Any,
+    outfile: BinaryIO,
+    max_width: int,
+    line_starts: LineStartsFn = optimal_line_starts,
+    space_width=1,
+) -> None:
+    """Format each paragraph in buffer (bytes-like, UTF-8), writing to outfile."""
+    check_max_width(max_width)
+    view = memoryview(buffer)
+    instr = INSTRUMENTATION
+    with LineRenderer(outfile) as renderer:
+        para_break = b''
+        for para_start, para_end in buffer_paragraphs(buffer):
+            if instr is not None:
+                start_time = time.perf_counter()
+            if NON_ASCII_RE.search(buffer, para_start, para_end):
+                spans, widths = unicode_word_spans(view, para_start, para_end)
+                word_starts = [start for start, _ in spans]
+                word_ends = [end for _, end in spans]
+            else:
+                spans = [match.span() for match in WORD_RE.finditer(buffer, para_start, para_end)]
+                word_starts = [start for start, _ in spans]
+                word_ends = [end for _, end in spans]
+                widths = list(map(operator.sub, word_ends, word_starts))
+            if instr is not None:
+                tokenize_time = time.perf_counter()
+            starts = line_starts(LineWidths.from_widths(widths, max_width, space_width))
+            if instr is not None:
+                layout_time = time.perf_counter()
+            renderer.write(para_break)
+            para_break = b'\n'
+            renderer.write_lines(buffer, word_starts, word_ends, starts)
+            if instr is not None:
+                instr.add('time_tokenize', tokenize_time - start_time)
+                instr.add('time_layout', layout_time - tokenize_time)
+                instr.add('time_render', time.perf_counter() - layout_time)
+                instr.add('words', len(spans))
+                instr.add('lines', len(starts))
+                instr.end_paragraph()
+
+
+def unicode_word_spans(view: memoryview, start: int, end: int) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """The (start, end) offsets of the words in view[start:end] (UTF-8),
+    split at any Unicode whitespace (e.g., U+00A0 or U+3000) as
+    split_text splits the decoded text, and their widths (word_width).
+
+    Invalid UTF-8 is decoded with surrogateescape, so that the offsets are
+    those of the bytes (but the words are measured as decoded with replace).
+    """
+    text = str(view[start:end], 'utf-8', 'surrogateescape')
+    spans = []
+    widths = []
+    pos = start  # offset of text[text_pos]
+    text_pos = 0
+    for match in UNICODE_WORD_RE.finditer(text):
+        word_start = pos + len(text[text_pos : match.start()].encode('utf-8', 'surrogateescape'))
+        word = match.group().encode('utf-8', 'surrogateescape')
+        pos = word_start + len(word)
+        text_pos = match.end()
+        spans.append((word_start, pos))
+        widths.append(word_width(str(word, 'utf-8', 'replace')))
+    return spans, widths
+
+
+class LineRenderer:
+    """Writes lines of words, given by their offsets in a buffer, to a
+    binary file - ragged right, with a space between words and a
+    newline after each line.
+
+    The bytes are copied from the buffer into an output buffer (of
+    buffer_size) with memoryview slices, and the output buffer is
+    written to outfile when it's full, so no bytes or str objects are
+    created for the words or lines. If the words of a line are
+    separated by single whitespace characters in the buffer (as in
+    most text), the line is copied with a single slice, and any of
+    those characters that isn't a space (e.g., a newline) is then
+    replaced by a space.
+
+    Use as a context manager (or call flush at the end).
+    """
+
+    def __init__(self, outfile: BinaryIO, buffer_size: int = REFLOW_BUFFER_SIZE) -> None:
+        self.outfile = outfile
+        self.out = bytearray(buffer_size)
+        self.out_view = memoryview(self.out)
+        self.pos = 0
+
+    def __enter__(self) -> 'LineRenderer':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.flush()
+
+    def flush(self) -> None:
+        """Write what's in the output buffer to outfile."""
+        if self.pos:
+            self.outfile.write(self.out_view[: self.pos])
+            self.pos = 0
+
+    def write(self, data: bytes) -> None:
+        """Output data (e.g., a blank line between paragraphs)."""
+        if self.pos + len(data) > len(self.out):
+            self.flush()
+            if len(data) > len(self.out):
+                self.outfile.write(data)
+                return
+        self.out[self.pos : self.pos + len(data)] = data
+        self.pos += len(data)
+
+    def write_lines(
+        self, buffer: Any, word_starts: Sequence[int], word_ends: Sequence[int], line_starts: Sequence[int]
+    ) -> None:
+        """Output lines of words from buffer (bytes-like).
+
+        The i-th word is buffer[word_starts[i]:word_ends[i]], and
+        line_starts has the index of the first word of each line (as
+        from a LineStartsFn).
+        """
+        view = memoryview(buffer)
+        out = self.out
+        out_view = self.out_view
+        out_size = len(out)
+        pos = self.pos
+        # byte_sums[i]: length of words[:i], each followed by a space
+        byte_sums = list(itertools.accumulate(map(operator.sub, word_ends, word_starts), initial=0))
+        line_ends = list(itertools.islice(line_starts, 1, None))
+        line_ends.append(len(word_starts))
+        # Whitespace that isn't a space, to be replaced where lines are
+        # copied with a single slice (in order, with a sentinel)
+        replace = []
+        if word_starts:
+            replace = [
+                match.start()
+                for match in NON_SPACE_WHITESPACE_RE.finditer(buffer, word_starts[0], word_ends[-1])
+            ]
+        replace.append(len(buffer))
+        replace_i = 0
+        for first, end in zip(line_starts, line_ends):
+            if first == end:  # no words (e.g., an empty paragraph)
+                line_len = 0
+            else:
+                src_start = word_starts[first]
+                src_end = word_ends[end - 1]
+                line_len = byte_sums[end] - byte_sums[first] + (end - first - 1)
+            if pos + line_len + 1 > out_size:
+                self.pos = pos
+                self.flush()
+                pos = 0
+                if line_len + 1 > out_size:
+                    self.write_long_line(view, word_starts, word_ends, first, end)
+                    continue
+            if first == end:
+                pass
+            elif src_end - src_start == line_len:
+                # single whitespace characters between the words
+                out_view[pos : pos + line_len] = view[src_start:src_end]
+                while replace[replace_i] < src_end:
+                    if replace[replace_i] > src_start:
+                        out[pos + replace[replace_i] - src_start] = 0x20  # ' '
+                    replace_i += 1
+            else:
+                word_pos = pos
+                for i in range(first, end):
+                    word_len = word_ends[i] - word_starts[i]
+                    out_view[word_pos : word_pos + word_len] = view[word_starts[i] : word_ends[i]]
+                    word_pos += word_len
+                    out[word_pos] = 0x20  # ' ' (overwritten by the newline after the last word)
+                    word_pos += 1
+            pos += line_len
+            out[pos] = 0x0A  # '\n'
+            pos += 1
+        self.pos = pos
+
+    def write_long_line(
+        self, view: memoryview, word_starts: Sequence[int], word_ends: Sequence[int], first: int, end: int
+    ) -> None:
+        """Output a line that's longer than the output buffer directly to outfile."""
+        for i in range(first, end):
+            if i > first:
+                self.outfile.write(b' ')
+            self.outfile.write(view[word_starts[i] : word_ends[i]])
+        self.outfile.write(b'\n')
+
+
+def buffer_paragraphs(buffer: Any) -> Iterator[Tuple[int, int]]:
+    """Find the paragraphs in buffer (bytes-like), as split_paragraphs does.
+
+    Yields the (start, end) offsets of each paragraph.
+    """
+    size = len(buffer)
+    pos = 0
+    while True:
+        while pos < size and buffer[pos : pos + 1] == b'\n':
+            pos += 1
+        if pos >= size:
+            return
+        end = buffer.find(b'\n\n', pos)
+        if end < 0:
+            yield pos, size
+            return
+        yield pos, end
+        pos = end + 2
+
+
+def split_paragraphs(text: str) -> Iterator[str]:
     """Split text into an iterator of paragraphs. Assumes Unix-style lines."""
+    return read_paragraphs(text.split('\n'))
+
 
-    para = []
-    for line in text.split('\n'):
-        if line == '':
+def read_paragraphs(lines: Iterable[str]) -> Iterator[str]:
+    """Split lines (e.g., from a file) into an iterator of paragraphs.
+
+    Each paragraph is yielded as soon as the blank line that ends it
+    has been read, so only one paragraph is held in memory at a time.
+    The lines may end with a newline. Assumes Unix-style lines.
+    """
+    para: List[str] = []
+    for line in lines:
+        if line == '' or line == '\n':
             if para:
                 yield '\n'.join(para)
             para = []
         else:
-            para.append(line)
+            para.append(line[:-1] if line.endswith('\n') else line)
     if para:
         yield '\n'.join(para)
 